@@ -1,35 +1,75 @@
 # -*- coding: utf-8 -*-
 # AutoVPN Switcher - 专业托盘版
-# 依赖: pip install pystray pillow
+# 依赖: pip install pystray pillow（仅图形界面需要，--headless / 命令行模式不加载）
 
-import tkinter as tk
-from tkinter import messagebox, scrolledtext
-import subprocess
 import time
+_T0 = time.perf_counter()  # 启动基准测试用：模块开始加载的时间
+
+# argparse、concurrent.futures、hashlib/hmac、http.server 等只在用到的命令或组件里导入
+import subprocess
 import threading
-import urllib.request
+import queue
+import atexit
+import urllib.parse
+import http.client
 import json
 import os
 import sys
+import socket
+import struct
+import shutil
+import stat
+import re
+import random
+import fnmatch
+import bisect
+import itertools
+import collections
 from datetime import datetime
-import pystray
-from PIL import Image
 import ctypes
-import winreg
+import types
 
-# 全局互斥句柄（仅 Windows 有效）
+# 全局互斥句柄（Windows 为互斥体，其他系统为加了 flock 的锁文件）
 _mutex_handle = None
 
+def private_dir(path):
+    """确保 path 是只有当前用户能访问的目录（不存在时以 0700 创建），否则抛出 OSError"""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} 不是当前用户私有的目录")
+    return path
+
+
 def acquire_mutex(name="AutoVPN_Mutex_01"):
+    """获取单实例锁；已有实例在运行，或锁文件无法安全打开时返回 False（拒绝启动）"""
     global _mutex_handle
     if sys.platform != "win32":
+        import fcntl
+        path = CONTROL_ADDRESS + ".lock"
+        try:
+            private_dir(os.path.dirname(path))
+            # 不跟随符号链接：锁文件被换成指向别处的链接时打开失败
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            log(f"E 无法打开单实例锁 {path}: {e}")
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        _mutex_handle = fd
         return True
     try:
         kernel32 = ctypes.windll.kernel32
         # CreateMutexW 返回句柄，若已存在，可通过 GetLastError 判断
         handle = kernel32.CreateMutexW(None, False, ctypes.c_wchar_p(name))
         if not handle:
-            return True
+            return False
         last = kernel32.GetLastError()
         ERROR_ALREADY_EXISTS = 183
         if last == ERROR_ALREADY_EXISTS:
@@ -47,6 +87,9 @@ def acquire_mutex(name="AutoVPN_Mutex_01"):
 def release_mutex():
     global _mutex_handle
     if sys.platform != "win32":
+        if _mutex_handle is not None:
+            os.close(_mutex_handle)  # 关闭即释放 flock
+            _mutex_handle = None
         return
     try:
         if _mutex_handle:
@@ -66,16 +109,69 @@ def get_base_path():
 BASE_PATH = get_base_path()
 CONFIG_FILE = os.path.join(BASE_PATH, "autovpn_config.json")
 LOG_FILE = os.path.join(BASE_PATH, "autovpn.log")
+STATE_FILE = os.path.join(BASE_PATH, "autovpn_state.json")  # 上次的网络指纹与已应用模式
+JOURNAL_DIR = os.path.join(BASE_PATH, "journal")             # 结构化事件日志（分段文件 + 索引）
 ICON_PNG = os.path.join(BASE_PATH, "icon.png")  # 可选：放一个 64x64 PNG 图标
 ICON_ICO = os.path.join(BASE_PATH, "icon.ico")  # 优先使用 ico（用于窗口与托盘）
+# 本机控制通道：Windows 为命名管道，其他系统为 Unix 套接字（旁边的 .lock 文件兼作单实例锁）
+if sys.platform == "win32":
+    CONTROL_ADDRESS = r"\\.\pipe\AutoVPN-" + os.environ.get("USERNAME", "")
+else:
+    # 没有 XDG_RUNTIME_DIR 时不直接放在所有人可写的 /tmp 下，而是放进 acquire_mutex 以 0700 创建的私有目录
+    RUNTIME_DIR = os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/autovpn-{os.getuid()}"
+    CONTROL_ADDRESS = os.path.join(RUNTIME_DIR, f"autovpn-{os.getuid()}.sock")
 
 DEFAULT_CONFIG = {
     "rules": [
         {"ssids": "公司WiFi,Office-5G", "mode": "Direct"},
         {"ssids": "*", "mode": "Rule"}
     ],
-    "api_url": "http://127.0.0.1:9090/configs",
+    "api_url": "http://127.0.0.1:9090/configs",  # 多个控制器可写成列表，同时切换
+    "api_retries": 1,          # 每个控制器切换失败时的重试次数
+    "drift_check": True,       # 检测并恢复在 Clash 界面被手动改掉的模式
+    "drift_interval": 5,       # 漂移检测间隔（秒）
+    "cutover": False,          # 切到直连后关闭仍走代理的连接并清空 fake-ip/DNS 缓存
+    "cutover_modes": ["Direct"],
+    "cutover_filters": [],     # 只关闭链路/规则名匹配的连接，空表示所有走代理的连接
+    # 规则可带 "group": "代理组名"，连上该网络时测速并把该组切到延迟最低的节点
+    "group_probe_url": "http://www.gstatic.com/generate_204",
+    "group_probe_timeout": 2.0,  # 单个节点测速超时（秒）
+    "group_deadline": 3.0,       # 一次测速的总时限（秒），超时未返回的节点视为不可用
+    "group_cache_ttl": 1800,     # 同一网络的测速结果缓存时间（秒），期间重连不再测速
+    "metrics": False,          # 收集运行指标
+    "metrics_port": 9797,      # 本机指标接口端口（/metrics、/metrics.json），0 表示不开接口
+    "connect_timeout": 1.0,    # 连接 Clash API 超时（秒）
+    "request_timeout": 3.0,    # 单次请求超时（秒）
     "interval": 15,
+    "fast_interval": 2,        # 网络变化或切换失败后的快速检查间隔（秒）
+    "max_interval": 60,        # 网络稳定时逐步放慢到的最长间隔（秒）
+    "max_backoff": 300,        # Clash API 连不上时退避的最长间隔（秒）
+    "event_watch": True,       # 监听系统网络变化事件，变化时立即检查
+    "watch_interval": 120,     # 事件监听可用时的兜底轮询间隔（秒）
+    "power_watch": True,       # 监听休眠/唤醒，唤醒后立即重新判断
+    "resume_jump": 10,         # 墙钟比 monotonic 多走超过此秒数时视为刚从休眠中恢复
+    "ssid_provider": "auto",   # auto/wlanapi/netsh/proc/nmcli/iw
+    "ssid_helper": "",         # 可选：常驻辅助进程命令，逐行应答 SSID 查询
+    "fingerprint": True,       # 读取 BSSID、默认网关 MAC 和出口接口类型，供 bssid:/gw:/iface: 规则使用
+    "probe_timeout": 0.8,      # 规则中 dns:/tcp:/http:// 探测项的单项超时（秒）
+    "probe_budget": 0.3,       # 每轮检查最多为探测等待的秒数，未完成的在后台继续，成功后立即重新判断
+    "probe_ttl": 300,          # 同一网络的探测结果缓存时间（秒）
+    "hot_reload": True,        # 监视配置文件，规则和轮询间隔修改后无需重启监控
+    "persist_state": True,     # 记住上次的网络和模式，启动时一致则只确认不切换
+    "boot_grace": 60,          # 启动后多少秒内 Clash 连不上时按快速间隔重试，不做指数退避
+    "debounce": True,          # 网络来回跳变时抑制频繁切换
+    "stable_window": 10,       # 切到非直连模式前，目标需持续不变的秒数
+    "max_switches": 6,         # switch_window 秒内最多切换次数（切到直连不受限）
+    "switch_window": 300,
+    "immediate_modes": ["Direct"],  # 切入这些模式不等待
+    "log_view_lines": 2000,    # 日志窗口最多显示的行数
+    "journal": True,           # 记录结构化事件日志，日志窗口可按时间、SSID、模式、错误检索
+    "journal_segments": 100,   # 事件日志最多保留的分段数（每段 50000 条）
+    "control": True,           # 开启本机控制通道，脚本可用 ctl 命令查询状态、强制模式、重新加载
+    "rules_url": "",           # 集中下发的规则文档：http(s) 地址或共享文件路径，空表示只用本地规则
+    "rules_key": "",           # 可选：规则文档的 HMAC-SHA256 签名密钥，设置后只接受签名正确的文档
+    "rules_refresh": 3600,     # 集中规则的拉取间隔（秒），实际间隔在 ±rules_jitter 比例内随机浮动
+    "rules_jitter": 0.1,
     "autostart": False
 }
 
@@ -98,630 +194,4260 @@ def load_config():
             print(f"配置文件加载失败: {e}")
     return DEFAULT_CONFIG.copy()
 
-def save_config(config):
+def _write_json_atomic(path, data):
+    """先写同目录临时文件再改名替换，读取方不会看到写了一半的内容"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def save_config(config, path=None):
     try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        _write_json_atomic(path or CONFIG_FILE, config)
         return True
     except:
         return False
 
-def log(msg, widget=None):
-    ts = datetime.now().strftime("%H:%M:%S")
-    line = f"[{ts}] {msg}\n"
-    if widget and widget.winfo_exists():
-        widget.insert(tk.END, line)
-        widget.see(tk.END)
-    print(line.strip())
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(line)
-        trim_log_file()
-    except:
-        pass
 
-def trim_log_file(max_lines=1000):
-    """保留最近 1000 行日志"""
+def load_state(path=None):
+    """读取上次保存的决策状态，不存在或损坏时返回空字典"""
     try:
-        if not os.path.exists(LOG_FILE):
-            return
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        if len(lines) > max_lines:
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                f.writelines(lines[-max_lines:])
-    except:
-        pass
+        with open(path or STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
 
-def get_ssid():
-    try:
-        creation_flags = 0
-        if sys.platform == 'win32':
-            creation_flags = subprocess.CREATE_NO_WINDOW
-        result = subprocess.run(
-            ["netsh", "wlan", "show", "interfaces"],
-            capture_output=True, text=True, encoding="utf-8", errors="replace",
-            creationflags=creation_flags
-        )
-        for line in result.stdout.splitlines():
-            line = line.strip()
-            if line.startswith("SSID") and ":" in line:
-                ssid = line.split(":", 1)[1].strip()
-                ssid = ''.join(c for c in ssid if ord(c) < 0x10000)
-                return ssid if ssid and not ssid.startswith("BSSID") else None
-        return None
-    except:
-        return None
 
-def set_clash_mode(mode, api_url):
-    data = json.dumps({"mode": mode}).encode("utf-8")
-    req = urllib.request.Request(api_url, data=data, method="PATCH")
-    req.add_header("Content-Type", "application/json")
+def save_state(state, path=None):
     try:
-        with urllib.request.urlopen(req, timeout=3) as resp:
-            return resp.status == 204, f"模式切换: {mode}"
-    except Exception as e:
-        return False, f"连接失败: {e}"
-
-def match_rule(ssid, rules):
-    """返回匹配的 mode，或 None"""
-    if not ssid:
-        ssid = ""
-    ssid_lower = ssid.lower()
-    for rule in rules:
-        ssids = [s.strip().lower() for s in rule["ssids"].split(",")]
-        if "*" in ssids or any(s in ssid_lower for s in ssids if s):
-            return rule["mode"]
-    return None
+        _write_json_atomic(path or STATE_FILE, state)
+        return True
+    except OSError:
+        return False
 
-def monitor_loop(rules, api, interval, log_widget, stop_event, status_callback, mode_callback):
-    last_ssid = None
-    current_mode = None
-    log("监控已启动", log_widget)
-    status_callback("运行中", "#27ae60")
+class LogWriter:
+    """后台日志写入：日志行先进队列，由写线程批量追加，超出行数或大小时轮转为 .1/.2…，不再回读整个文件"""
 
-    while not stop_event.is_set():
-        try:
-            ssid = get_ssid()
+    def __init__(self, path, max_lines=1000, max_bytes=1024 * 1024, backups=1, flush_interval=1.0):
+        self.path = path
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self._file = None
+        self._lines = 0
+        self._bytes = 0
+        self.failures = 0       # 写入失败（丢弃）的批次数
+        self.last_error = None  # 最近一次写入失败的原因
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-            if ssid != last_ssid:
-                log(f"WiFi: {ssid or '未连接'}", log_widget)
-                last_ssid = ssid
+    def write(self, line):
+        self.queue.put(line)
 
-            target = match_rule(ssid, rules) or "Rule"
+    def flush(self, timeout=5):
+        """等待队列中已有的日志写入磁盘；写线程已退出（已关闭）时直接返回 False"""
+        if not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
 
-            if target != current_mode:
-                ok, msg = set_clash_mode(target, api)
-                log(f"{'成功' if ok else '失败'} {msg}", log_widget)
-                if ok:
-                    current_mode = target
-                    mode_callback(current_mode, False)
+    def close(self, timeout=5):
+        self.queue.put(None)
+        self._thread.join(timeout)
 
-            stop_event.wait(interval)
-        except Exception as e:
-            log(f"E 监控错误: {e}", log_widget)
-            stop_event.wait(interval)
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._bytes = self._file.tell()
+        self._lines = 0
+        if self._bytes:
+            # 只在打开时统计一次已有行数
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    self._lines += chunk.count(b"\n")
 
-    log("监控已停止", log_widget)
-    status_callback("已停止", "#95a5a6")
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups, 0, -1):
+            src = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i}")
+        self._open()
 
-# ==================== 托盘 & 热键 ====================
-def set_autostart(enable):
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run", 0, winreg.KEY_SET_VALUE)
-        if enable:
-            winreg.SetValueEx(key, "AutoVPN", 0, winreg.REG_SZ, f'"{sys.executable}"')
-        else:
+    def _write_batch(self, batch):
+        while batch:
+            if self._file is None:
+                self._open()
+            # 一批内容跨过轮转阈值时拆开写
+            room = max(1, self.max_lines - self._lines)
+            chunk, batch = batch[:room], batch[room:]
+            text = "".join(chunk)
+            self._file.write(text)
+            self._file.flush()
+            self._lines += len(chunk)
+            self._bytes += len(text.encode("utf-8"))
+            if self._lines >= self.max_lines or self._bytes >= self.max_bytes:
+                self._rotate()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            # 收集一个刷新周期内的所有日志行后一次写入
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=left)
+                except queue.Empty:
+                    break
             try:
-                winreg.DeleteValue(key, "AutoVPN")
-            except:
-                pass
-        winreg.CloseKey(key)
-    except:
-        pass
+                self._write_batch(batch)
+            except Exception as e:
+                # 丢弃这一批，关闭文件后下一批重新打开（磁盘满、文件被删等）
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                if _metrics:
+                    _metrics.inc("autovpn_log_write_failures_total")
+                if self._file:
+                    try:
+                        self._file.close()
+                    except OSError:
+                        pass
+                self._file = None
+            for w in waiters:
+                w.set()
+            if stop:
+                if self._file:
+                    self._file.close()
+                return
 
-class App:
-    def __init__(self, root):
-        self.root = root
-        self.config = load_config()
-        self.thread = None
-        self.stop_event = threading.Event()
-        self.log_window = None
 
-        root.title("AutoVPN 切换器")
-        root.geometry("400x500")
-        root.minsize(380, 240)
-        root.resizable(True, True)
-        root.configure(bg="#f5f7fa")
+class EventJournal(LogWriter):
+    """结构化事件日志：记录以 JSON 行追加到分段文件（每段 segment_records 条），复用 LogWriter 的批量写线程。
 
-        # 尝试加载目录下的 ico 优先作为窗口图标，若没有则尝试 png
-        try:
-            if os.path.exists(ICON_ICO):
+    每段按 block 条记录分块建索引：块在文件中的偏移、时间范围，以及 INDEX_FIELDS 各字段出现过的值。
+    查询时先用索引跳过不相关的段和块，只读取并解析可能命中的块，结果惰性产出，可以一页一页地取。
+    写满的段在封存时把索引写入 .idx 文件；最后一段启动时重新扫描一次。
+    """
+    INDEX_FIELDS = ("kind", "level", "ssid", "mode")
+
+    def __init__(self, directory, segment_records=50000, max_segments=100, block=256, flush_interval=0.5):
+        self.directory = directory
+        self.max_segments = max_segments
+        self.block = block
+        self.segments = []  # [{"seq", "count", "size", "t0", "t1", "blocks": [[偏移, t0, t1, 条数, {字段: 值集合}]]}]
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+        super().__init__(self._segment_path(self.segments[-1]["seq"]), max_lines=segment_records,
+                         max_bytes=float("inf"), flush_interval=flush_interval)
+
+    # ---- 文件与索引 ----
+    def _segment_path(self, seq, ext="jsonl"):
+        return os.path.join(self.directory, f"{seq:06d}.{ext}")
+
+    def _load_index(self):
+        seqs = sorted(int(name[:6]) for name in os.listdir(self.directory)
+                      if name.endswith(".jsonl") and name[:6].isdigit())
+        for i, seq in enumerate(seqs):
+            seg = None
+            if i < len(seqs) - 1:
                 try:
-                    root.iconbitmap(ICON_ICO)
-                except:
-                    pass
-            elif os.path.exists(ICON_PNG):
+                    with open(self._segment_path(seq, "idx"), "r", encoding="utf-8") as f:
+                        seg = json.load(f)
+                    for blk in seg["blocks"]:
+                        blk[4] = {k: set(v) for k, v in blk[4].items()}
+                except (OSError, ValueError, KeyError, IndexError):
+                    seg = None
+            self.segments.append(seg or self._scan_segment(seq))
+        if not self.segments:
+            self.segments.append(self._new_segment(1))
+
+    def _new_segment(self, seq):
+        return {"seq": seq, "count": 0, "size": 0, "t0": None, "t1": None, "blocks": []}
+
+    def _scan_segment(self, seq):
+        """没有索引文件（或最后一段）时扫描一遍重建；末尾不完整的行丢弃"""
+        seg = self._new_segment(seq)
+        path = self._segment_path(seq)
+        with open(path, "rb") as f:
+            offset = 0
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
                 try:
-                    self._icon_photo = tk.PhotoImage(file=ICON_PNG)
-                    root.iconphoto(False, self._icon_photo)
-                except:
+                    self._index_record(seg, json.loads(raw), offset)
+                except ValueError:
                     pass
-        except:
+                offset += len(raw)
+        seg["size"] = offset
+        if os.path.getsize(path) != offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return seg
+
+    def _index_record(self, seg, rec, offset):
+        t = rec.get("t", 0)
+        blocks = seg["blocks"]
+        if not blocks or blocks[-1][3] >= self.block:
+            blocks.append([offset, t, t, 0, {k: set() for k in self.INDEX_FIELDS}])
+        blk = blocks[-1]
+        blk[1] = min(blk[1], t)
+        blk[2] = max(blk[2], t)
+        blk[3] += 1
+        for key in self.INDEX_FIELDS:
+            value = rec.get(key)
+            if value is not None:
+                blk[4][key].add(value)
+        seg["count"] += 1
+        seg["t0"] = t if seg["t0"] is None else min(seg["t0"], t)
+        seg["t1"] = t if seg["t1"] is None else max(seg["t1"], t)
+
+    def _save_index(self, seg):
+        data = dict(seg, blocks=[b[:4] + [{k: sorted(v, key=str) for k, v in b[4].items()}] for b in seg["blocks"]])
+        try:
+            _write_json_atomic(self._segment_path(seg["seq"], "idx"), data)
+        except OSError:
             pass
 
-        # 设置窗口权重，使内容自适应
-        root.grid_rowconfigure(0, weight=1)
-        root.grid_columnconfigure(0, weight=1)
-
-        self._create_ui()
-        self.setup_tray()
-        self.load_autostart()
-
-    def _create_ui(self):
-        # 主容器使用网格布局
-        main_container = tk.Frame(self.root, bg="#f5f7fa")
-        main_container.grid(row=0, column=0, sticky="nsew", padx=0, pady=0)
-        main_container.grid_rowconfigure(0, weight=0)  # 头部
-        main_container.grid_rowconfigure(1, weight=0)  # 状态
-        main_container.grid_rowconfigure(2, weight=0)  # 按钮
-        main_container.grid_rowconfigure(3, weight=1)  # 空白
-        main_container.grid_columnconfigure(0, weight=1)
-
-        self._create_header(main_container)
-        self._create_status_section(main_container)
-        self._create_buttons(main_container)
-
-    def _create_header(self, parent):
-        header = tk.Frame(parent, bg="#2c3e50", height=110)
-        header.grid(row=0, column=0, sticky="ew", padx=0, pady=0)
-        header.grid_columnconfigure(0, weight=1)
-        header.pack_propagate(False)
-        
-        inner = tk.Frame(header, bg="#2c3e50")
-        inner.pack(expand=True, fill="both")
-        
-        tk.Label(inner, text="⚔️", font=("Segoe UI Emoji", 36), bg="#2c3e50", fg="white").pack(pady=(8, 0))
-        tk.Label(inner, text="VPN 切换器", font=("Microsoft YaHei UI", 18, "bold"), bg="#2c3e50", fg="white").pack(pady=(2, 0))
-        tk.Label(inner, text="智能多策略 VPN 切换系统", font=("Microsoft YaHei UI", 9), bg="#2c3e50", fg="#bdc3c7").pack(pady=(0, 8))
-
-    def _create_status_section(self, parent):
-        frame = tk.Frame(parent, bg="#ffffff", highlightbackground="#dfe4ea", highlightthickness=1)
-        frame.grid(row=1, column=0, sticky="ew", padx=15, pady=(15, 15))
-        frame.grid_columnconfigure(0, weight=1)
-        
-        inner = tk.Frame(frame, bg="#ffffff")
-        inner.pack(fill="both", expand=False, padx=15, pady=12)
-        
-        # 状态行
-        status_row = tk.Frame(inner, bg="#ffffff")
-        status_row.pack(fill="x", padx=0, pady=(0, 8))
-        tk.Label(status_row, text="运行状态:", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(side="left", padx=(0, 10))
-        self.status_label = tk.Label(status_row, text="未启动", font=("Microsoft YaHei UI", 11, "bold"), bg="#ffffff", fg="#95a5a6")
-        self.status_label.pack(side="left", fill="x", expand=True)
-        
-        # 模式行
-        mode_row = tk.Frame(inner, bg="#ffffff")
-        mode_row.pack(fill="x", padx=0, pady=(0, 0))
-        tk.Label(mode_row, text="当前模式:", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(side="left", padx=(0, 10))
-        self.mode_label = tk.Label(mode_row, text="--", font=("Microsoft YaHei UI", 11, "bold"), bg="#ffffff", fg="#2c3e50")
-        self.mode_label.pack(side="left", fill="x", expand=True)
-
-    def _create_buttons(self, parent):
-        frame = tk.Frame(parent, bg="#f5f7fa")
-        frame.grid(row=2, column=0, sticky="ew", padx=15, pady=(0, 15))
-        frame.grid_columnconfigure(0, weight=1)
-        
-        btn_inner = tk.Frame(frame, bg="#f5f7fa")
-        btn_inner.pack(expand=False, pady=10, fill="x")
-        
-        # 使用 grid 布局使按钮能自适应换行
-        btn_frame = tk.Frame(btn_inner, bg="#f5f7fa")
-        btn_frame.pack(fill="x")
-        btn_frame.grid_columnconfigure(0, weight=1)
-        btn_frame.grid_columnconfigure(1, weight=1)
-        btn_frame.grid_columnconfigure(2, weight=1)
-        btn_frame.grid_columnconfigure(3, weight=1)
-        
-        tk.Button(btn_frame, text="▶ 启动", command=self.start, bg="#27ae60", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=0, padx=4, pady=2, sticky="ew")
-        tk.Button(btn_frame, text="⏹ 停止", command=self.stop, bg="#e74c3c", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=1, padx=4, pady=2, sticky="ew")
-        tk.Button(btn_frame, text="⚙ 设置", command=self.open_settings, bg="#3498db", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=2, padx=4, pady=2, sticky="ew")
-        tk.Button(btn_frame, text="📋 日志", command=self.open_log_window, bg="#9b59b6", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=3, padx=4, pady=2, sticky="ew")
-
-    def update_status(self, text, color):
-        if self.status_label.winfo_exists():
-            self.root.after(0, lambda: self.status_label.config(text=f"{text}", fg=color))
-
-    def update_mode(self, mode, is_silent=False):
-        if self.mode_label.winfo_exists():
-            self.root.after(0, lambda: self.mode_label.config(text=f"模式: {mode}"))
+    # ---- LogWriter 扩展点 ----
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._lines = self.segments[-1]["count"]
+        self._bytes = self._file.tell()
 
-    def start(self):
-        if self.thread and self.thread.is_alive():
-            messagebox.showinfo("提示", "监控已在运行")
-            return
+    def _rotate(self):
+        """当前段写满：封存索引，开始下一段，超出保留数时删除最旧的段"""
+        self._file.close()
+        self._file = None
+        with self._lock:
+            self._save_index(self.segments[-1])
+            self.segments.append(self._new_segment(self.segments[-1]["seq"] + 1))
+            while len(self.segments) > self.max_segments:
+                old = self.segments.pop(0)
+                for ext in ("jsonl", "idx"):
+                    try:
+                        os.remove(self._segment_path(old["seq"], ext))
+                    except OSError:
+                        pass
+        self.path = self._segment_path(self.segments[-1]["seq"])
+        self._open()
 
-        api = self.config.get("api_url", "").strip()
-        interval = self.config.get("interval", 15)
+    def _write_batch(self, batch):
+        while batch:
+            if self._file is None:
+                self._open()
+            room = max(1, self.max_lines - self._lines)
+            chunk, batch = batch[:room], batch[room:]
+            lines = [json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for rec in chunk]
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            # 数据落盘后再更新索引，查询方看到的块总是完整的
+            with self._lock:
+                seg = self.segments[-1]
+                for rec, line in zip(chunk, lines):
+                    self._index_record(seg, rec, seg["size"])
+                    seg["size"] += len(line)
+            self._lines += len(chunk)
+            if self._lines >= self.max_lines:
+                self._rotate()
 
-        if not api:
-            messagebox.showerror("错误", "请先在设置中填写 API 地址")
-            return
+    def close(self, timeout=5):
+        super().close(timeout)
+        with self._lock:
+            if self.segments and self.segments[-1]["count"]:
+                self._save_index(self.segments[-1])
 
-        self.stop_event.clear()
-        self.thread = threading.Thread(
-            target=monitor_loop,
-            args=(self.config["rules"], api, interval, self.log_box if (self.log_window and self.log_window.winfo_exists()) else None, self.stop_event, self.update_status, self.update_mode),
-            daemon=True
-        )
-        self.thread.start()
+    # ---- 查询 ----
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self.segments), "records": sum(s["count"] for s in self.segments),
+                    "blocks": sum(len(s["blocks"]) for s in self.segments),
+                    "t0": self.segments[0]["t0"], "t1": self.segments[-1]["t1"]}
 
-    def stop(self):
-        self.stop_event.set()
-
-    def open_settings(self):
-        """打开设置窗口"""
-        settings_win = tk.Toplevel(self.root)
-        settings_win.title("设置")
-        settings_win.geometry("550x500")
-        settings_win.minsize(450, 400)
-        settings_win.transient(self.root)
-        settings_win.grab_set()
-
-        # 主容器
-        main = tk.Frame(settings_win, bg="#f5f7fa")
-        main.pack(fill="both", expand=True, padx=0, pady=0)
-        main.grid_rowconfigure(1, weight=1)
-        main.grid_columnconfigure(0, weight=1)
-
-        # 头部
-        header = tk.Frame(main, bg="#2c3e50", height=60)
-        header.pack(fill="x")
-        header.pack_propagate(False)
-        tk.Label(header, text="⚙ 设置", font=("Microsoft YaHei UI", 16, "bold"), bg="#2c3e50", fg="white").pack(pady=15)
-
-        # 内容区 - 使用滚动框架
-        scroll_frame = ScrollableFrame(main, bg="#f5f7fa")
-        scroll_frame.pack(fill="both", expand=True, pady=20, padx=20)
-        content = scroll_frame.get_frame()
-        content.configure(bg="#f5f7fa")
-
-        # 规则部分
-        rules_frame = tk.LabelFrame(content, text="多策略规则", font=("Microsoft YaHei UI", 12, "bold"), bg="#ffffff", fg="#2c3e50", padx=15, pady=15)
-        rules_frame.pack(fill="x", pady=(0, 15), padx=0)
-
-        self.rules_text_settings = tk.Text(rules_frame, height=4, font=("Consolas", 9), relief="flat", bd=1, bg="#f8f9fa", padx=10, pady=8)
-        self.rules_text_settings.pack(fill="both", expand=True, pady=(0, 10))
-        self._update_rules_text_settings()
-
-        rules_btn = tk.Frame(rules_frame, bg="#ffffff")
-        rules_btn.pack(fill="x")
-        tk.Button(rules_btn, text="添加规则", command=self.add_rule_settings, bg="#3498db", fg="white", relief="flat", padx=12, pady=6, font=("Microsoft YaHei UI", 10)).pack(side="right", padx=(5, 0))
-        tk.Button(rules_btn, text="保存规则", command=lambda: self.save_rules_settings(settings_win), bg="#27ae60", fg="white", relief="flat", padx=12, pady=6, font=("Microsoft YaHei UI", 10)).pack(side="right", padx=5)
-
-        # API 部分
-        api_frame = tk.LabelFrame(content, text="Clash API 配置", font=("Microsoft YaHei UI", 12, "bold"), bg="#ffffff", fg="#2c3e50", padx=15, pady=15)
-        api_frame.pack(fill="x", padx=0, pady=(0, 15))
-        
-        tk.Label(api_frame, text="API 地址:", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(anchor="w", pady=(0, 5))
-        self.e_api_settings = tk.Entry(api_frame, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#f8f9fa", highlightthickness=0)
-        self.e_api_settings.pack(fill="x", padx=10, pady=8)
-        self.e_api_settings.insert(0, self.config["api_url"])
-
-        # 间隔部分
-        interval_frame = tk.Frame(content, bg="#ffffff")
-        interval_frame.pack(fill="x", padx=15, pady=15)
-        tk.Label(interval_frame, text="检查间隔 (秒):", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(anchor="w", pady=(0, 5))
-        self.e_int_settings = tk.Entry(interval_frame, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#f8f9fa", highlightthickness=0, width=10)
-        self.e_int_settings.pack(anchor="w", padx=10, pady=8)
-        self.e_int_settings.insert(0, str(self.config["interval"]))
-
-        # 开机启动
-        v = tk.BooleanVar(value=self.config.get("autostart", False))
-        chk = tk.Checkbutton(content, text="开机启动", variable=v,
-                             command=lambda: [self.config.update(autostart=v.get()), set_autostart(v.get()), save_config(self.config)],
-                             bg="#f5f7fa", fg="#2c3e50", activebackground="#f5f7fa", selectcolor="#ffffff", font=("Microsoft YaHei UI", 11))
-        chk.pack(anchor="w", padx=15, pady=15)
-
-        # 底部保存按钮 - 固定在底部
-        btn_frame = tk.Frame(main, bg="#f5f7fa")
-        btn_frame.pack(fill="x", padx=20, pady=(0, 20))
-        tk.Button(btn_frame, text="保存所有设置", command=lambda: self.save_all_settings_settings(settings_win), bg="#27ae60", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x")
-
-    def _update_rules_text_settings(self):
-        self.rules_text_settings.delete("1.0", tk.END)
-        for r in self.config["rules"]:
-            self.rules_text_settings.insert(tk.END, f"{r['ssids']} → {r['mode']}\n")
-
-    def add_rule_settings(self):
-        """添加规则（设置窗口版本）"""
-        win = tk.Toplevel(self.root)
-        win.title("添加规则")
-        win.geometry("400x280")
-        win.minsize(350, 250)
-        win.transient(self.root)
-        win.grab_set()
-
-        main = tk.Frame(win, bg="#f5f7fa")
-        main.pack(fill="both", expand=True)
-
-        # 头部
-        header = tk.Frame(main, bg="#2c3e50")
-        header.pack(fill="x", padx=0, pady=0)
-        tk.Label(header, text="➕ 添加规则", font=("Microsoft YaHei UI", 12, "bold"), bg="#2c3e50", fg="white").pack(pady=10)
-
-        # 内容
-        content = tk.Frame(main, bg="#f5f7fa")
-        content.pack(fill="both", expand=True, padx=20, pady=20)
-
-        tk.Label(content, text="WiFi名称 (逗号分隔):", font=("Microsoft YaHei UI", 11), bg="#f5f7fa", fg="#34495e").pack(anchor="w", pady=(0, 5))
-        e1 = tk.Entry(content, width=40, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#ffffff")
-        e1.pack(fill="x", pady=(0, 15))
-        
-        tk.Label(content, text="代理模式:", font=("Microsoft YaHei UI", 11), bg="#f5f7fa", fg="#34495e").pack(anchor="w", pady=(0, 8))
-        mode = tk.StringVar(value="Rule")
-        frame_mode = tk.Frame(content, bg="#f5f7fa")
-        frame_mode.pack(fill="x", pady=(0, 15))
-        tk.Radiobutton(frame_mode, text="直连 (Direct)", variable=mode, value="Direct", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
-        tk.Radiobutton(frame_mode, text="规则 (Rule)", variable=mode, value="Rule", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
-        tk.Radiobutton(frame_mode, text="全局 (Global)", variable=mode, value="Global", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
-
-        # 按钮
-        btn_frame = tk.Frame(main, bg="#f5f7fa")
-        btn_frame.pack(fill="x", padx=20, pady=20)
-
-        def ok():
-            ssids = e1.get().strip()
-            if ssids:
-                self.config["rules"].insert(-1, {"ssids": ssids, "mode": mode.get()})
-                self._update_rules_text_settings()
-                win.destroy()
-            else:
-                messagebox.showwarning("提示", "请输入WiFi名称")
-        
-        tk.Button(btn_frame, text="确定", command=ok, bg="#27ae60", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x", side="left", padx=(0, 5))
-        tk.Button(btn_frame, text="取消", command=win.destroy, bg="#95a5a6", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x", side="left", padx=5)
-
-    def save_rules_settings(self, parent):
-        """保存规则（设置窗口版本）"""
-        try:
-            text = self.rules_text_settings.get("1.0", tk.END).strip()
-            rules = []
-            for line in text.splitlines():
-                if "→" in line:
-                    ssids, mode = line.split("→", 1)
-                    rules.append({"ssids": ssids.strip(), "mode": mode.strip()})
-            if not any("*" in r["ssids"] for r in rules):
-                rules.append({"ssids": "*", "mode": "Rule"})
-            self.config["rules"] = rules
-            messagebox.showinfo("成功", "规则已保存")
-        except:
-            messagebox.showerror("错误", "规则格式错误")
+    def query(self, start=None, end=None, text=None, reverse=True, **fields):
+        """按时间范围 [start, end)、字段精确匹配、msg 子串（不区分大小写）查询，惰性产出记录；reverse 时从新到旧"""
+        with self._lock:
+            # 只复制块的元数据快照，读文件不持锁
+            plan = [(s["seq"], s["t0"], s["t1"],
+                     [(b[0], (s["blocks"][i + 1][0] if i + 1 < len(s["blocks"]) else s["size"]), b[1], b[2],
+                       {k: b[4][k] for k in fields if k in b[4]})
+                      for i, b in enumerate(s["blocks"])])
+                    for s in self.segments if s["count"]]
+        text = text.lower() if text else None
+        # 先在原始字节上粗筛；含 JSON 转义字符时只做逐条比较
+        needle = text.encode("utf-8") if text and not any(c in text for c in '"\\') else None
+        # 字段条件在原始行里的样子（与写入时的 JSON 格式一致），不含时不必解析
+        field_needles = [(json.dumps(k) + ":" + json.dumps(v, ensure_ascii=False)).encode("utf-8")
+                         for k, v in fields.items()]
+        for seq, t0, t1, blocks in (reversed(plan) if reverse else plan):
+            if (start is not None and t1 < start) or (end is not None and t0 >= end):
+                continue
+            blocks = [(lo, hi) for lo, hi, b0, b1, values in (reversed(blocks) if reverse else blocks)
+                      if not ((start is not None and b1 < start) or (end is not None and b0 >= end))
+                      and all(v in values[k] for k, v in fields.items() if k in values and v is not None)]
+            if not blocks:
+                continue  # 索引表明整段都不会命中，不必打开文件
+            try:
+                f = open(self._segment_path(seq), "rb")
+            except OSError:
+                continue  # 查询期间被轮转删除
+            with f:
+                for lo, hi in blocks:
+                    f.seek(lo)
+                    data = f.read(hi - lo)
+                    if needle and needle not in data.lower():
+                        continue
+                    lines = data.splitlines()
+                    for raw in (reversed(lines) if reverse else lines):
+                        if needle and needle not in raw.lower():
+                            continue
+                        if any(fn not in raw for fn in field_needles):
+                            continue
+                        rec = json.loads(raw)
+                        t = rec.get("t", 0)
+                        if (start is not None and t < start) or (end is not None and t >= end):
+                            continue
+                        if any(rec.get(k) != v for k, v in fields.items()):
+                            continue
+                        if text and text not in rec.get("msg", "").lower():
+                            continue
+                        yield rec
+
+
+def format_event(rec):
+    """事件记录 -> 日志窗口中的一行"""
+    return f"[{datetime.fromtimestamp(rec.get('t', 0)).strftime('%m-%d %H:%M:%S')}] {rec.get('msg', '')}\n"
+
+
+_journal = None
+
+def enable_journal(directory=None, max_segments=100):
+    """打开事件日志（已打开时直接返回）"""
+    global _journal
+    if _journal is None:
+        with _log_writer_lock:
+            if _journal is None:
+                _journal = EventJournal(directory or JOURNAL_DIR, max_segments=max_segments)
+                atexit.register(_journal.close)
+    return _journal
+
+
+def get_journal():
+    return _journal
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = LogWriter(LOG_FILE)
+                atexit.register(_log_writer.close)
+    return _log_writer
+
+
+def flush_log_writer(timeout=5):
+    for writer in (_log_writer, _journal):
+        if writer:
+            writer.flush(timeout)
+
+
+def close_log_writer():
+    """关闭日志文件与事件日志"""
+    for writer in (_log_writer, _journal):
+        if writer:
+            writer.close()
+
+
+_log_view = None
+
+def set_log_view(view):
+    global _log_view
+    _log_view = view
+
+
+def log(msg, widget=None, **fields):
+    """widget 为 LogView（可在任意线程调用）；缺省时写入当前注册的日志视图。
+
+    fields 为结构化字段（kind、ssid、mode、ok、ms 等），开启事件日志时与消息一起记录，供检索。
+    """
+    now = datetime.now()
+    line = f"[{now.strftime('%H:%M:%S')}] {msg}\n"
+    view = widget or _log_view
+    if view is not None:
+        view.push(line)
+    print(line.strip())
+    try:
+        get_log_writer().write(line)
+        if _journal is not None:
+            level = "error" if msg.startswith("E ") else "info"
+            _journal.write(dict(fields, t=round(now.timestamp(), 3), level=level, msg=msg))
+    except:
+        pass
+
+
+def read_log_tail(path, max_lines, block=8192):
+    """从文件末尾按块向前读取最后 max_lines 行，不足时补上轮转出去的 .1 文件"""
+    lines = []
+    for p in (path, f"{path}.1"):
+        need = max_lines - len(lines)
+        if need <= 0 or not os.path.exists(p):
+            break
+        with open(p, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            data = b""
+            while pos > 0 and data.count(b"\n") <= need:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        chunk = data.decode("utf-8", "replace").splitlines(keepends=True)
+        lines = chunk[-need:] + lines
+    return lines
 
-    def save_all_settings_settings(self, parent):
-        """保存所有设置"""
+
+# ==================== WiFi 名称获取 ====================
+def _clean_ssid(ssid):
+    # Tk 无法显示 BMP 以外的字符（如 emoji），统一过滤
+    ssid = ''.join(c for c in (ssid or "") if ord(c) < 0x10000).strip()
+    return ssid or None
+
+
+def normalize_mac(mac):
+    """统一为小写冒号分隔的 MAC，无效时返回 None"""
+    digits = re.sub(r"[^0-9a-fA-F]", "", mac or "")
+    if len(digits) != 12 or digits in ("000000000000", "ffffffffffff"):
+        return None
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2)).lower()
+
+
+def parse_netsh(text):
+    """返回 (SSID, BSSID)"""
+    ssid = bssid = None
+    for line in text.splitlines():
+        line = line.strip()
+        if ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        key = key.strip()
+        if key == "SSID" and ssid is None:
+            ssid = _clean_ssid(value.strip())
+        elif key == "BSSID" and bssid is None:
+            bssid = normalize_mac(value)
+    return ssid, bssid
+
+
+def parse_nmcli(text):
+    """nmcli -t 输出（active:ssid:bssid），冒号以 \\: 转义；返回 (SSID, BSSID)"""
+    for line in text.splitlines():
+        fields = [f.replace("\\:", ":").replace("\\\\", "\\") for f in re.split(r"(?<!\\):", line)]
+        if fields[0] == "yes":
+            return _clean_ssid(fields[1] if len(fields) > 1 else ""), normalize_mac(fields[2] if len(fields) > 2 else "")
+    return None, None
+
+
+def parse_iw(text):
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("ssid "):
+            return _clean_ssid(line[5:])
+    return None
+
+
+class SSIDProvider:
+    """WiFi 名称查询后端基类，记录每次查询耗时"""
+    name = "base"
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.last_bssid = None  # 后端能拿到时记录所连 AP 的 BSSID
+
+    def get(self):
+        t0 = time.perf_counter()
+        bssid = None
         try:
-            api = self.e_api_settings.get().strip()
-            try:
-                interval = max(3, int(self.e_int_settings.get()))
-            except:
-                interval = 15
+            ssid = self._query()
+            # 后端可以返回 (SSID, BSSID)
+            if isinstance(ssid, tuple):
+                ssid, bssid = ssid
+        except Exception:
+            ssid = None
+        self.last_bssid = bssid if ssid else None
+        ms = (time.perf_counter() - t0) * 1000
+        self.calls += 1
+        self.total_ms += ms
+        self.last_ms = ms
+        self.max_ms = max(self.max_ms, ms)
+        return ssid
 
-            if not api:
-                messagebox.showerror("错误", "请填写 API 地址")
-                return
+    def stats(self):
+        avg = self.total_ms / self.calls if self.calls else 0.0
+        return {"provider": self.name, "calls": self.calls, "last_ms": round(self.last_ms, 2),
+                "avg_ms": round(avg, 2), "max_ms": round(self.max_ms, 2)}
 
-            self.config.update({"api_url": api, "interval": interval})
-            self.save_rules_settings(parent)
-            save_config(self.config)
-            messagebox.showinfo("成功", "所有设置已保存")
-            parent.destroy()
-        except Exception as e:
-            messagebox.showerror("错误", f"保存失败: {e}")
+    def available(self):
+        return True
 
-    def open_log_window(self):
-        """打开日志窗口"""
-        if self.log_window and self.log_window.winfo_exists():
-            self.log_window.lift()
-            return
+    def close(self):
+        pass
 
-        self.log_window = tk.Toplevel(self.root)
-        self.log_window.title("日志")
-        self.log_window.geometry("750x600")
-        self.log_window.minsize(500, 300)
-        self.log_window.protocol("WM_DELETE_WINDOW", self.close_log_window)
-
-        # 主容器
-        main = tk.Frame(self.log_window, bg="#f5f7fa")
-        main.pack(fill="both", expand=True, padx=0, pady=0)
-        main.grid_rowconfigure(1, weight=1)
-        main.grid_columnconfigure(0, weight=1)
-
-        # 头部
-        header = tk.Frame(main, bg="#2c3e50", height=50)
-        header.grid(row=0, column=0, sticky="ew", padx=0, pady=0)
-        header.pack_propagate(False)
-        tk.Label(header, text="📋 日志", font=("Microsoft YaHei UI", 14, "bold"), bg="#2c3e50", fg="white").pack(pady=12)
-
-        # 日志框 - 自适应填充可用空间
-        log_frame = tk.Frame(main, bg="#ffffff")
-        log_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
-        log_frame.grid_rowconfigure(0, weight=1)
-        log_frame.grid_columnconfigure(0, weight=1)
-
-        self.log_box = scrolledtext.ScrolledText(log_frame, font=("Consolas", 10), relief="flat", bd=0, bg="#2c3e50", fg="#ecf0f1", insertbackground="#ecf0f1", padx=10, pady=8)
-        self.log_box.grid(row=0, column=0, sticky="nsew")
-
-        # 底部按钮
-        btn_frame = tk.Frame(main, bg="#f5f7fa")
-        btn_frame.grid(row=2, column=0, sticky="ew", padx=10, pady=10)
-        btn_frame.grid_columnconfigure(0, weight=1)
-        
-        btn_inner = tk.Frame(btn_frame, bg="#f5f7fa")
-        btn_inner.pack()
-        
-        tk.Button(btn_inner, text="清空日志", command=self.clear_log, bg="#e74c3c", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
-        tk.Button(btn_inner, text="关闭", command=self.close_log_window, bg="#95a5a6", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
-
-        # 输出初始信息
-        log(f"配置加载: {CONFIG_FILE}", self.log_box)
-
-    def close_log_window(self):
-        """关闭日志窗口"""
-        if self.log_window:
-            self.log_window.destroy()
-            self.log_window = None
-
-    def clear_log(self):
-        """清空日志"""
-        if self.log_box and self.log_box.winfo_exists():
-            self.log_box.delete("1.0", tk.END)
-
-    def setup_tray(self):
-        # 托盘图标：优先使用 ico，然后 png，最后回退为简易生成图
-        if os.path.exists(ICON_ICO):
-            try:
-                image = Image.open(ICON_ICO)
-            except:
-                image = None
-        elif os.path.exists(ICON_PNG):
-            try:
-                image = Image.open(ICON_PNG)
-            except:
-                image = None
-        else:
-            image = None
+    def _query(self):
+        raise NotImplementedError
+
+
+class CommandSSIDProvider(SSIDProvider):
+    """每次查询执行一条命令并解析输出；runner 可替换为回放录制输出的假实现"""
+    cmd = []
+
+    def __init__(self, runner=None):
+        super().__init__()
+        self.runner = runner or self._run
 
-        if image is None:
-            image = Image.new("RGB", (64, 64), "#34495e")
-            from PIL import ImageDraw, ImageFont
-            d = ImageDraw.Draw(image)
+    def available(self):
+        return self.runner is not self._run or shutil.which(self.cmd[0]) is not None
+
+    def _run(self, cmd):
+        creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8",
+                                errors="replace", creationflags=creation_flags, timeout=5)
+        return result.stdout
+
+    def _query(self):
+        return self.parse(self.runner(self.cmd))
+
+    @staticmethod
+    def parse(text):
+        raise NotImplementedError
+
+
+class NetshProvider(CommandSSIDProvider):
+    name = "netsh"
+    cmd = ["netsh", "wlan", "show", "interfaces"]
+    parse = staticmethod(parse_netsh)
+
+
+class NmcliProvider(CommandSSIDProvider):
+    name = "nmcli"
+    cmd = ["nmcli", "-t", "-f", "active,ssid,bssid", "dev", "wifi", "list", "--rescan", "no"]
+    parse = staticmethod(parse_nmcli)
+
+
+class IwProvider(CommandSSIDProvider):
+    name = "iw"
+    cmd = ["iw", "dev"]
+    parse = staticmethod(parse_iw)
+
+
+class ProcWirelessProvider(SSIDProvider):
+    """Linux：从 /proc/net/wireless 取无线网卡，再用 SIOCGIWESSID ioctl 读 SSID，不创建进程"""
+    name = "proc"
+    SIOCGIWESSID = 0x8B1B
+    SIOCGIWAP = 0x8B15
+
+    def __init__(self, path="/proc/net/wireless", essid_func=None, ap_func=None):
+        super().__init__()
+        self.path = path
+        self.essid_func = essid_func or self._ioctl_essid  # 测试时可替换
+        self.ap_func = ap_func or (self._ioctl_ap if essid_func is None else (lambda ifname: None))
+        self._sock = None
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    def interfaces(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()[2:]  # 前两行是表头
+        return [line.split(":", 1)[0].strip() for line in lines if ":" in line]
+
+    def _ioctl_essid(self, ifname):
+        import fcntl
+        import array
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        buf = array.array("B", bytes(33))
+        # struct iwreq: ifr_name[16] + iw_point{pointer, length, flags}
+        req = struct.pack("16sPHH", ifname.encode()[:15], buf.buffer_info()[0], 32, 0)
+        req += bytes(max(0, 32 - len(req)))
+        res = fcntl.ioctl(self._sock.fileno(), self.SIOCGIWESSID, req)
+        length = struct.unpack_from("H", res, 16 + struct.calcsize("P"))[0]
+        return buf.tobytes()[:length].decode("utf-8", "replace")
+
+    def _ioctl_ap(self, ifname):
+        import fcntl
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # 联合体里是 struct sockaddr ap_addr，MAC 在 sa_data 前 6 字节
+        res = fcntl.ioctl(self._sock.fileno(), self.SIOCGIWAP, struct.pack("16s16s", ifname.encode()[:15], bytes(16)))
+        return res[18:24].hex(":")
+
+    def _query(self):
+        for ifname in self.interfaces():
             try:
-                font = ImageFont.truetype("seguiemj.ttf", 40)
-            except:
-                font = ImageFont.load_default()
-            d.text((10, 10), "Shield", fill="white", font=font)
+                ssid = _clean_ssid(self.essid_func(ifname))
+            except OSError:
+                continue
+            if ssid:
+                try:
+                    bssid = normalize_mac(self.ap_func(ifname))
+                except OSError:
+                    bssid = None
+                return ssid, bssid
+        return None
 
-        menu = pystray.Menu(
-            pystray.MenuItem("显示", self.show_window),
-            pystray.MenuItem("退出", self.quit_app)
-        )
-        self.icon = pystray.Icon("AutoVPN", image, "VPN 切换器", menu)
-        threading.Thread(target=self.icon.run, daemon=True).start()
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
 
-    def show_window(self, icon=None, item=None):
-        self.root.after(0, lambda: [self.root.deiconify(), self.root.lift()])
 
-    def quit_app(self, icon=None, item=None):
-        # 触发停止，停止托盘并释放互斥，最后退出主循环
+class WlanApiProvider(SSIDProvider):
+    """Windows：常驻的 WLAN API 句柄，直接查询当前连接，不再每次启动 netsh"""
+    name = "wlanapi"
+
+    def __init__(self):
+        super().__init__()
+        self._api = None
+        self._handle = None
+
+    def available(self):
+        if sys.platform != "win32":
+            return False
         try:
-            self.stop_event.set()
-            # 等待后台线程短暂结束
-            try:
-                if self.thread and self.thread.is_alive():
-                    self.thread.join(timeout=2)
-            except:
-                pass
-            if getattr(self, 'icon', None):
+            self._open()
+            return True
+        except Exception:
+            return False
+
+    def _open(self):
+        if self._handle is not None:
+            return
+        api = ctypes.windll.wlanapi
+        handle = ctypes.c_void_p()
+        negotiated = ctypes.c_ulong()
+        if api.WlanOpenHandle(2, None, ctypes.byref(negotiated), ctypes.byref(handle)) != 0:
+            raise OSError("WlanOpenHandle 失败")
+        self._api, self._handle = api, handle
+
+    def _query(self):
+        self._open()
+        wt = _wlan_types()
+        api = self._api
+        iface_list = ctypes.POINTER(wt.InterfaceInfoList)()
+        if api.WlanEnumInterfaces(self._handle, None, ctypes.byref(iface_list)) != 0:
+            raise OSError("WlanEnumInterfaces 失败")
+        try:
+            count = iface_list.contents.dwNumberOfItems
+            infos = ctypes.cast(ctypes.addressof(iface_list.contents.InterfaceInfo),
+                                ctypes.POINTER(wt.InterfaceInfo))
+            for i in range(count):
+                if infos[i].isState != 1:  # wlan_interface_state_connected
+                    continue
+                size = ctypes.c_ulong()
+                data = ctypes.c_void_p()
+                # opcode 7: wlan_intf_opcode_current_connection
+                if api.WlanQueryInterface(self._handle, ctypes.byref(infos[i].InterfaceGuid), 7, None,
+                                          ctypes.byref(size), ctypes.byref(data), None) != 0:
+                    continue
                 try:
-                    self.icon.stop()
-                except:
-                    pass
-            try:
-                release_mutex()
-            except:
-                pass
+                    attrs = ctypes.cast(data, ctypes.POINTER(wt.ConnectionAttributes)).contents
+                    dot11 = attrs.wlanAssociationAttributes.dot11Ssid
+                    ssid = bytes(dot11.ucSSID[:dot11.uSSIDLength]).decode("utf-8", "replace")
+                    bssid = bytes(attrs.wlanAssociationAttributes.dot11Bssid).hex(":")
+                    return _clean_ssid(ssid), normalize_mac(bssid)
+                finally:
+                    api.WlanFreeMemory(data)
+            return None
+        finally:
+            api.WlanFreeMemory(iface_list)
+
+    def close(self):
+        if self._handle is not None:
+            self._api.WlanCloseHandle(self._handle, None)
+            self._handle = None
+
+
+_WLAN_TYPES = None
+
+def _wlan_types():
+    """wlanapi.h 中用到的结构体，首次使用时定义"""
+    global _WLAN_TYPES
+    if _WLAN_TYPES is None:
+        class GUID(ctypes.Structure):
+            _fields_ = [("Data1", ctypes.c_ulong), ("Data2", ctypes.c_ushort),
+                        ("Data3", ctypes.c_ushort), ("Data4", ctypes.c_ubyte * 8)]
+
+        class InterfaceInfo(ctypes.Structure):
+            _fields_ = [("InterfaceGuid", GUID), ("strInterfaceDescription", ctypes.c_wchar * 256),
+                        ("isState", ctypes.c_uint)]
+
+        class InterfaceInfoList(ctypes.Structure):
+            _fields_ = [("dwNumberOfItems", ctypes.c_ulong), ("dwIndex", ctypes.c_ulong),
+                        ("InterfaceInfo", InterfaceInfo * 1)]
+
+        class Dot11Ssid(ctypes.Structure):
+            _fields_ = [("uSSIDLength", ctypes.c_ulong), ("ucSSID", ctypes.c_ubyte * 32)]
+
+        class AssociationAttributes(ctypes.Structure):
+            _fields_ = [("dot11Ssid", Dot11Ssid), ("dot11BssType", ctypes.c_uint),
+                        ("dot11Bssid", ctypes.c_ubyte * 6), ("dot11PhyType", ctypes.c_uint),
+                        ("uDot11PhyIndex", ctypes.c_ulong), ("wlanSignalQuality", ctypes.c_ulong),
+                        ("ulRxRate", ctypes.c_ulong), ("ulTxRate", ctypes.c_ulong)]
+
+        class ConnectionAttributes(ctypes.Structure):
+            _fields_ = [("isState", ctypes.c_uint), ("wlanConnectionMode", ctypes.c_uint),
+                        ("strProfileName", ctypes.c_wchar * 256),
+                        ("wlanAssociationAttributes", AssociationAttributes)]
+
+        class _Types:
+            pass
+        for cls in (GUID, InterfaceInfo, InterfaceInfoList, Dot11Ssid, AssociationAttributes, ConnectionAttributes):
+            setattr(_Types, cls.__name__, cls)
+        _WLAN_TYPES = _Types
+    return _WLAN_TYPES
+
+
+class HelperSSIDProvider(SSIDProvider):
+    """常驻辅助进程：启动一次，之后每次写入一行 "ssid" 查询，读回一行结果（空行表示未连接）"""
+    name = "helper"
+
+    def __init__(self, cmd):
+        super().__init__()
+        self.cmd = cmd if isinstance(cmd, list) else cmd.split()
+        self.proc = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return bool(self.cmd) and shutil.which(self.cmd[0]) is not None
+
+    def _ensure(self):
+        if self.proc is None or self.proc.poll() is not None:
+            creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+            self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True, encoding="utf-8",
+                                         errors="replace", bufsize=1, creationflags=creation_flags)
+
+    def _query(self):
+        with self._lock:
+            self._ensure()
             try:
-                self.root.quit()
-                self.root.destroy()
-            except:
-                pass
+                self.proc.stdin.write("ssid\n")
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except (OSError, ValueError):
+                self.close()
+                raise
+            if not line:
+                self.close()
+                return None
+            return _clean_ssid(line.rstrip("\n"))
+
+    def close(self):
+        if self.proc:
             try:
-                sys.exit(0)
+                self.proc.kill()
             except:
                 pass
-        except Exception:
+            self.proc = None
+
+
+SSID_PROVIDERS = {
+    "wlanapi": WlanApiProvider,
+    "netsh": NetshProvider,
+    "proc": ProcWirelessProvider,
+    "nmcli": NmcliProvider,
+    "iw": IwProvider,
+}
+
+
+def create_ssid_provider(name="auto", helper_cmd=""):
+    """按配置创建 WiFi 名称查询后端，auto 时按平台挑选第一个可用的"""
+    if helper_cmd:
+        return HelperSSIDProvider(helper_cmd)
+    if name != "auto" and name in SSID_PROVIDERS:
+        return SSID_PROVIDERS[name]()
+    order = ["wlanapi", "netsh"] if sys.platform == "win32" else ["proc", "nmcli", "iw"]
+    for key in order:
+        provider = SSID_PROVIDERS[key]()
+        if provider.available():
+            return provider
+    return NetshProvider()
+
+
+_ssid_provider = None
+
+def set_ssid_provider(provider):
+    global _ssid_provider
+    if _ssid_provider and _ssid_provider is not provider:
+        _ssid_provider.close()
+    _ssid_provider = provider
+
+
+def get_ssid():
+    global _ssid_provider
+    if _ssid_provider is None:
+        _ssid_provider = create_ssid_provider()
+    return _ssid_provider.get()
+
+# ==================== 网络指纹 ====================
+class NetworkFingerprint(collections.namedtuple("NetworkFingerprint", "ssid bssid gateway_mac iface")):
+    """当前网络的身份：SSID、所连 AP 的 BSSID、默认网关 MAC、出口接口类型（wifi/wired）"""
+    __slots__ = ()
+
+    def describe(self):
+        parts = [f"网关 {self.gateway_mac}"] if self.gateway_mac else []
+        if self.bssid:
+            parts.append(f"BSSID {self.bssid}")
+        if self.iface:
+            parts.append({"wifi": "无线", "wired": "有线"}.get(self.iface, self.iface))
+        return "，".join(parts) or "无网关"
+
+
+def read_default_gateway(route_path="/proc/net/route"):
+    """Linux：返回 metric 最小的默认路由 (接口名, 网关 IP)，没有时为 (None, None)"""
+    best = (None, None, None)
+    with open(route_path) as f:
+        next(f, None)
+        for line in f:
+            fields = line.split()
+            # Destination 为 0 且带 RTF_GATEWAY 标志
+            if len(fields) < 7 or fields[1] != "00000000" or not int(fields[3], 16) & 0x2:
+                continue
+            metric = int(fields[6])
+            if best[2] is None or metric < best[2]:
+                best = (fields[0], socket.inet_ntoa(struct.pack("<I", int(fields[2], 16))), metric)
+    return best[:2]
+
+
+def read_arp_mac(ip, arp_path="/proc/net/arp"):
+    """Linux：从内核 ARP 表里查 IP 对应的 MAC（不发包），未解析时返回 None"""
+    with open(arp_path) as f:
+        next(f, None)
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 4 and fields[0] == ip:
+                return normalize_mac(fields[3])
+    return None
+
+
+def linux_iface_type(ifname, sys_path="/sys/class/net"):
+    base = os.path.join(sys_path, ifname)
+    if os.path.exists(os.path.join(base, "wireless")) or os.path.exists(os.path.join(base, "phy80211")):
+        return "wifi"
+    return "wired"
+
+
+_IPHLP_TYPES = None
+
+def _iphlp_types():
+    """iphlpapi.h 中用到的结构体，首次使用时定义"""
+    global _IPHLP_TYPES
+    if _IPHLP_TYPES is None:
+        DWORD = ctypes.c_ulong
+
+        class ForwardRow(ctypes.Structure):  # MIB_IPFORWARDROW
+            _fields_ = [(name, DWORD) for name in (
+                "dwForwardDest", "dwForwardMask", "dwForwardPolicy", "dwForwardNextHop", "dwForwardIfIndex",
+                "dwForwardType", "dwForwardProto", "dwForwardAge", "dwForwardNextHopAS", "dwForwardMetric1",
+                "dwForwardMetric2", "dwForwardMetric3", "dwForwardMetric4", "dwForwardMetric5")]
+
+        class IfRow(ctypes.Structure):  # MIB_IFROW
+            _fields_ = [("wszName", ctypes.c_wchar * 256), ("dwIndex", DWORD), ("dwType", DWORD),
+                        ("dwMtu", DWORD), ("dwSpeed", DWORD), ("dwPhysAddrLen", DWORD),
+                        ("bPhysAddr", ctypes.c_ubyte * 8)] + \
+                       [(name, DWORD) for name in (
+                           "dwAdminStatus", "dwOperStatus", "dwLastChange", "dwInOctets", "dwInUcastPkts",
+                           "dwInNUcastPkts", "dwInDiscards", "dwInErrors", "dwInUnknownProtos", "dwOutOctets",
+                           "dwOutUcastPkts", "dwOutNUcastPkts", "dwOutDiscards", "dwOutErrors", "dwOutQLen",
+                           "dwDescrLen")] + \
+                       [("bDescr", ctypes.c_ubyte * 256)]
+
+        class _Types:
             pass
+        for cls in (ForwardRow, IfRow):
+            setattr(_Types, cls.__name__, cls)
+        _IPHLP_TYPES = _Types
+    return _IPHLP_TYPES
 
-    def on_close(self):
-        # 点击窗口 X 时直接退出程序（关闭后台、托盘、释放锁）
-        self.quit_app()
 
-    def load_autostart(self):
-        try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run")
-            winreg.QueryValueEx(key, "AutoVPN")
-            self.config["autostart"] = True
-        except:
-            self.config["autostart"] = False
+def _windows_gateway():
+    """Windows：GetBestRoute 找默认网关，GetIfEntry 判断接口类型，SendARP 取网关 MAC（命中 ARP 缓存时不发包）"""
+    iphlp = ctypes.windll.iphlpapi
+    t = _iphlp_types()
+    row = t.ForwardRow()
+    if iphlp.GetBestRoute(0, 0, ctypes.byref(row)) != 0:
+        return None, None
+    iface = None
+    ifrow = t.IfRow(dwIndex=row.dwForwardIfIndex)
+    if iphlp.GetIfEntry(ctypes.byref(ifrow)) == 0:
+        iface = "wifi" if ifrow.dwType == 71 else "wired"  # IF_TYPE_IEEE80211
+    if not row.dwForwardNextHop:
+        return iface, None
+    mac = (ctypes.c_ubyte * 8)()
+    size = ctypes.c_ulong(8)
+    if iphlp.SendARP(row.dwForwardNextHop, 0, mac, ctypes.byref(size)) != 0:
+        return iface, None
+    return iface, normalize_mac(bytes(mac[:size.value]).hex())
 
-# ==================== UI 组件 ====================
-class ModernEntry(tk.Frame):
-    def __init__(self, parent, **kwargs):
-        super().__init__(parent, bg="#f5f7fa", **kwargs)
-        self.entry = tk.Entry(self, font=("Microsoft YaHei UI", 11), relief="flat", bd=0, bg="#ffffff", highlightthickness=1, highlightbackground="#dfe4ea", insertbackground="#2c3e50")
-        self.entry.pack(fill="both", expand=True, padx=10, pady=8)
 
-    def get(self):
-        return self.entry.get()
-
-    def insert(self, index, string):
-        self.entry.insert(index, string)
-    
-    def config(self, **kwargs):
-        self.entry.config(**kwargs)
-
-
-class ScrollableFrame(tk.Frame):
-    """可滚动的框架，用于处理内容溢出"""
-    def __init__(self, parent, **kwargs):
-        super().__init__(parent, **kwargs)
-        
-        # 创建画布和滚动条
-        self.canvas = tk.Canvas(self, bg=parent.cget("bg"), highlightthickness=0)
-        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = tk.Frame(self.canvas, bg=self.canvas.cget("bg"))
-        
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        )
-        
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        
-        self.canvas.pack(side="left", fill="both", expand=True)
-        self.scrollbar.pack(side="right", fill="y")
-        
-        # 支持鼠标滚轮
-        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
-
-    def _on_mousewheel(self, event):
-        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
-
-    def get_frame(self):
-        return self.scrollable_frame
+def get_gateway():
+    """返回 (出口接口类型, 默认网关 MAC)，拿不到的字段为 None"""
+    try:
+        if sys.platform == "win32":
+            return _windows_gateway()
+        ifname, ip = read_default_gateway()
+        if not ifname:
+            return None, None
+        return linux_iface_type(ifname), read_arp_mac(ip)
+    except (OSError, ValueError, AttributeError):
+        return None, None
 
-# ==================== 主程序 ====================
-if __name__ == "__main__":
-    # 先获取单实例锁，防止重复打开
-    if not acquire_mutex("AutoVPN_SingleInstance_Mutex"):
-        try:
-            # Windows 原生消息框（避免在无 GUI 上出现问题）
-            ctypes.windll.user32.MessageBoxW(None, "程序已在运行中", "提示", 0)
-        except:
-            print("程序已在运行中")
-        sys.exit(0)
 
-    root = tk.Tk()
-    app = App(root)
-    # 点击 X 时退出（而不是隐藏）以确保后台线程与托盘被清理
-    root.protocol("WM_DELETE_WINDOW", app.quit_app)
+def get_fingerprint(ssid=None):
+    """在已查到的 SSID 基础上补全 BSSID、网关 MAC 和接口类型"""
+    bssid = _ssid_provider.last_bssid if _ssid_provider and ssid else None
+    iface, gateway_mac = get_gateway()
+    if iface is None and ssid:
+        iface = "wifi"
+    return NetworkFingerprint(ssid, bssid, gateway_mac, iface)
+
+# ==================== 可达性探测 ====================
+def probe_item(item):
+    """规则项是否为探测项：dns:主机、tcp:主机:端口、http(s)://地址；是则返回规范化的探测项，否则 None"""
+    lower = item.lower()
+    if lower.startswith("dns:") and len(item) > 4:
+        return "dns:" + lower[4:]
+    if lower.startswith("tcp:"):
+        host, sep, port = lower[4:].rpartition(":")
+        if not sep or not host or not port.isdigit():
+            raise ValueError(f"探测项格式应为 tcp:主机:端口，而不是 {item}")
+        return f"tcp:{host}:{port}"
+    if lower.startswith(("http://", "https://")):
+        return item
+    return None
+
+
+def run_probe(probe, timeout):
+    """执行一个探测项，返回是否成功（DNS 能解析、TCP 能连上、HTTP 状态码小于 400）"""
+    kind, _, target = probe.partition(":")
     try:
-        root.mainloop()
-    finally:
-        # 确保退出时释放互斥（保险起见）
+        if kind == "dns":
+            return bool(socket.getaddrinfo(target, None))
+        if kind == "tcp":
+            host, _, port = target.rpartition(":")
+            socket.create_connection((host.strip("[]"), int(port)), timeout=timeout).close()
+            return True
+        parts = urllib.parse.urlsplit(probe)
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        conn = cls(parts.hostname, parts.port, timeout=timeout)
         try:
-            release_mutex()
-        except:
-            pass
+            conn.request("GET", (parts.path or "/") + (f"?{parts.query}" if parts.query else ""))
+            return conn.getresponse().status < 400
+        finally:
+            conn.close()
+    except (OSError, http.client.HTTPException, ValueError):
+        return False
+
+
+class ProbeRunner:
+    """并发执行规则中的可达性探测，用于 SSID 之外识别网络（如内网域名能否解析、内网端口是否可达）。
+
+    candidates 为按规则顺序排列的 (规则序号, [探测项])；排在前面的规则未决时不能采用后面的结果，
+    一旦能确定第一条全部探测成功的规则就立即返回，不再等其余探测。
+    结果按网络 (SSID, 网关 MAC, 接口类型) 缓存 ttl 秒，网络不变时不重复探测；DNS 解析无法中断，超时后在后台结束。
+    budget 为一次 run 最多等待的秒数，即监控线程每轮因探测多出的延迟上限（缺省等满单项超时）：
+    到时未完成的探测本轮按失败处理，在后台继续并写入缓存，下一轮不重复发起；其中成功的会调用 notify 触发重新判断。
+    """
+
+    def __init__(self, timeout=0.8, ttl=300, workers=8, clock=time.monotonic, budget=None, notify=None):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.budget = timeout + 0.2 if budget is None else budget
+        self.notify = notify
+        self.clock = clock
+        self.cache = {}  # (网络, 探测项) -> (过期时刻, 是否成功)
+        self.runs = 0    # 实际发起过探测的次数
+        self.last = None  # 最近一次实际探测的明细，供日志
+        self.late = 0     # 超过 budget 后才成功的探测数
+        self._inflight = {}  # (网络, 探测项) -> 尚未完成的 future
+        self._late = set()   # 超过 budget、完成后需要通知的 future
+        self.workers = workers
+        self._pool = None    # 第一次真正需要探测时才创建（多数规则没有探测项）
+
+    def _timed(self, probe):
+        t0 = time.perf_counter()
+        ok = run_probe(probe, self.timeout)
+        return ok, (time.perf_counter() - t0) * 1000
+
+    def _store(self, key, probe, fut):
+        self._inflight.pop((key, probe), None)
+        if not fut.cancelled() and fut.exception() is None:
+            self.cache[(key, probe)] = (self.clock() + self.ttl, fut.result()[0])
+
+    def _late_done(self, fut):
+        self._late.discard(fut)
+        if not fut.cancelled() and fut.exception() is None and fut.result()[0]:
+            self.late += 1
+            if self.notify:
+                self.notify()
+
+    def run(self, key, candidates):
+        """返回第一条所有探测都成功的规则序号，都不成功时返回 None"""
+        import concurrent.futures
+        now = self.clock()
+        results = {}
+        for _, probes in candidates:
+            for p in probes:
+                hit = self.cache.get((key, p))
+                if hit and hit[0] > now:
+                    results[p] = hit[1]
+
+        def decide():
+            for idx, probes in candidates:
+                states = [results.get(p) for p in probes]
+                if False in states:
+                    continue
+                return (idx, True) if None not in states else (None, False)
+            return None, True
+
+        winner, done = decide()
+        if done:
+            return winner
+        t0 = time.perf_counter()
+        cached = len(results)
+        pending = {}
+        for _, probes in candidates:
+            for p in probes:
+                if p not in results and p not in pending.values():
+                    fut = self._inflight.get((key, p))  # 上一轮超出 budget 还在跑的直接接着等
+                    if fut is None:
+                        if self._pool is None:
+                            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                               thread_name_prefix="probe")
+                        fut = self._pool.submit(self._timed, p)
+                        self._inflight[(key, p)] = fut
+                        fut.add_done_callback(lambda f, p=p: self._store(key, p, f))
+                    pending[fut] = p
+        detail = {}
+        deadline = time.monotonic() + self.budget
+        while not done and pending:
+            finished, _ = concurrent.futures.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+            if not finished:
+                break
+            for fut in finished:
+                p = pending.pop(fut)
+                ok, ms = fut.result() if fut.exception() is None else (False, 0.0)
+                results[p] = ok
+                detail[p] = (ok, round(ms, 1))
+            winner, done = decide()
+        skipped = len(pending) if done else 0
+        for fut, p in pending.items():
+            if done:
+                fut.cancel()  # 已经能下结论，剩下的不再等
+                continue
+            # 超过本轮的等待上限：本轮按失败处理，探测在后台继续，完成后写入缓存，成功时再通知重新判断
+            results[p] = False
+            detail[p] = (False, None)
+            if fut not in self._late:  # 连续几轮都没等到时只通知一次
+                self._late.add(fut)
+                fut.add_done_callback(self._late_done)
+        if not done:
+            winner, done = decide()
+        self.runs += 1
+        self.last = {"ms": round((time.perf_counter() - t0) * 1000, 1), "detail": detail,
+                     "cached": cached, "skipped": skipped}
+        return winner
+
+    def summary(self):
+        """最近一次探测的日志文本"""
+        st = self.last or {}
+        parts = [f"{p} {'通' if ok else '不通'}" + (f" {ms:.0f}ms" if ms is not None else "（本轮未完成，后台继续）")
+                 for p, (ok, ms) in (st.get("detail") or {}).items()]
+        if st.get("skipped"):
+            parts.append(f"另有 {st['skipped']} 项无需等待")
+        if st.get("cached"):
+            parts.append(f"{st['cached']} 项用缓存")
+        return f"{'，'.join(parts)}（耗时 {st.get('ms', 0):.0f} ms）"
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_probe_runner = None
+
+def set_probe_runner(runner):
+    global _probe_runner
+    if _probe_runner and _probe_runner is not runner:
+        _probe_runner.close()
+    _probe_runner = runner
+
+
+def get_probe_runner():
+    global _probe_runner
+    if _probe_runner is None:
+        _probe_runner = ProbeRunner()
+    return _probe_runner
+
+# ==================== Clash 控制 ====================
+class ClashController:
+    """Clash 外部控制器客户端：HTTP/1.1 长连接，先读当前模式，一致则跳过写入，写入后回读确认"""
+
+    def __init__(self, api_url, connect_timeout=1.0, timeout=3.0):
+        parts = urllib.parse.urlsplit(api_url)
+        self.api_url = api_url
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if self.scheme == "https" else 80)
+        self.path = parts.path or "/configs"
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+        self.reachable = True  # 最近一次请求是否连上了控制器
+        self.last_headers = {}
+        self._etag = None
+        self._mode = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def request(self, method, path=None, body=None, headers=None):
+        """发送请求并返回 (状态码, 响应体)；复用的连接若已被对端关闭，重连重试一次"""
+        headers = dict(headers or {})
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        t0 = time.perf_counter()
+        with self._lock:
+            for attempt in (0, 1):
+                reused = self._conn is not None
+                try:
+                    if not reused:
+                        self._conn = self._connect()
+                    self._conn.request(method, path or self.path, body=data, headers=headers)
+                    resp = self._conn.getresponse()
+                    payload = resp.read()
+                    self.last_headers = resp.headers
+                    if resp.will_close:
+                        self._close_conn()
+                    self.reachable = True
+                    if _metrics:
+                        _metrics.observe("autovpn_controller_request_seconds", time.perf_counter() - t0, method=method)
+                        _metrics.inc("autovpn_controller_responses_total", method=method, code=str(resp.status))
+                    return resp.status, payload
+                except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                        ConnectionResetError, BrokenPipeError):
+                    self._close_conn()
+                    if not reused or attempt:
+                        self.reachable = False
+                        if _metrics:
+                            _metrics.inc("autovpn_controller_responses_total", method=method, code="error")
+                        raise
+                except Exception:
+                    self._close_conn()
+                    self.reachable = False
+                    if _metrics:
+                        _metrics.inc("autovpn_controller_responses_total", method=method, code="error")
+                    raise
+
+    def get_mode(self, conditional=False):
+        """读取当前模式；conditional 时带上次的 ETag，304 直接返回缓存的模式"""
+        headers = {"If-None-Match": self._etag} if conditional and self._etag else None
+        status, payload = self.request("GET", headers=headers)
+        if status == 304 and self._mode:
+            return self._mode
+        if status != 200:
+            raise OSError(f"GET {self.path} 返回 {status}")
+        self._mode = json.loads(payload.decode("utf-8") or "{}").get("mode")
+        self._etag = self.last_headers.get("ETag")
+        return self._mode
+
+    def set_mode(self, mode, verify=True):
+        try:
+            try:
+                current = self.get_mode()
+            except (OSError, ValueError, http.client.HTTPException):
+                if not self.reachable:
+                    raise
+                current = None
+            if current and current.lower() == mode.lower():
+                return True, f"模式已是 {mode}，跳过写入"
+            status, _ = self.request("PATCH", body={"mode": mode})
+            if status != 204:
+                return False, f"模式切换返回 {status}"
+            if verify:
+                actual = self.get_mode()
+                if not actual or actual.lower() != mode.lower():
+                    return False, f"模式回读不一致: {actual}"
+            return True, f"模式切换: {mode}"
+        except Exception as e:
+            self.reachable = False
+            return False, f"连接失败: {e}"
+
+    def endpoint(self, name):
+        """控制器其他接口的路径：api_url 指向 .../configs，其余接口与之同级"""
+        root = self.path[:-len("/configs")] if self.path.endswith("/configs") else self.path.rstrip("/")
+        return f"{root}/{name.lstrip('/')}"
+
+    def get_connections(self):
+        status, payload = self.request("GET", self.endpoint("connections"))
+        if status != 200:
+            raise OSError(f"GET /connections 返回 {status}")
+        return json.loads(payload.decode("utf-8") or "{}").get("connections") or []
+
+    def close_connections(self, ids=None, batch=200):
+        """ids 为 None 时一次 DELETE /connections 全部关闭；否则在共享的长连接上用 HTTP 管线批量发送 DELETE。
+        控制器中途关闭连接（不支持管线或限制了每条连接的请求数）时，没有收到响应的部分逐个重发。
+        """
+        path = self.endpoint("connections")
+        if ids is None:
+            status, _ = self.request("DELETE", path)
+            return status in (200, 204)
+        paths = [f"{path}/{urllib.parse.quote(str(cid))}" for cid in ids]
+        closed = answered = 0
+        host = f"{self.host}:{self.port}"
+        with self._lock:
+            try:
+                if self._conn is None or self._conn.sock is None:
+                    self._conn = self._connect()
+                # 直接在 http.client 连接的套接字上收发（https 时即 TLS 套接字），结束时连接仍处于空闲状态可继续复用
+                sock = self._conn.sock
+                with sock.makefile("rb") as reader:
+                    for i in range(0, len(paths), batch):
+                        chunk = paths[i:i + batch]
+                        # 一批请求一次写出，再依次读回响应，避免双方缓冲区写满互相等待
+                        sock.sendall("".join(f"DELETE {p} HTTP/1.1\r\nHost: {host}\r\nContent-Length: 0\r\n\r\n"
+                                             for p in chunk).encode("ascii"))
+                        for _ in chunk:
+                            if _read_http_response(reader) in (200, 204):
+                                closed += 1
+                            answered += 1
+            except (OSError, ValueError, IndexError):
+                self._close_conn()
+        for p in paths[answered:]:
+            try:
+                status, _ = self.request("DELETE", p)
+            except (OSError, http.client.HTTPException):
+                break
+            closed += status in (200, 204)
+        return closed
+
+    def get_proxy(self, name):
+        """GET /proxies/{name}：代理组返回 {"type", "now", "all": [节点名...]}"""
+        status, payload = self.request("GET", self.endpoint(f"proxies/{urllib.parse.quote(name, safe='')}"))
+        if status != 200:
+            raise OSError(f"GET /proxies/{name} 返回 {status}")
+        return json.loads(payload.decode("utf-8") or "{}")
+
+    def select_proxy(self, group, name):
+        """PUT /proxies/{group}：把选择器代理组切到指定节点"""
+        status, _ = self.request("PUT", self.endpoint(f"proxies/{urllib.parse.quote(group, safe='')}"), body={"name": name})
+        return status in (200, 204)
+
+    def proxy_delay(self, name, url, timeout=2.0):
+        """让控制器对一个节点测速，返回毫秒数，超时/不可用返回 None。
+        每次测速用单独的连接，多个节点可以并发测而不在共享连接上排队。
+        """
+        query = urllib.parse.urlencode({"timeout": int(timeout * 1000), "url": url})
+        conn = self._connect()
+        try:
+            conn.sock.settimeout(timeout + self.timeout)
+            conn.request("GET", self.endpoint(f"proxies/{urllib.parse.quote(name, safe='')}/delay") + "?" + query)
+            resp = conn.getresponse()
+            payload = resp.read()
+        finally:
+            conn.close()
+        if resp.status != 200:
+            return None
+        delay = json.loads(payload.decode("utf-8") or "{}").get("delay")
+        return delay if isinstance(delay, (int, float)) and delay > 0 else None
+
+    def flush_caches(self):
+        """清空 fake-ip 与 DNS 缓存（mihomo 接口，旧内核返回 404 时忽略）"""
+        result = {}
+        for name in ("cache/fakeip/flush", "cache/dns/flush"):
+            try:
+                status, _ = self.request("POST", self.endpoint(name))
+                result[name] = status in (200, 204)
+            except Exception:
+                result[name] = False
+        return result
+
+    def _close_conn(self):
+        if self._conn:
+            try:
+                self._conn.close()
+            except:
+                pass
+            self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._close_conn()
+
+
+class ControllerGroup:
+    """同时切换多个 Clash/mihomo 控制器：各目标并发执行、单独超时与重试，总耗时取决于最慢的正常目标。
+
+    每个控制器同一时间最多一个切换任务：目标连不上时任务在后台重试，之后的轮次不再重复提交，
+    只更新要切到的模式，任务重试时取最新的模式。
+    """
+    REQUESTS_PER_SWITCH = 3  # 一次切换最多 GET、PATCH、回读 GET 三个请求
+
+    def __init__(self, controllers, retries=1):
+        import concurrent.futures
+        self.controllers = list(controllers)
+        self.retries = retries
+        self.status = {c.api_url: {"ok": None, "msg": "", "ms": 0.0} for c in self.controllers}
+        self._target = None
+        self._pending = {}  # api_url -> 仍在进行的切换任务
+        self._overdue = set()  # 超过等待上限仍未完成的任务
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.controllers),
+                                                           thread_name_prefix="clash")
+
+    @property
+    def api_url(self):
+        return ", ".join(c.api_url for c in self.controllers)
+
+    @property
+    def reachable(self):
+        # 任一目标连不上（或超时的任务还没结束）都按退避节奏重试，已切换成功的目标会因模式一致而跳过写入
+        return all(c.reachable for c in self.controllers) and all(f.done() for f in self._overdue)
+
+    def deadline(self):
+        """等待一轮切换的上限：每个请求的连接 + 响应超时，乘以请求数和重试次数"""
+        return max((c.connect_timeout + c.timeout) * self.REQUESTS_PER_SWITCH * (self.retries + 1)
+                   for c in self.controllers)
+
+    def _switch(self, controller):
+        t0 = time.perf_counter()
+        while True:
+            mode = self._target
+            for attempt in range(self.retries + 1):
+                ok, msg = controller.set_mode(mode)
+                if ok or not controller.reachable:
+                    break
+            if mode == self._target:  # 重试期间没有换目标
+                break
+        ms = (time.perf_counter() - t0) * 1000
+        self.status[controller.api_url] = {"ok": ok, "msg": msg, "ms": round(ms, 1)}
+        return mode, ok, msg
+
+    def set_mode(self, mode):
+        import concurrent.futures
+        self._target = mode
+        futures = {}
+        inflight = set()
+        for c in self.controllers:
+            fut = self._pending.get(c.api_url)
+            if fut is not None and not fut.done():
+                inflight.add(fut)  # 上一轮的任务还在进行，它会接着切到新的模式
+            else:
+                fut = self._pending[c.api_url] = self._pool.submit(self._switch, c)
+            futures[fut] = c
+        # 仍在进行的任务和上一轮就连不上的目标在后台重试，不等待它们
+        waited = [f for f, c in futures.items()
+                  if f not in inflight and (self.status[c.api_url]["ok"] is not False or c.reachable)]
+        waited = waited or [f for f in futures if f not in inflight]
+        if waited:
+            concurrent.futures.wait(waited, timeout=self.deadline())
+        self._overdue = {f for f in self._overdue if not f.done()}
+        parts = []
+        all_ok = True
+        for fut, c in futures.items():
+            name = f"{c.host}:{c.port}"
+            if not fut.done():
+                all_ok = False
+                if fut in waited:
+                    # 不改控制器的 reachable（由它自己的请求线程维护），超时只记在本组，任务结束后自然解除
+                    self._overdue.add(fut)
+                parts.append(f"{name} 超时" if fut in waited else f"{name} 后台重试中")
+                continue
+            done_mode, ok, msg = fut.result()
+            ok = ok and done_mode == mode
+            all_ok = all_ok and ok
+            parts.append(f"{name} {'成功' if ok else '失败'} {self.status[c.api_url]['ms']:.0f}ms")
+        head = f"模式切换: {mode}" if all_ok else f"部分目标切换失败: {mode}"
+        return all_ok, f"{head} [{'; '.join(parts)}]"
+
+    def close(self):
+        for c in self.controllers:
+            c.close()
+        self._pool.shutdown(wait=False)
+
+
+def parse_api_urls(value):
+    """api_url 可以是单个地址、地址列表，或用逗号/空白分隔的多个地址"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = re.split(r"[,\s]+", value or "")
+    return [u.strip() for u in items if u and u.strip()]
+
+
+def create_controller(api_url, connect_timeout=1.0, timeout=3.0, retries=1):
+    urls = parse_api_urls(api_url)
+    controllers = [ClashController(u, connect_timeout, timeout) for u in urls]
+    if len(controllers) == 1:
+        return controllers[0]
+    return ControllerGroup(controllers, retries)
+
+
+def set_clash_mode(mode, api_url):
+    """api_url 可以是地址（一个或多个）或 create_controller 的结果"""
+    if hasattr(api_url, "set_mode"):
+        return api_url.set_mode(mode)
+    controller = create_controller(api_url)
+    try:
+        return controller.set_mode(mode)
+    finally:
+        controller.close()
+
+# ==================== 模式漂移检测 ====================
+class DriftWatcher:
+    """检测 Clash 模式被其他途径（如 Clash Verge 界面）改掉，并在 interval 秒内改回规则选定的模式。
+
+    Clash/mihomo 没有推送配置变化的流式接口，这里用独立的长连接定时做带
+    If-None-Match 的 GET /configs（控制器不支持 ETag 时就是一次普通的小请求）。
+    """
+
+    def __init__(self, api_url, interval=5, connect_timeout=1.0, timeout=3.0):
+        self.controllers = [ClashController(u, connect_timeout, timeout) for u in parse_api_urls(api_url)]
+        self.interval = interval
+        self.expected = None
+        self.corrections = 0
+        self._right_at = {}  # 控制器 -> 最近一次确认模式正确的 monotonic 时间
+        self._stop = threading.Event()
+        self._thread = None
+
+    def expect(self, mode):
+        """监控循环在切换前告知目标模式"""
+        self.expected = mode
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for c in self.controllers:
+            c.close()
+
+    def check(self):
+        """检查一轮，返回本轮纠正的目标数"""
+        expected = self.expected
+        fixed = 0
+        if not expected:
+            return fixed
+        for c in self.controllers:
+            try:
+                actual = c.get_mode(conditional=True)
+            except Exception:
+                continue  # 连不上交给监控循环的退避处理
+            if not actual or expected != self.expected:
+                continue
+            if actual.lower() == expected.lower():
+                self._right_at[c] = time.monotonic()
+                continue
+            t0 = time.perf_counter()
+            ok, msg = c.set_mode(expected)
+            ms = (time.perf_counter() - t0) * 1000
+            if _metrics:
+                _metrics.inc("autovpn_drift_total", target=f"{c.host}:{c.port}")
+                if ok:
+                    # 被改动的时刻未知，从上次确认无误算起（最多多算一个检测间隔）；之前没确认过时只算恢复耗时
+                    since = self._right_at.get(c, time.monotonic() - ms / 1000)
+                    _metrics.inc("autovpn_wrong_mode_seconds_total", time.monotonic() - since)
+            if ok:
+                self._right_at[c] = time.monotonic()
+            log(f"检测到 {c.host}:{c.port} 模式被改为 {actual}（应为 {expected}），"
+                f"{'已恢复' if ok else '恢复失败: ' + msg}（{ms:.0f} ms）")
+            if ok:
+                fixed += 1
+                self.corrections += 1
+        return fixed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                log(f"E 模式漂移检测错误: {e}")
+
+# ==================== 切换后清理 ====================
+def _read_http_response(reader):
+    """从管线连接中读出一个响应，返回状态码（只支持 Content-Length 与 chunked）"""
+    status_line = reader.readline()
+    if not status_line:
+        raise ConnectionError("控制器提前关闭了连接")
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    while True:
+        line = reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        key = key.strip().lower()
+        if key == "content-length":
+            length = int(value.strip())
+        elif key == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int(reader.readline().split(b";")[0].strip() or b"0", 16)
+            reader.read(size + 2)
+            if size == 0:
+                break
+    elif length:
+        reader.read(length)
+    return status
+
+
+def is_proxied_connection(conn, filters=None):
+    """filters 为空时：链路不全是 DIRECT/REJECT 的连接算走代理；否则按链路节点名或规则名匹配"""
+    chains = conn.get("chains") or []
+    if filters:
+        return conn.get("rule") in filters or any(c in filters for c in chains)
+    return any(c not in ("DIRECT", "REJECT") for c in chains)
+
+
+def cutover(controller, filters=None, flush=True, timeout=5.0, poll=0.05):
+    """切到直连后关闭仍走代理的连接并清空 fake-ip/DNS 缓存，返回统计信息。
+
+    先读一次连接列表：全部都需要关闭时用一次 DELETE /connections，否则管线批量关闭匹配的连接；
+    之后轮询直到不再有匹配的连接或超时，记录耗时。
+    """
+    t0 = time.perf_counter()
+    conns = controller.get_connections()
+    matched = [c["id"] for c in conns if is_proxied_connection(c, filters)]
+    stats = {"total": len(conns), "matched": len(matched), "closed": 0, "remaining": 0}
+    if matched:
+        if len(matched) == len(conns):
+            stats["closed"] = len(matched) if controller.close_connections() else 0
+        else:
+            stats["closed"] = controller.close_connections(matched)
+    if flush:
+        stats["flush"] = controller.flush_caches()
+    deadline = t0 + timeout
+    while matched:
+        remaining = sum(1 for c in controller.get_connections() if is_proxied_connection(c, filters))
+        stats["remaining"] = remaining
+        if remaining == 0 or time.perf_counter() >= deadline:
+            break
+        time.sleep(poll)
+    stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return stats
+
+
+def run_cutover(api, filters=None, flush=True, timeout=5.0, log_widget=None):
+    """对一个或多个控制器执行切换后清理并记录日志"""
+    controllers = api.controllers if isinstance(api, ControllerGroup) else [api]
+    for c in controllers:
+        if not isinstance(c, ClashController):
+            continue
+        try:
+            st = cutover(c, filters, flush, timeout)
+        except Exception as e:
+            log(f"E 切换后清理失败 {c.host}:{c.port}: {e}", log_widget)
+            continue
+        if _metrics:
+            _metrics.observe("autovpn_cutover_seconds", st["ms"] / 1000)
+            _metrics.inc("autovpn_cutover_closed_total", st["closed"])
+        log(f"切换后清理 {c.host}:{c.port}: 关闭代理连接 {st['closed']}/{st['matched']}"
+            f"（剩余 {st['remaining']}），耗时 {st['ms']:.0f} ms", log_widget)
+
+# ==================== 代理组选择 ====================
+class GroupSelector:
+    """规则带 "group" 时，连上该网络后为这个代理组选出延迟最低的节点。
+
+    组内节点由控制器并发测速（最多 workers 个同时进行），总时限 deadline 秒，到时仍未返回的节点按不可用处理；
+    选中后 PUT /proxies/{group}。结果按 (控制器, 代理组, 网络) 缓存 ttl 秒，期间重连同一网络只确认/恢复所选节点，不再测速；
+    缓存最多保留 CACHE_SIZE 个网络，写入时先丢弃过期的，再按最久未用淘汰。
+    """
+    SKIP = {"DIRECT", "REJECT", "REJECT-DROP", "PASS", "COMPATIBLE"}
+    CACHE_SIZE = 256
+
+    def __init__(self, url="http://www.gstatic.com/generate_204", timeout=2.0, deadline=3.0, ttl=1800,
+                 workers=16, clock=time.monotonic):
+        self.url = url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.ttl = ttl
+        self.clock = clock
+        self.cache = collections.OrderedDict()  # (api_url, group, 网络) -> (过期时刻, 节点, {节点: 延迟})
+        self._locks = {}  # 同一 key 的选择串行进行，后到的直接用前一次的测速结果；只保留正在使用的 key
+        self._locks_guard = threading.Lock()
+        self.workers = workers
+        self._pool = None  # 第一次测速时才创建（多数配置没有带 group 的规则）
+
+    @staticmethod
+    def network_key(network):
+        # 与状态文件一致：不含 BSSID，同一网络内漫游不算换网络
+        return tuple(_state_network(network))
+
+    def probe(self, controller, nodes):
+        """并发测速，返回 {节点: 毫秒或 None}；总时限内未完成的节点记为 None"""
+        import concurrent.futures
+        with self._locks_guard:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe")
+        futures = {self._pool.submit(controller.proxy_delay, n, self.url, self.timeout): n for n in nodes}
+        done, pending = concurrent.futures.wait(futures, timeout=self.deadline)
+        for fut in pending:
+            fut.cancel()  # 还在排队的不再测
+        delays = {}
+        for fut, node in futures.items():
+            try:
+                delays[node] = fut.result() if fut in done else None
+            except Exception:
+                delays[node] = None
+        return delays
+
+    def select(self, controller, group, network):
+        """为 group 选出并应用最快的节点，返回统计信息 dict"""
+        t0 = time.perf_counter()
+        key = (controller.api_url, group, self.network_key(network))
+        with self._locks_guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])  # [锁, 使用者数]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                return self._select(controller, group, key, t0)
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def _remember(self, key, best, delays):
+        now = self.clock()
+        cache = self.cache
+        for k in [k for k, hit in cache.items() if hit[0] <= now]:
+            del cache[k]
+        cache[key] = (now + self.ttl, best, delays)
+        cache.move_to_end(key)
+        while len(cache) > self.CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def _select(self, controller, group, key, t0):
+        info = controller.get_proxy(group)
+        nodes = [n for n in info.get("all") or [] if n.upper() not in self.SKIP]
+        stats = {"group": group, "nodes": len(nodes), "previous": info.get("now"), "cached": False}
+        hit = self.cache.get(key)
+        if hit and hit[0] > self.clock() and hit[1] in nodes:
+            best, delays = hit[1], hit[2]
+            stats["cached"] = True
+            self.cache.move_to_end(key)
+        else:
+            delays = self.probe(controller, nodes)
+            alive = {n: d for n, d in delays.items() if d is not None}
+            best = min(alive, key=alive.get) if alive else None
+            if best:
+                self._remember(key, best, delays)
+        stats.update(node=best, delay=delays.get(best) if best else None,
+                     alive=sum(1 for d in delays.values() if d is not None))
+        stats["changed"] = bool(best) and best != info.get("now")
+        if stats["changed"] and not controller.select_proxy(group, best):
+            raise OSError(f"PUT /proxies/{group} 失败")
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return stats
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_group_select(api, selector, group, network, log_widget=None, on_done=None):
+    """对一个或多个控制器执行代理组选择并记录日志；结束后调用 on_done(是否全部选定)"""
+    controllers = api.controllers if isinstance(api, ControllerGroup) else [api]
+    ok = True
+    for c in controllers:
+        if not isinstance(c, ClashController):
+            continue
+        try:
+            st = selector.select(c, group, network)
+        except Exception as e:
+            log(f"E 代理组 {group} 选择失败 {c.host}:{c.port}: {e}", log_widget, kind="group", group=group)
+            ok = False
+            continue
+        if _metrics:
+            _metrics.observe("autovpn_group_select_seconds", st["ms"] / 1000, cached=str(st["cached"]).lower())
+        if not st["node"]:
+            log(f"E 代理组 {group}: {st['nodes']} 个节点均不可用（总时限 {selector.deadline:g} 秒）", log_widget,
+                kind="group", group=group)
+            ok = False
+            continue
+        how = "沿用缓存的测速结果" if st["cached"] else f"测速 {st['alive']}/{st['nodes']} 个可用"
+        action = f"切换 {st['previous']} → {st['node']}" if st["changed"] else f"保持 {st['node']}"
+        log(f"代理组 {group}: {how}，{action}（{st['delay']} ms），耗时 {st['ms']:.0f} ms", log_widget,
+            kind="group", group=group, node=st["node"], ms=st["ms"], cached=st["cached"])
+    if on_done:
+        on_done(ok)
+
+
+# ==================== 规则匹配 ====================
+class _SubstringAutomaton:
+    """Aho-Corasick 多模式子串匹配，节点上记录能命中的最小规则序号"""
+    NONE = float("inf")
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [self.NONE]
+
+    def add(self, pattern, rule_idx):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(self.NONE)
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.out[node] = min(self.out[node], rule_idx)
+
+    def build(self):
+        pending = list(self.goto[0].values())
+        for node in pending:
+            for ch, child in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.out[child] = min(self.out[child], self.out[self.fail[child]])
+                pending.append(child)
+
+    def search(self, text, best):
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node] < best:
+                best = out[node]
+        return best
+
+
+class RuleIndex:
+    """编译后的规则表：精确匹配走哈希，通配符/正则逐条检查，普通名称走子串自动机。
+
+    规则 ssids 中每一项的写法：
+        Office        子串匹配（原有行为；不带下列前缀的项里 & * ? 等都按普通字符处理）
+        sub:=Office   子串匹配，用于本身以下列前缀开头的名称
+        =Office-5G    精确匹配
+        glob:Office-* 通配符（* ? [ ] 整串匹配；不带前缀时这些字符按普通字符做子串匹配）
+        re:^HZ-\\d+$   正则（不区分大小写，不能含逗号）
+        bssid:3c:84:6a:aa:bb:cc   所连 AP 的 BSSID
+        gw:00:11:22:33:44:55      默认网关 MAC（有线扩展坞也适用）
+        iface:wired   出口接口类型（wifi/wired）
+        dns:intranet.corp        探测：内网域名能解析
+        tcp:10.0.0.5:445         探测：端口能连上
+        http://10.0.0.5/health   探测：HTTP 状态码小于 400（地址中不能含逗号）
+        *             兜底
+    all: 后用 & 连接的多项需要同时满足，例如 "all:gw:00:11:22:33:44:55&iface:wired"、
+    "all:glob:Corp-*&dns:intranet.corp"；其中的单项写法同上（不能再含 &）。
+    探测项由 ProbeRunner 并发执行：只有可能改变结果的规则（排在无需探测即命中的规则之前）才会探测。
+    匹配结果与逐条检查一致：按规则顺序，第一条命中的规则生效。
+    同一网络指纹的结果会缓存，指纹不变时不再重新匹配。
+    规则还可以带 "group"（代理组名），见 GroupSelector。
+    """
+    CACHE_SIZE = 256
+    KEYS = {"bssid": "bssid", "gw": "gateway_mac", "iface": "iface"}
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.exact = {}
+        self.fields = {field: {} for field in self.KEYS.values()}  # 指纹字段精确匹配
+        self.patterns = []  # (规则序号, 已编译正则)
+        self.compound = []  # (规则序号, [(字段, 判断函数)])，all: 组合项
+        self.probed = []    # (规则序号, [(字段, 判断函数)], [探测项])，含探测的项
+        self.automaton = _SubstringAutomaton()
+        self.fallback = _SubstringAutomaton.NONE
+        for idx, rule in enumerate(self.rules):
+            for raw in rule["ssids"].split(","):
+                self._add(raw.strip(), idx)
+        self.automaton.build()
+        self.patterns.sort(key=lambda p: p[0])
+        self.compound.sort(key=lambda p: p[0])
+        self.probed.sort(key=lambda p: p[0])
+        self.cache = collections.OrderedDict()  # 网络指纹 -> (不探测时命中的规则序号, 需要探测的候选规则)
+
+    def _field(self, lower):
+        """bssid:/gw:/iface: 项 -> (指纹字段, 取值)，其他项返回 None"""
+        key, sep, value = lower.partition(":")
+        if not sep or key not in self.KEYS:
+            return None
+        field = self.KEYS[key]
+        return field, value if field == "iface" else normalize_mac(value) or value
+
+    def _term(self, item):
+        """单项 -> (指纹字段, 判断函数)，供 all: 组合使用"""
+        lower = item.lower()
+        if lower.startswith("sub:"):
+            lower = lower[4:]
+            return "ssid", lambda v: bool(v) and lower in v
+        field = self._field(lower)
+        if field:
+            return field[0], field[1].__eq__
+        if lower.startswith("re:"):
+            return "ssid", re.compile(item[3:], re.IGNORECASE).search
+        if lower.startswith("="):
+            return "ssid", lambda v: v == lower[1:]
+        if lower.startswith("glob:"):
+            return "ssid", re.compile(fnmatch.translate(lower[5:])).match
+        return "ssid", lambda v: bool(v) and lower in v
+
+    def _add(self, item, idx):
+        if not item:
+            return
+        lower = item.lower()
+        if lower.startswith("sub:"):
+            if lower[4:]:
+                self.automaton.add(lower[4:], idx)
+            return
+        if lower.startswith("all:"):
+            items = [t.strip() for t in item[4:].split("&") if t.strip()]
+            probes = [probe_item(t) for t in items]
+            terms = [self._term(t) for t, p in zip(items, probes) if p is None]
+            if any(probes):
+                self.probed.append((idx, terms, [p for p in probes if p]))
+            elif terms:
+                self.compound.append((idx, terms))
+            return
+        probe = probe_item(item)
+        if probe:
+            self.probed.append((idx, [], [probe]))
+            return
+        field = self._field(lower)
+        if field:
+            self.fields[field[0]].setdefault(field[1], idx)
+        elif lower == "*":
+            self.fallback = min(self.fallback, idx)
+        elif lower.startswith("re:"):
+            self.patterns.append((idx, re.compile(item[3:], re.IGNORECASE).search))
+        elif lower.startswith("="):
+            self.exact.setdefault(lower[1:], idx)
+        elif lower.startswith("glob:"):
+            self.patterns.append((idx, re.compile(fnmatch.translate(lower[5:])).match))
+        else:
+            self.automaton.add(lower, idx)
+
+    def match(self, network):
+        """network 为 SSID 或 NetworkFingerprint；返回匹配的 mode，或 None"""
+        rule = self.lookup(network)
+        return rule["mode"] if rule else None
+
+    def lookup(self, network, runner=None):
+        """返回第一条命中的规则（dict），或 None。
+        runner 为执行探测的 ProbeRunner，缺省用全局的；为 False 时探测项一律视为不满足（离线回放）。
+        """
+        fp = network if isinstance(network, NetworkFingerprint) else NetworkFingerprint(network, None, None, None)
+        cache = self.cache
+        if fp in cache:
+            cache.move_to_end(fp)
+            best, candidates = cache[fp]
+        else:
+            best = self._match(fp)
+            candidates = self._candidates(fp, best) if self.probed else ()
+            cache[fp] = best, candidates
+            if len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
+        if candidates and runner is not False:
+            key = (fp.ssid, fp.gateway_mac, fp.iface)
+            won = (runner or get_probe_runner()).run(key, candidates)
+            if won is not None:
+                best = won
+        return self.rules[best] if best != _SubstringAutomaton.NONE else None
+
+    def _candidates(self, fp, best):
+        """排在 best 之前、除探测项外都已满足的规则"""
+        values = {"ssid": (fp.ssid or "").lower(), "bssid": fp.bssid, "gateway_mac": fp.gateway_mac, "iface": fp.iface}
+        return tuple((idx, probes) for idx, terms, probes in self.probed
+                     if idx < best and all(values[field] and fn(values[field]) for field, fn in terms))
+
+    def _match(self, fp):
+        ssid_lower = (fp.ssid or "").lower()
+        best = min(self.fallback, self.exact.get(ssid_lower, self.fallback))
+        for field, table in self.fields.items():
+            value = getattr(fp, field)
+            if value and table:
+                best = min(best, table.get(value, best))
+        if ssid_lower:
+            best = self.automaton.search(ssid_lower, best)
+        for idx, fn in self.patterns:
+            if idx >= best:
+                break
+            if fn(ssid_lower):
+                best = idx
+                break
+        if self.compound:
+            values = {"ssid": ssid_lower, "bssid": fp.bssid, "gateway_mac": fp.gateway_mac, "iface": fp.iface}
+            for idx, terms in self.compound:
+                if idx >= best:
+                    break
+                if all(values[field] and fn(values[field]) for field, fn in terms):
+                    best = idx
+                    break
+        return best
+
+
+_rule_index_cache = (None, None)
+
+def compile_rules(rules):
+    """把规则列表编译为 RuleIndex；内容未变时复用上次的结果"""
+    global _rule_index_cache
+    if isinstance(rules, RuleIndex):
+        return rules
+    key = tuple((r["ssids"], r["mode"], r.get("group")) for r in rules)
+    if _rule_index_cache[0] != key:
+        _rule_index_cache = (key, RuleIndex(rules))
+    return _rule_index_cache[1]
+
+
+def match_rule(network, rules):
+    """返回匹配的 mode，或 None；network 为 SSID 或 NetworkFingerprint，rules 可以是规则列表或 compile_rules 的结果"""
+    return compile_rules(rules).match(network)
+
+
+# ==================== 网络变化监听 ====================
+class NetworkWatcher:
+    """网络变化监听基类：后台收到系统事件后立即唤醒监控循环，轮询只作兜底"""
+    name = "poll"
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self.alive = False
+        self.last_change = None  # 本轮第一条网络变化事件的 monotonic 时间
+        self.events = 0
+        self.settle = 0.3        # 合并连续事件的静默时间（秒）
+        self.max_settle = 2.0
+        self._urgent = False     # 本轮唤醒不需要合并等待（如配置变化）
+
+    def start(self):
+        self._open()
+        self.alive = True
+        threading.Thread(target=self._reader, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self._wake.set()
+        try:
+            self._close()
+        except:
+            pass
+
+    def notify(self, settle=True):
+        """事件源回调：记录变化时间并唤醒等待方；settle=False 时跳过合并等待"""
+        self.events += 1
+        if not settle:
+            self._urgent = True
+        if not self._wake.is_set():
+            self.last_change = time.monotonic()
+            self._wake.set()
+
+    def wait(self, timeout):
+        """等待网络变化或超时，返回 True 表示被事件唤醒"""
+        if not self._wake.wait(timeout) or self._closed.is_set():
+            return False
+        # 一次切网往往带来一串事件（断开、关联、拿到地址），合并后再检查
+        deadline = time.monotonic() + self.max_settle
+        while not self._closed.is_set() and not self._urgent:
+            self._wake.clear()
+            left = deadline - time.monotonic()
+            if left <= 0 or self.settle <= 0 or not self._wake.wait(min(self.settle, left)):
+                break
+        self._wake.clear()
+        self._urgent = False
+        return not self._closed.is_set()
+
+    def _reader(self):
+        try:
+            while not self._closed.is_set():
+                changed = self._read()
+                if changed is None:
+                    break
+                if changed:
+                    self.notify()
+        except Exception as e:
+            if not self._closed.is_set():
+                log(f"E 网络事件监听中断({self.name}): {e}")
+        finally:
+            self.alive = False
+
+    # 子类实现
+    def _open(self):
+        pass
+
+    def _read(self):
+        """阻塞读取一批事件，返回是否包含网络变化；返回 None 表示事件源已结束"""
+        return None
+
+    def _close(self):
+        pass
+
+
+class ManualWatcher(NetworkWatcher):
+    """没有系统事件源，只由调用方 notify() 唤醒（基准测试、外部触发重新检查）"""
+    name = "manual"
+
+    def _read(self):
+        self._closed.wait()
+        return None
+
+
+class NetlinkWatcher(NetworkWatcher):
+    """Linux rtnetlink：链路、地址、路由变化"""
+    name = "netlink"
+    RTMGRP_LINK = 0x1
+    RTMGRP_IPV4_IFADDR = 0x10
+    RTMGRP_IPV4_ROUTE = 0x40
+    RTMGRP_IPV6_IFADDR = 0x100
+    # RTM_NEWLINK/DELLINK/NEWADDR/DELADDR/NEWROUTE/DELROUTE
+    CHANGE_TYPES = {16, 17, 20, 21, 24, 25}
+
+    def __init__(self, sock=None):
+        super().__init__()
+        self.sock = sock  # 测试时可传入伪造的事件源（如 socketpair）
+
+    def _open(self):
+        if self.sock is None:
+            groups = self.RTMGRP_LINK | self.RTMGRP_IPV4_IFADDR | self.RTMGRP_IPV4_ROUTE | self.RTMGRP_IPV6_IFADDR
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, groups))
+            self.sock = sock
+        self.sock.settimeout(1.0)
+
+    def _read(self):
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return False
+        if not data:
+            return None
+        return any(t in self.CHANGE_TYPES for t in self.parse(data))
+
+    @staticmethod
+    def parse(data):
+        """解析 nlmsghdr，返回消息类型列表"""
+        types = []
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=IH", data, offset)
+            if length < 16:
+                break
+            types.append(msg_type)
+            offset += (length + 3) & ~3
+        return types
+
+    def _close(self):
+        if self.sock:
+            self.sock.close()
+
+
+class DBusWatcher(NetworkWatcher):
+    """Linux NetworkManager：通过 gdbus monitor 订阅 D-Bus 信号"""
+    name = "dbus"
+    CMD = ["gdbus", "monitor", "--system", "--dest", "org.freedesktop.NetworkManager"]
+    KEYWORDS = ("StateChanged", "PrimaryConnection", "ActiveConnections", "ActiveAccessPoint")
+
+    def __init__(self, stream=None, cmd=None):
+        super().__init__()
+        self.stream = stream  # 测试时可传入伪造的信号输出流
+        self.cmd = cmd or self.CMD
+        self.proc = None
+
+    def _open(self):
+        if self.stream is None:
+            self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                         text=True, encoding="utf-8", errors="replace")
+            self.stream = self.proc.stdout
+
+    def _read(self):
+        line = self.stream.readline()
+        if not line:
+            return None
+        return any(k in line for k in self.KEYWORDS)
+
+    def _close(self):
+        if self.proc:
+            self.proc.terminate()
+        elif self.stream:
+            self.stream.close()
+
+
+class WlanWatcher(NetworkWatcher):
+    """Windows：WlanRegisterNotification 的 ACM 连接/断开通知"""
+    name = "wlan"
+    WLAN_NOTIFICATION_SOURCE_ACM = 0x8
+    # connection_complete / interface_arrival / interface_removal / disconnected
+    ACM_CODES = {10, 13, 14, 21}
+
+    def _open(self):
+        wlanapi = ctypes.windll.wlanapi
+        self._api = wlanapi
+        self._handle = ctypes.c_void_p()
+        negotiated = ctypes.c_ulong()
+        if wlanapi.WlanOpenHandle(2, None, ctypes.byref(negotiated), ctypes.byref(self._handle)) != 0:
+            raise OSError("WlanOpenHandle 失败")
+        callback_type = ctypes.WINFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
+        # 回调需要持有引用，否则会被回收
+        self._callback = callback_type(self._on_notification)
+        prev = ctypes.c_ulong()
+        if wlanapi.WlanRegisterNotification(self._handle, self.WLAN_NOTIFICATION_SOURCE_ACM, True,
+                                            self._callback, None, None, ctypes.byref(prev)) != 0:
+            wlanapi.WlanCloseHandle(self._handle, None)
+            raise OSError("WlanRegisterNotification 失败")
+
+    def _on_notification(self, data, context):
+        try:
+            # WLAN_NOTIFICATION_DATA 前两个 DWORD 为 NotificationSource、NotificationCode
+            code = ctypes.cast(data, ctypes.POINTER(ctypes.c_ulong))[1]
+            if code in self.ACM_CODES:
+                self.notify()
+        except:
+            pass
+
+    def _read(self):
+        # 通知由系统线程池回调，这里只负责保持存活状态
+        self._closed.wait()
+        return None
+
+    def _close(self):
+        if getattr(self, "_handle", None):
+            self._api.WlanCloseHandle(self._handle, None)
+            self._handle = None
+
+
+def create_network_watcher(kind="auto"):
+    """按平台创建并启动网络变化监听，全部不可用时返回 None（退回定时轮询）"""
+    if kind in (False, None, "poll"):
+        return None
+    if sys.platform == "win32":
+        candidates = [WlanWatcher]
+    elif sys.platform.startswith("linux"):
+        candidates = [NetlinkWatcher]
+        if shutil.which("gdbus"):
+            candidates.append(DBusWatcher)
+    else:
+        candidates = []
+    if kind not in (True, "auto"):
+        candidates = [c for c in candidates if c.name == kind]
+    for cls in candidates:
+        try:
+            return cls().start()
+        except Exception as e:
+            log(f"网络事件监听不可用({cls.name}): {e}")
+    return None
+
+# ==================== 休眠唤醒 ====================
+class LogindSleepSource:
+    """Linux：通过 gdbus monitor 订阅 systemd-logind 的 PrepareForSleep 信号（true 为即将休眠，false 为已唤醒）"""
+    name = "logind"
+    CMD = ["gdbus", "monitor", "--system", "--dest", "org.freedesktop.login1",
+           "--object-path", "/org/freedesktop/login1"]
+
+    def __init__(self, stream=None, cmd=None):
+        self.stream = stream  # 测试时可传入伪造的信号输出流
+        self.cmd = cmd or self.CMD
+        self.proc = None
+
+    def start(self, power):
+        if self.stream is None:
+            self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                         text=True, encoding="utf-8", errors="replace")
+            self.stream = self.proc.stdout
+        threading.Thread(target=self._reader, args=(power,), daemon=True).start()
+        return self
+
+    def _reader(self, power):
+        for line in self.stream:
+            if "PrepareForSleep" not in line:
+                continue
+            if "true" in line.split("PrepareForSleep", 1)[1]:
+                power.suspending(self.name)
+            else:
+                power.resumed(self.name)
+
+    def stop(self):
+        if self.proc:
+            self.proc.terminate()
+        elif self.stream:
+            self.stream.close()
+
+
+class WindowsPowerSource:
+    """Windows：PowerRegisterSuspendResumeNotification 回调（PBT_APMSUSPEND / PBT_APMRESUME*）"""
+    name = "power"
+    PBT_APMSUSPEND = 0x4
+    RESUME_TYPES = {0x7, 0x12}  # PBT_APMRESUMESUSPEND、PBT_APMRESUMEAUTOMATIC
+
+    def start(self, power):
+        callback_type = ctypes.WINFUNCTYPE(ctypes.c_ulong, ctypes.c_void_p, ctypes.c_ulong, ctypes.c_void_p)
+
+        class Params(ctypes.Structure):
+            _fields_ = [("Callback", callback_type), ("Context", ctypes.c_void_p)]
+
+        def on_event(context, kind, setting):
+            if kind == self.PBT_APMSUSPEND:
+                power.suspending(self.name)
+            elif kind in self.RESUME_TYPES:
+                power.resumed(self.name)
+            return 0
+
+        # 回调和参数结构需要持有引用，否则会被回收
+        self._params = Params(callback_type(on_event), None)
+        self._handle = ctypes.c_void_p()
+        DEVICE_NOTIFY_CALLBACK = 2
+        if ctypes.windll.powrprof.PowerRegisterSuspendResumeNotification(
+                DEVICE_NOTIFY_CALLBACK, ctypes.byref(self._params), ctypes.byref(self._handle)) != 0:
+            raise OSError("PowerRegisterSuspendResumeNotification 失败")
+        return self
+
+    def stop(self):
+        if getattr(self, "_handle", None):
+            ctypes.windll.powrprof.PowerUnregisterSuspendResumeNotification(self._handle)
+            self._handle = None
+
+
+class PowerWatcher:
+    """休眠/唤醒检测。系统电源事件为主，时钟跳变检测兜底：
+    每 period 秒比较一次墙钟与 monotonic 的走时，挂起期间 monotonic 不走（Linux）或本线程没被调度（其他系统），
+    两者相差超过 threshold 秒即视为刚从休眠中恢复。同一次唤醒被多个来源报告时只算一次。
+    唤醒时调用 notify（唤醒监控线程），monitor_loop 看到 resumes 变化后丢弃缓存的判断并立即重新决策。
+    时钟可替换，用于模拟跳变。
+    """
+
+    def __init__(self, notify=None, sources=(), period=5.0, threshold=10.0, wall=time.time, mono=time.monotonic):
+        self.notify = notify or _noop
+        self.sources = list(sources)
+        self.period = period
+        self.threshold = threshold
+        self.wall = wall
+        self.mono = mono
+        self.resumes = 0
+        self.last_resume = None  # (来源, 休眠秒数或 None)
+        self.suspended_at = None  # 收到“即将休眠”时的墙钟时间
+        self._resumed_mono = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._base = (wall(), mono())
+
+    @property
+    def name(self):
+        return "+".join([s.name for s in self.sources] + ["clock"])
+
+    def start(self):
+        started = []
+        for source in self.sources:
+            try:
+                started.append(source.start(self))
+            except Exception as e:
+                log(f"电源事件监听不可用({source.name}): {e}")
+        self.sources = started
+        self._base = (self.wall(), self.mono())
+        threading.Thread(target=self._ticker, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        for source in self.sources:
+            try:
+                source.stop()
+            except Exception:
+                pass
+
+    def _ticker(self):
+        while not self._closed.wait(self.period):
+            self.check()
+
+    def check(self):
+        """时钟跳变检测，发现跳变时按唤醒处理并返回 True"""
+        wall, mono = self.wall(), self.mono()
+        last_wall, last_mono = self._base
+        self._base = (wall, mono)
+        d_wall, d_mono = wall - last_wall, mono - last_mono
+        if max(d_wall - d_mono, d_mono - self.period) <= self.threshold:
+            return False
+        return self.resumed("clock", max(d_wall, d_mono) - self.period)
+
+    def suspending(self, source):
+        self.suspended_at = self.wall()
+
+    def resumed(self, source, slept=None):
+        with self._lock:
+            mono = self.mono()
+            if self._resumed_mono is not None and mono - self._resumed_mono < max(self.period, self.threshold):
+                return False  # 同一次唤醒的另一个来源
+            self._resumed_mono = mono
+            if slept is None and self.suspended_at is not None:
+                slept = self.wall() - self.suspended_at
+            self.suspended_at = None
+            self._base = (self.wall(), mono)
+            self.last_resume = (source, slept)
+            self.resumes += 1
+        self.notify()
+        return True
+
+
+def create_power_watcher(notify=None, threshold=10.0):
+    """按平台选择电源事件来源并启动；时钟跳变检测总是启用"""
+    sources = []
+    if sys.platform == "win32":
+        sources.append(WindowsPowerSource())
+    elif sys.platform.startswith("linux") and shutil.which("gdbus"):
+        sources.append(LogindSleepSource())
+    return PowerWatcher(notify, sources, threshold=threshold).start()
+
+# ==================== 配置热加载 ====================
+# 修改后由监控循环直接应用的配置项（或与监控无关的界面设置），其余项需重启监控
+CONFIG_HOT_KEYS = {"rules", "interval", "fast_interval", "max_interval", "max_backoff", "fingerprint",
+                   "hot_reload", "autostart", "log_view_lines"}
+
+
+class ConfigSnapshot(collections.namedtuple("ConfigSnapshot", "config rules version stamp load_ms")):
+    """校验并编译好的只读配置：config 为只读映射，rules 为 RuleIndex，stamp 为文件 (mtime_ns, size, inode)"""
+    __slots__ = ()
+
+
+def validate_config(data):
+    """合并默认值并检查字段类型，返回新的配置字典；不合法时抛 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("配置必须是 JSON 对象")
+    config = DEFAULT_CONFIG.copy()
+    config.update(data)
+    rules = config["rules"]
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("rules 必须是非空列表")
+    if not isinstance(config["rules_url"], str):
+        raise ValueError("rules_url 必须是地址或文件路径")
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get("ssids"), str) \
+                or not isinstance(rule.get("mode"), str) or not rule["mode"]:
+            raise ValueError(f"rules[{i}] 需要字符串 ssids 和 mode")
+        if rule.get("group") is not None and (not isinstance(rule["group"], str) or not rule["group"]):
+            raise ValueError(f"rules[{i}].group 必须是代理组名")
+    try:
+        compile_rules(rules)  # 正则和探测项写错时在这里报出来，而不是到监控线程里才出错
+    except re.error as e:
+        raise ValueError(f"规则中的正则无效: {e}")
+    except ValueError as e:
+        raise ValueError(f"规则无效: {e}")
+    for key in ("interval", "fast_interval", "max_interval", "max_backoff", "connect_timeout", "request_timeout",
+                "rules_refresh", "probe_budget"):
+        value = config[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{key} 必须是正数")
+    return config
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def make_snapshot(config, version=0, stamp=None):
+    """校验配置并预编译规则；出错时抛 ValueError"""
+    t0 = time.perf_counter()
+    config = validate_config(config)
+    try:
+        rules = compile_rules(config["rules"])  # validate_config 已编译过，这里取缓存
+    except (re.error, ValueError) as e:
+        raise ValueError(f"规则无效: {e}")
+    return ConfigSnapshot(types.MappingProxyType(config), rules, version, stamp,
+                          (time.perf_counter() - t0) * 1000)
+
+
+def load_snapshot(path, version=0):
+    stamp = _file_stamp(path)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return make_snapshot(data, version, stamp)
+
+
+class ConfigWatcher:
+    """监视配置文件，变化后在后台线程解析、校验、编译成新快照，再整体替换 snapshot。
+
+    Linux 用 inotify 监视所在目录（兼容改名替换式保存），其他平台或 inotify 不可用时按 interval 轮询文件状态。
+    解析失败时保留上一版并记录一次错误；notify 在新快照就绪后调用，用于唤醒监控循环。
+    """
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, path, config=None, interval=1.0, notify=None, use_inotify=True):
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self.notify = notify
+        self.use_inotify = use_inotify and sys.platform.startswith("linux")
+        self.backend = None
+        stamp = _file_stamp(self.path)
+        if config is not None:
+            self.snapshot = make_snapshot(config, 0, stamp)
+        else:
+            self.snapshot = load_snapshot(self.path)
+        self.reloads = 0
+        self.errors = 0
+        self._seen = stamp  # 最近处理过的文件状态（含解析失败的版本）
+        self._fd = None
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.use_inotify:
+            try:
+                self._fd = self._inotify_open()
+                self.backend = "inotify"
+            except (OSError, AttributeError) as e:
+                log(f"配置文件监听退回轮询: {e}")
+        self.backend = self.backend or "poll"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(2)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _inotify_open(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, "inotify_add_watch 失败")
+        return fd
+
+    def _inotify_wait(self):
+        """等待一批目录事件，返回其中是否有配置文件"""
+        import select
+        if not select.select([self._fd], [], [], self.interval)[0]:
+            return False
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return False
+        name = os.path.basename(self.path).encode()
+        hit = False
+        pos = 0
+        while pos + 16 <= len(data):
+            _, _, _, length = struct.unpack_from("iIII", data, pos)
+            if data[pos + 16:pos + 16 + length].rstrip(b"\0") == name:
+                hit = True
+            pos += 16 + length
+        return hit
+
+    def _run(self):
+        while not self._closed.is_set():
+            if self._fd is not None:
+                if not self._inotify_wait():
+                    continue
+            elif self._closed.wait(self.interval):
+                break
+            self.check()
+
+    def check(self, force=False):
+        """文件状态变了（force 时不论是否变化）就重新加载；返回是否换上了新快照"""
+        stamp = _file_stamp(self.path)
+        if stamp is None or (stamp == self._seen and not force):
+            return False
+        self._seen = stamp
+        try:
+            snap = load_snapshot(self.path, self.snapshot.version + 1)
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            log(f"E 配置文件无效，继续使用上一版: {e}")
+            return False
+        self.snapshot = snap
+        self.reloads += 1
+        if _metrics:
+            _metrics.observe("autovpn_config_reload_seconds", snap.load_ms / 1000)
+        if self.notify:
+            self.notify()
+        return True
+
+# ==================== 集中规则 ====================
+RULES_CACHE = os.path.join(BASE_PATH, "autovpn_rules_cache.json")  # 上次拉取到的集中规则原文及 ETag
+RULES_MAX_BYTES = 4 * 1024 * 1024
+RULES_SIGNATURE_KEYS = ("sha256", "hmac")
+
+
+def _rules_payload(doc):
+    """去掉校验字段后的规范化 JSON，校验和与签名都按它计算"""
+    body = {k: v for k, v in doc.items() if k not in RULES_SIGNATURE_KEYS}
+    return json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def sign_rules_document(doc, key=None):
+    """给规则文档加上 sha256 校验和；给出 key 时再加 HMAC-SHA256 签名"""
+    import hashlib
+    import hmac
+    payload = _rules_payload(doc)
+    doc = {k: v for k, v in doc.items() if k not in RULES_SIGNATURE_KEYS}
+    doc["sha256"] = hashlib.sha256(payload).hexdigest()
+    if key:
+        doc["hmac"] = hmac.new(key.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+    return doc
+
+
+def parse_rules_document(text, key=None):
+    """解析并校验下发的规则文档 {"version", "rules", "sha256"/"hmac"}，返回 (版本, 规则列表)；不合法时抛 ValueError"""
+    import hashlib
+    import hmac
+    doc = json.loads(text)
+    if not isinstance(doc, dict):
+        raise ValueError("规则文档必须是 JSON 对象")
+    payload = _rules_payload(doc)
+    if key:
+        expect = hmac.new(key.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(str(doc.get("hmac", "")).encode("utf-8"), expect.encode("ascii")):
+            raise ValueError("签名不匹配")
+    elif "sha256" in doc:
+        if not hmac.compare_digest(str(doc["sha256"]).lower().encode("utf-8"),
+                                   hashlib.sha256(payload).hexdigest().encode("ascii")):
+            raise ValueError("校验和不匹配")
+    else:
+        raise ValueError("缺少 sha256 校验和")
+    rules = validate_config({"rules": doc.get("rules")})["rules"]
+    return str(doc.get("version") or ""), rules
+
+
+def merge_rules(local, remote):
+    """本地规则优先：本地的具体规则、下发的规则，最后是兜底的 * 规则（本地有就用本地的）"""
+    def fallback(rule):
+        return rule["ssids"].strip() == "*"
+    tail = [r for r in local if fallback(r)][:1] or [r for r in remote if fallback(r)][:1]
+    return [r for r in local if not fallback(r)] + [r for r in remote if not fallback(r)] + tail
+
+
+class RulesFeed:
+    """集中下发的规则：从 URL 或共享路径拉取带校验和（或签名）的规则文档，与本地规则合并使用。
+
+    HTTP 源带 If-None-Match / If-Modified-Since 条件请求，未修改时服务器只回 304，不再下载和解析；
+    文件源比较文件状态，未变时不读取；下载到的内容与上一版相同时同样不解析。成功拉取的原文连同 ETag 等写入本地缓存，离线启动时直接用缓存。
+    拉取失败或校验不通过时继续使用上一版；拉取间隔带随机抖动，避免大量客户端同时请求。
+    """
+
+    def __init__(self, source, cache_path=None, interval=3600, jitter=0.1, key=None, timeout=10.0, notify=None):
+        self.source = source
+        self.is_http = source.lower().startswith(("http://", "https://"))
+        self.cache_path = cache_path
+        self.interval = interval
+        self.jitter = jitter
+        self.key = key or None
+        self.timeout = timeout
+        self.notify = notify
+        self.rules = []        # 最近一版下发的规则
+        self.version = None    # 文档自带的版本号
+        self.revision = 0      # 每换上一版规则加一，监控循环据此重新合并
+        self.meta = {}         # 条件请求用的 etag / last_modified，文件源为 stamp；digest 为原文的 sha256
+        self.fetched = None    # 最近一次确认规则为最新的时间
+        self.stats = collections.Counter()  # requests / updated / not_modified / errors / bytes
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self.load_cache()
+
+    def load_cache(self):
+        """从本地缓存恢复上一版规则；缓存来自别的地址或校验不通过时忽略"""
+        if not self.cache_path:
+            return False
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("source") != self.source:
+                return False
+            version, rules = parse_rules_document(cache["document"], self.key)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log(f"E 集中规则缓存无效，已忽略: {e}", kind="rules")
+            return False
+        self._apply(version, rules)
+        self.meta = cache.get("meta") or {}
+        self.fetched = cache.get("fetched")
+        return True
+
+    def _apply(self, version, rules):
+        self.rules = rules
+        self.version = version
+        self.revision += 1
+
+    def _fetch_http(self):
+        import urllib.request
+        import urllib.error
+        req = urllib.request.Request(self.source, headers={"Accept": "application/json", "User-Agent": "AutoVPN"})
+        if self.meta.get("etag"):
+            req.add_header("If-None-Match", self.meta["etag"])
+        if self.meta.get("last_modified"):
+            req.add_header("If-Modified-Since", self.meta["last_modified"])
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                raw = resp.read(RULES_MAX_BYTES + 1)
+                headers = resp.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, None
+            raise
+        self.stats["bytes"] += len(raw)
+        return raw, {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+    def _fetch_file(self):
+        path = self.source[len("file://"):] if self.source.startswith("file://") else self.source
+        stamp = _file_stamp(path)
+        if stamp is None:
+            raise FileNotFoundError(f"无法访问 {path}")
+        if list(stamp) == self.meta.get("stamp"):
+            return None, None
+        with open(path, "rb") as f:
+            raw = f.read(RULES_MAX_BYTES + 1)
+        self.stats["bytes"] += len(raw)
+        return raw, {"stamp": list(stamp)}
+
+    def refresh(self):
+        """拉取一次，返回 "updated"、"not_modified" 或 "error" """
+        import hashlib
+        with self._lock:
+            t0 = time.perf_counter()
+            self.stats["requests"] += 1
+            try:
+                raw, meta = self._fetch_http() if self.is_http else self._fetch_file()
+                if raw is not None:
+                    if len(raw) > RULES_MAX_BYTES:
+                        raise ValueError(f"文档超过 {RULES_MAX_BYTES // 1024 // 1024} MB")
+                    meta["digest"] = hashlib.sha256(raw).hexdigest()
+                    if meta["digest"] == self.meta.get("digest"):
+                        # 服务器不支持条件请求或文件只是被 touch 过：内容相同就不再解析
+                        self.meta = meta
+                        raw = None
+                    else:
+                        text = raw.decode("utf-8")
+                        version, rules = parse_rules_document(text, self.key)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                result = "error"
+                log(f"E 集中规则拉取失败，继续使用{'上一版' if self.revision else '本地规则'}: {e}", kind="rules")
+            else:
+                self.fetched = time.time()
+                if raw is None:
+                    result = "not_modified"
+                else:
+                    result = "updated"
+                    self._apply(version, rules)
+                    self.meta = meta  # 校验通过后才记下 ETag，否则坏文档会一直被 304 挡住
+                    self._save(text)
+                    log(f"集中规则已更新（版本 {version or '未标注'}，{len(rules)} 条，{len(raw) / 1024:.1f} KB，"
+                        f"{(time.perf_counter() - t0) * 1000:.0f} ms）", kind="rules", version=version)
+            self.stats[result] += 1
+        if _metrics:
+            _metrics.inc("autovpn_rules_fetch_total", result=result)
+        if result == "updated" and self.notify:
+            self.notify()
+        return result
+
+    def _save(self, text):
+        if not self.cache_path:
+            return
+        try:
+            _write_json_atomic(self.cache_path, {"source": self.source, "fetched": self.fetched,
+                                                 "meta": self.meta, "document": text})
+        except OSError as e:
+            log(f"E 集中规则缓存写入失败: {e}", kind="rules")
+
+    def next_delay(self, failures=0):
+        """下次拉取前等待的秒数：间隔乘以 1±jitter 的随机因子；连续失败时从 60 秒起翻倍重试，不超过间隔"""
+        base = self.interval if not failures else min(self.interval, 60 * 2 ** (failures - 1))
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rules-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(2)
+
+    def _run(self):
+        # 有缓存时首次拉取也错开，避免整批电脑同时开机时一起请求
+        delay = random.uniform(0, min(30.0, self.interval * self.jitter)) if self.revision else 0
+        failures = 0
+        while not self._closed.wait(delay):
+            failures = failures + 1 if self.refresh() == "error" else 0
+            delay = self.next_delay(failures)
+
+
+def create_rules_feed(config, notify=None):
+    """按配置创建集中规则源（未启动，已载入本地缓存）；没有配置 rules_url 时返回 None"""
+    source = config.get("rules_url") or ""
+    if not source:
+        return None
+    if not source.lower().startswith(("http://", "https://", "file://")):
+        source = os.path.join(os.path.dirname(CONFIG_FILE), os.path.expanduser(source))
+    return RulesFeed(source, RULES_CACHE, config.get("rules_refresh", 3600), config.get("rules_jitter", 0.1),
+                     config.get("rules_key"), config.get("request_timeout", 3.0) * 3, notify)
+
+# ==================== 运行指标 ====================
+class Metrics:
+    """计数器、直方图和仪表值，可输出 Prometheus 文本格式或 JSON 快照"""
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # 每个直方图：各桶计数（不累计）+ 总和 + 次数
+        self.gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(self.BUCKETS) + 3)
+            h[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @staticmethod
+    def _escape(value):
+        """标签值转义：反斜杠、双引号、换行"""
+        return str(value).replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
+
+    @classmethod
+    def _labels(cls, labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{cls._escape(v)}"' for k, v in items) + "}"
+
+    def prometheus(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            declare(name, "gauge")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in histograms:
+            declare(name, "histogram")
+            total = 0
+            for bound, count in zip(self.BUCKETS + ("+Inf",), h[:-2]):
+                total += count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {total}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {h[-1]}")
+        lines.append(f"autovpn_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON 友好的快照；直方图给出次数、平均值和按桶估算的 p50/p99（秒）"""
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+
+        def key_str(key):
+            return key[0] + self._labels(key[1])
+
+        def quantile(h, q):
+            target = q * h[-1]
+            total = 0
+            for bound, count in zip(self.BUCKETS + (float("inf"),), h[:-2]):
+                total += count
+                if total >= target:
+                    return bound
+            return float("inf")
+        return {
+            "uptime_seconds": round(time.time() - self.started),
+            "counters": {key_str(k): v for k, v in counters.items()},
+            "gauges": {key_str(k): v for k, v in gauges.items()},
+            "histograms": {key_str(k): {"count": h[-1], "avg": round(h[-2] / h[-1], 6) if h[-1] else 0,
+                                        "p50_le": quantile(h, 0.5), "p99_le": quantile(h, 0.99)}
+                           for k, h in histograms.items()},
+        }
+
+
+# 关闭时为 None，热路径只多一次判断
+_metrics = None
+_metrics_server = None
+
+def enable_metrics(port=None, host="127.0.0.1"):
+    """开启指标收集；给出端口时在本机提供 /metrics（Prometheus）和 /metrics.json"""
+    global _metrics, _metrics_server
+    if _metrics is None:
+        _metrics = Metrics()
+    if port and _metrics_server is None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    data = json.dumps(_metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                    ctype = "application/json"
+                elif self.path.startswith("/metrics"):
+                    data = _metrics.prometheus().encode("utf-8")
+                    ctype = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), Handler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+            log(f"指标接口: http://{host}:{port}/metrics")
+        except OSError as e:
+            log(f"指标接口启动失败: {e}")
+    return _metrics
+
+
+def disable_metrics():
+    global _metrics, _metrics_server
+    _metrics = None
+    if _metrics_server:
+        _metrics_server.shutdown()
+        _metrics_server.server_close()
+        _metrics_server = None
+
+# ==================== 轮询调度 ====================
+class PollScheduler:
+    """自适应轮询间隔：
+    fast     网络刚变化或切换失败后，按 fast 间隔连续检查几次
+    stable   之后每次乘以 growth 逐步放慢，直到 max_stable
+    backoff  Clash API 连不上时指数退避并加抖动，直到 max_backoff
+    clock/rand 可替换，便于用假时钟验证。
+    """
+    FAST, STABLE, BACKOFF = "fast", "stable", "backoff"
+
+    def __init__(self, base=15, fast=2, max_stable=60, max_backoff=300, fast_ticks=3,
+                 growth=1.5, jitter=0.2, clock=time.monotonic, rand=random.random, boot_grace=0):
+        self.base = base
+        self.fast = min(fast, base)
+        self.max_stable = max(max_stable, base)
+        self.max_backoff = max_backoff
+        self.fast_ticks = fast_ticks
+        self.growth = growth
+        self.jitter = jitter
+        self.clock = clock
+        self.rand = rand
+        self.state = self.FAST
+        self.delay = self.fast
+        self.failures = 0
+        self.next_at = clock()
+        self.boot_until = clock() + boot_grace  # 登录时 Clash 可能还没起来，这段时间内连不上也按 fast 重试
+        self._fast_left = fast_ticks
+
+    def reconfigure(self, base, fast, max_stable, max_backoff):
+        """配置热加载时更新间隔参数，保留当前状态"""
+        self.base = base
+        self.fast = min(fast, base)
+        self.max_stable = max(max_stable, base)
+        self.max_backoff = max_backoff
+
+    def update(self, changed=False, failed=False, unreachable=False):
+        """根据本轮结果计算下次检查前的等待秒数"""
+        if unreachable:
+            self.failures += 1
+            self.state = self.BACKOFF
+            if self.clock() < self.boot_until:
+                delay = self.fast
+            else:
+                delay = min(self.max_backoff, self.fast * 2 ** (self.failures - 1))
+                delay *= 1 + self.jitter * (2 * self.rand() - 1)
+        else:
+            self.failures = 0
+            if changed or failed:
+                self._fast_left = self.fast_ticks
+            if self._fast_left > 0:
+                self._fast_left -= 1
+                self.state = self.FAST
+                delay = self.fast
+            elif self.state != self.STABLE:
+                self.state = self.STABLE
+                delay = self.base
+            else:
+                delay = min(self.max_stable, self.delay * self.growth)
+        self.delay = delay
+        self.next_at = self.clock() + delay
+        return delay
+
+    def snapshot(self):
+        return {"state": self.state, "delay": round(self.delay, 2), "failures": self.failures,
+                "next_in": round(max(0.0, self.next_at - self.clock()), 2)}
+
+# ==================== 切换防抖 ====================
+class TransitionFilter:
+    """位于规则匹配与切换之间，抑制网络来回跳变引起的频繁切换：
+    断网（没有 SSID 也没有网关）时保持当前模式；
+    切入 immediate 中的模式（如直连）立即生效，不受频率限制；
+    切到其他模式前，目标需持续 stable 秒不变，且 window 秒内切换次数不超过 max_switches。
+    时间只来自 clock，可换成假时钟回放。
+    """
+    REASONS = {"disconnected": "网络断开", "stable": "等待网络稳定", "rate": "切换过于频繁"}
+
+    def __init__(self, stable=10, max_switches=6, window=300, immediate=("Direct",), clock=time.monotonic):
+        self.stable = stable
+        self.max_switches = max_switches
+        self.window = window
+        self.immediate = {m.lower() for m in immediate}
+        self.clock = clock
+        self.pending = None       # 正在等待稳定的目标
+        self.pending_until = 0.0  # 目标稳定到这一时刻后才可切换
+        self.switches = collections.deque()  # 最近的切换时间
+        self.reason = None        # 本轮被压下时的原因
+
+    def decide(self, target, current, connected=True):
+        """返回本轮应当生效的模式：target，或者继续保持 current"""
+        self.reason = None
+        if current is None:
+            return target
+        if not connected:
+            # 断网期间不计入稳定时间，重新连上后重新计时
+            self.pending = None
+            self.reason = "disconnected"
+            return current
+        if target == current:
+            self.pending = None
+            return current
+        if target.lower() in self.immediate:
+            self.pending = None
+            return target
+        now = self.clock()
+        if self.pending != target:
+            self.pending, self.pending_until = target, now + self.stable
+        if now < self.pending_until:
+            self.reason = "stable"
+            return current
+        self._expire(now)
+        if len(self.switches) >= self.max_switches:
+            self.reason = "rate"
+            return current
+        return target
+
+    def record(self, mode):
+        """切换成功后调用"""
+        self.pending = None
+        self.switches.append(self.clock())
+
+    def _expire(self, now):
+        while self.switches and now >= self.switches[0] + self.window:
+            self.switches.popleft()
+
+    def due(self):
+        """有目标在等待时，返回最早可以切换的时刻，否则 None"""
+        if self.pending is None:
+            return None
+        self._expire(self.clock())
+        if len(self.switches) >= self.max_switches:
+            return max(self.pending_until, self.switches[0] + self.window)
+        return self.pending_until
+
+    def wait_hint(self):
+        """有目标在等待时，返回距离可以切换还剩的秒数，否则 None"""
+        due = self.due()
+        return None if due is None else max(0.0, due - self.clock())
+
+
+class SimController:
+    """离线回放用的假控制器：只记录模式与写入次数"""
+
+    def __init__(self, mode=None):
+        self.mode = mode
+        self.writes = 0
+
+    def set_mode(self, mode):
+        if self.mode == mode:
+            return True, f"模式已是 {mode}，跳过写入"
+        self.mode = mode
+        self.writes += 1
+        return True, f"模式切换: {mode}"
+
+
+def simulate(events, rules, transition=None, controller=None, end=None):
+    """用虚拟时钟按时间回放 (秒, SSID 或 NetworkFingerprint) 事件，匹配与防抖逻辑与 monitor_loop 相同。
+
+    transition 的 clock 会被替换为回放时钟；等待稳定的目标在到期时刻补一次检查，
+    对应 monitor_loop 按 wait_hint 缩短等待。返回 {"switches": [(秒, 模式)], "time_in_mode": {模式: 秒},
+    "events": 事件数, "writes": 控制器写入次数}；end 为统计截止时间（默认最后一个事件）。
+    """
+    index = compile_rules(rules)
+
+    def match(network):
+        rule = index.lookup(network, False)  # 时间线里没有探测结果，探测项按不满足处理
+        return rule["mode"] if rule else None
+
+    controller = controller or SimController()
+    now = 0.0
+    if transition:
+        transition.clock = lambda: now
+        decide, record = transition.decide, transition.record
+    current = None
+    switches = []
+    count = 0
+    unset = last = object()
+    fp_type = NetworkFingerprint
+
+    def step(network):
+        nonlocal current
+        if type(network) is fp_type:
+            connected = bool(network.ssid or network.gateway_mac)
+        else:
+            connected = bool(network)
+        target = match(network) or "Rule"
+        if transition:
+            target = decide(target, current, connected)
+        if target != current:
+            ok, _ = controller.set_mode(target)
+            if ok:
+                if transition:
+                    record(target)
+                current = target
+                switches.append((now, target))
+
+    for t, network in events:
+        count += 1
+        # 在两个事件之间到期的等待目标
+        while transition and transition.pending is not None and last is not unset:
+            due = transition.due()
+            if due > t:
+                break
+            now = max(now, due)
+            step(last)
+        now = t
+        if network != last or transition:
+            step(network)
+        last = network
+
+    end = now if end is None else end
+    time_in_mode = {}
+    for (t, mode), nxt in zip(switches, switches[1:] + [(end, None)]):
+        time_in_mode[mode] = time_in_mode.get(mode, 0.0) + max(0.0, nxt[0] - t)
+    return {"switches": switches, "time_in_mode": time_in_mode, "events": count,
+            "writes": getattr(controller, "writes", len(switches))}
+
+
+# ==================== 手动指定模式 ====================
+class ModeOverride:
+    """托盘菜单等处手动指定的模式：设置后监控线程不再按规则匹配，直接使用该模式；清除后恢复自动。
+    notify 在变化时调用，用于唤醒正在等待的监控线程。
+    """
+    MODES = ("Direct", "Rule", "Global")
+
+    def __init__(self, notify=None):
+        self.notify = notify or _noop
+        self.mode = None
+        self.since = None
+
+    def set(self, mode):
+        if mode is not None and mode not in self.MODES:
+            raise ValueError(f"未知模式: {mode}")
+        if mode != self.mode:
+            self.mode = mode
+            self.since = time.time() if mode else None
+            self.notify()
+
+    def clear(self):
+        self.set(None)
+
+
+# ==================== 本地控制通道 ====================
+class MonitorControl:
+    """控制通道命令：status / reevaluate / force <mode|auto> / reload。
+    create_monitor 每次组装监控线程时用 attach 接上 watcher、config_watcher 和集中规则源；status 由 monitor_loop 每轮更新。
+    extra 可注册额外命令（如界面的 show）：名称 -> fn(参数) -> dict。
+    """
+    COMMANDS = ("status", "reevaluate", "force", "reload")
+
+    def __init__(self, override=None, tick_timeout=3.0):
+        self.override = override or ModeOverride()
+        self.status = {"state": "已停止", "ticks": 0}
+        self.watcher = None
+        self.config_watcher = None
+        self.rules_feed = None
+        self.tick_timeout = tick_timeout
+        self.extra = {}
+        self.on_force = None
+        self.started = time.time()
+
+    def attach(self, watcher, config_watcher=None, rules_feed=None):
+        self.watcher = watcher
+        self.config_watcher = config_watcher
+        self.rules_feed = rules_feed
+
+    def handle(self, line):
+        """处理一行命令，返回应答 dict（ok 表示是否成功）"""
+        cmd, _, arg = line.strip().partition(" ")
+        arg = arg.strip()
+        try:
+            if cmd in self.extra:
+                return dict(self.extra[cmd](arg) or {}, ok=True)
+            if cmd not in self.COMMANDS:
+                return {"ok": False, "error": f"未知命令: {cmd}，可用: {', '.join(self.COMMANDS + tuple(self.extra))}"}
+            return getattr(self, "cmd_" + cmd)(arg)
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+
+    def cmd_status(self, arg=""):
+        return dict(self.status, ok=True, forced=self.override.mode, pid=os.getpid(),
+                    uptime=round(time.time() - self.started, 1))
+
+    def _after_tick(self, ticks):
+        """等监控线程跑完下一轮再应答，这样应答里的模式就是命令生效后的结果"""
+        deadline = time.monotonic() + self.tick_timeout
+        while self.status["ticks"] == ticks and self.status["state"] != "已停止" and time.monotonic() < deadline:
+            time.sleep(0.002)
+        return self.cmd_status()
+
+    def cmd_reevaluate(self, arg=""):
+        ticks = self.status["ticks"]
+        if self.watcher:
+            self.watcher.notify(settle=False)
+        return self._after_tick(ticks)
+
+    def cmd_force(self, arg=""):
+        modes = {m.lower(): m for m in ModeOverride.MODES}
+        if arg.lower() not in modes and arg.lower() != "auto":
+            raise ValueError(f"用法: force {'|'.join(ModeOverride.MODES)}|auto")
+        mode = modes.get(arg.lower())
+        ticks = self.status["ticks"]
+        self.override.set(mode)
+        if self.on_force:
+            self.on_force(mode)
+        return self._after_tick(ticks)
+
+    def cmd_reload(self, arg=""):
+        """重新读取配置文件；配置了集中规则时同时拉取一次"""
+        if not self.config_watcher and not self.rules_feed:
+            return {"ok": False, "error": "监控未运行或未开启配置热加载（hot_reload）"}
+        ticks = self.status["ticks"]
+        changed = False
+        extra = {}
+        if self.config_watcher:
+            errors = self.config_watcher.errors
+            changed = self.config_watcher.check(force=True)
+            if self.config_watcher.errors != errors:
+                return {"ok": False, "error": "配置文件无效，继续使用上一版（详见日志）"}
+            extra["version"] = self.config_watcher.snapshot.version
+        if self.rules_feed:
+            result = self.rules_feed.refresh()
+            if result == "error":
+                return {"ok": False, "error": "集中规则拉取失败，继续使用上一版（详见日志）"}
+            changed = changed or result == "updated"
+            extra["rules"] = result
+        return dict(self._after_tick(ticks) if changed else self.cmd_status(), **extra)
+
+
+def _recv_line(read, limit=65536):
+    """从 read(n) 读到第一个换行（或对端关闭）为止，返回去掉换行的文本"""
+    data = b""
+    while b"\n" not in data and len(data) < limit:
+        chunk = read(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data.split(b"\n", 1)[0].decode("utf-8", "replace").strip()
+
+
+class ControlServer:
+    """本机控制通道的服务端：Windows 上是命名管道，其他系统是 Unix 套接字（仅当前用户可访问）。
+    协议一问一答：客户端发一行命令（如 "force Direct"），收到一行 JSON 应答后连接关闭。
+    每个连接在单独的线程里处理，等待监控轮次的命令不会挡住其他查询。
+    """
+
+    def __init__(self, handler, address=None):
+        self.handler = handler  # fn(命令行) -> dict
+        self.address = address or CONTROL_ADDRESS
+        self.requests = 0
+        self._closed = threading.Event()
+        self._sock = None
+
+    def start(self):
+        if sys.platform == "win32":
+            target = self._serve_pipe
+        else:
+            # 能走到这里说明已持有实例锁，遗留的套接字文件来自异常退出的旧进程
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.bind(self.address)
+            os.chmod(self.address, 0o600)
+            self._sock.listen(16)
+            target = self._serve_unix
+        threading.Thread(target=target, daemon=True, name="autovpn-control").start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        if self._sock:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)  # 唤醒阻塞在 accept 的线程
+            except OSError:
+                pass
+            self._sock.close()
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+        elif sys.platform == "win32":
+            try:
+                open(self.address, "r+b", buffering=0).close()  # 让 ConnectNamedPipe 返回
+            except OSError:
+                pass
+
+    def _respond(self, line):
+        self.requests += 1
+        try:
+            reply = self.handler(line)
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        return (json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _serve_unix(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._unix_client, args=(conn,), daemon=True).start()
+
+    def _unix_client(self, conn):
+        with conn:
+            try:
+                conn.settimeout(2.0)
+                line = _recv_line(conn.recv)
+                if line:
+                    conn.sendall(self._respond(line))
+            except OSError:
+                pass
+
+    def _serve_pipe(self):
+        k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        k32.CreateNamedPipeW.restype = ctypes.c_void_p
+        k32.CreateNamedPipeW.argtypes = [ctypes.c_wchar_p] + [ctypes.c_ulong] * 6 + [ctypes.c_void_p]
+        for fn in (k32.ConnectNamedPipe, k32.DisconnectNamedPipe, k32.FlushFileBuffers, k32.CloseHandle):
+            fn.argtypes = [ctypes.c_void_p] + ([ctypes.c_void_p] if fn is k32.ConnectNamedPipe else [])
+        for fn in (k32.ReadFile, k32.WriteFile):
+            fn.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong), ctypes.c_void_p]
+        invalid = ctypes.c_void_p(-1).value
+        first = 0x00080000  # FILE_FLAG_FIRST_PIPE_INSTANCE：同名管道已存在时创建失败
+
+        def create():
+            nonlocal first
+            # PIPE_ACCESS_DUPLEX，字节模式，实例数不限
+            h = k32.CreateNamedPipeW(self.address, 0x3 | first, 0, 255, 4096, 4096, 0, None)
+            first = 0
+            return None if h in (None, invalid) else h
+
+        h = create()
+        if h is None:
+            log(f"E 控制通道不可用: 创建命名管道失败 ({ctypes.get_last_error()})")
+            return
+        while True:
+            # ERROR_PIPE_CONNECTED(535)：客户端在 ConnectNamedPipe 之前就连上了
+            if not k32.ConnectNamedPipe(h, None) and ctypes.get_last_error() != 535:
+                k32.CloseHandle(h)
+                h = create()
+                if h is None:
+                    break
+                continue
+            if self._closed.is_set():
+                k32.CloseHandle(h)
+                break
+            nxt = create()  # 先建好下一个实例，处理期间新客户端不会找不到管道
+            threading.Thread(target=self._pipe_client, args=(k32, h), daemon=True).start()
+            if nxt is None:
+                break
+            h = nxt
+
+    def _pipe_client(self, k32, h):
+        buf = ctypes.create_string_buffer(4096)
+        n = ctypes.c_ulong()
+
+        def read(size):
+            if not k32.ReadFile(h, buf, min(size, len(buf)), ctypes.byref(n), None):
+                return b""
+            return buf.raw[:n.value]
+
+        try:
+            line = _recv_line(read)
+            if line:
+                data = self._respond(line)
+                k32.WriteFile(h, data, len(data), ctypes.byref(n), None)
+                k32.FlushFileBuffers(h)
+        finally:
+            k32.DisconnectNamedPipe(h)
+            k32.CloseHandle(h)
+
+
+def send_control(command, address=None, timeout=5.0):
+    """把一行命令发给正在运行的实例并返回应答 dict；没有实例在监听时返回 None"""
+    address = address or CONTROL_ADDRESS
+    request = (command.strip() + "\n").encode("utf-8")
+    if sys.platform == "win32":
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                pipe = open(address, "r+b", buffering=0)
+                break
+            except FileNotFoundError:
+                return None
+            except OSError as e:
+                # ERROR_PIPE_BUSY：实例都在处理别的请求，稍等再连
+                if getattr(e, "winerror", None) != 231 or time.monotonic() > deadline:
+                    raise
+                ctypes.windll.kernel32.WaitNamedPipeW(address, 100)
+        with pipe:
+            pipe.write(request)
+            line = _recv_line(pipe.read)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            return None
+        with sock:
+            sock.sendall(request)
+            line = _recv_line(sock.recv)
+    return json.loads(line) if line else None
+
+
+# ==================== 离线回放 ====================
+def _parse_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _timeline_network(row):
+    """记录 -> SSID 或 NetworkFingerprint（带 BSSID/网关/接口字段时）"""
+    ssid = row.get("ssid") or None
+    bssid = normalize_mac(row.get("bssid"))
+    gateway_mac = normalize_mac(row.get("gateway_mac") or row.get("gw"))
+    iface = row.get("iface") or None
+    if bssid or gateway_mac or iface:
+        return NetworkFingerprint(ssid, bssid, gateway_mac, iface)
+    return ssid
+
+
+def load_timeline(path):
+    """读取网络时间线，返回 [(设备, 秒, 网络)]，按设备、时间排序。
+
+    支持三种格式：
+        .jsonl  每行 {"t": 秒或 ISO 时间, "device": ..., "ssid": ..., "bssid": ..., "gateway_mac": ..., "iface": ...}
+        .csv    表头为上述字段名
+        其他    AutoVPN 自己的日志，取 "WiFi: ..." 行（只有时分秒，跨零点自动顺延）
+    """
+    events = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    events.append((str(row.get("device", "")), _parse_time(row["t"]), _timeline_network(row)))
+        elif path.endswith(".csv"):
+            import csv
+            for row in csv.DictReader(f):
+                events.append((row.get("device", ""), _parse_time(row["t"]), _timeline_network(row)))
+        else:
+            line_re = re.compile(r"^\[(\d\d):(\d\d):(\d\d)\] WiFi: (.*?)(?:（[^（]*ms）)?$")
+            day = prev = 0
+            for line in f:
+                hit = line_re.match(line.rstrip("\n"))
+                if not hit:
+                    continue
+                t = int(hit[1]) * 3600 + int(hit[2]) * 60 + int(hit[3])
+                if t < prev:
+                    day += 86400
+                prev = t
+                ssid = hit[4]
+                events.append(("", float(day + t), None if ssid == "未连接" else ssid))
+    events.sort(key=lambda e: (e[0], e[1]))
+    return events
+
+
+def simulate_fleet(timeline, rules, make_transition=None):
+    """按设备分别回放 (设备, 秒, 网络) 时间线，返回 {设备: simulate 结果}；规则只编译一次"""
+    index = compile_rules(rules)
+    results = {}
+    for device, group in itertools.groupby(timeline, key=lambda e: e[0]):
+        events = [(t, network) for _, t, network in group]
+        results[device] = simulate(events, index, make_transition() if make_transition else None)
+    return results
+
+
+def _mode_diff(a, b, end):
+    """两条切换记录中模式不一致的时间段 [(开始, 结束, 模式A, 模式B)]"""
+    marks = sorted({t for t, _ in a} | {t for t, _ in b})
+    diffs = []
+    ia = ib = 0
+    mode_a = mode_b = None
+    for i, t in enumerate(marks):
+        while ia < len(a) and a[ia][0] <= t:
+            mode_a = a[ia][1]
+            ia += 1
+        while ib < len(b) and b[ib][0] <= t:
+            mode_b = b[ib][1]
+            ib += 1
+        stop = marks[i + 1] if i + 1 < len(marks) else end
+        if mode_a != mode_b and stop > t:
+            if diffs and diffs[-1][1] == t and diffs[-1][2:] == (mode_a, mode_b):
+                diffs[-1] = (diffs[-1][0], stop, mode_a, mode_b)
+            else:
+                diffs.append((t, stop, mode_a, mode_b))
+    return diffs
+
+
+def summarize_simulation(results):
+    """汇总各设备的回放结果"""
+    total = {"devices": len(results), "events": 0, "switches": 0, "writes": 0, "time_in_mode": {}}
+    for r in results.values():
+        total["events"] += r["events"]
+        total["switches"] += len(r["switches"])
+        total["writes"] += r["writes"]
+        for mode, sec in r["time_in_mode"].items():
+            total["time_in_mode"][mode] = total["time_in_mode"].get(mode, 0.0) + sec
+    return total
+
+
+def compare_rule_sets(timeline, rules_a, rules_b, make_transition=None):
+    """同一时间线分别用两套规则回放，返回 (结果A, 结果B, {设备: 不一致时间段})"""
+    res_a = simulate_fleet(timeline, rules_a, make_transition)
+    res_b = simulate_fleet(timeline, rules_b, make_transition)
+    ends = {}
+    for device, t, _ in timeline:
+        ends[device] = t
+    diffs = {}
+    for device in res_a:
+        d = _mode_diff(res_a[device]["switches"], res_b[device]["switches"], ends[device])
+        if d:
+            diffs[device] = d
+    return res_a, res_b, diffs
+
+
+def _load_rules_file(path):
+    """规则文件可以是完整配置（取 rules）或规则列表"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["rules"] if isinstance(data, dict) else data
+
+
+def _transition_factory(config, enabled=True):
+    if not enabled or not config.get("debounce", True):
+        return None
+    return lambda: TransitionFilter(config.get("stable_window", 10), config.get("max_switches", 6),
+                                    config.get("switch_window", 300), config.get("immediate_modes", ["Direct"]))
+
+
+def _format_seconds(sec):
+    return f"{sec / 3600:.1f} h" if sec >= 3600 else f"{sec:.0f} s"
+
+
+def cmd_simulate(config, timeline_path, rules_path=None, against=None, debounce=True, as_json=False, limit=10):
+    """离线回放时间线，输出切换次数、各模式时长；against 给出时对比两套规则"""
+    t0 = time.perf_counter()
+    timeline = load_timeline(timeline_path)
+    load_ms = (time.perf_counter() - t0) * 1000
+    rules = _load_rules_file(rules_path) if rules_path else config["rules"]
+    make_transition = _transition_factory(config, debounce)
+    t0 = time.perf_counter()
+    if against:
+        res_a, res_b, diffs = compare_rule_sets(timeline, rules, _load_rules_file(against), make_transition)
+    else:
+        res_a, res_b, diffs = simulate_fleet(timeline, rules, make_transition), None, {}
+    sim_ms = (time.perf_counter() - t0) * 1000
+    report = {"timeline": timeline_path, "load_ms": round(load_ms, 1), "simulate_ms": round(sim_ms, 1),
+              "a": summarize_simulation(res_a)}
+    if res_b is not None:
+        report["b"] = summarize_simulation(res_b)
+        report["diff_devices"] = len(diffs)
+        report["diff_seconds"] = round(sum(stop - start for d in diffs.values() for start, stop, _, _ in d), 1)
+        report["diffs"] = [{"device": dev, "start": start, "end": stop, "a": ma, "b": mb}
+                           for dev, d in diffs.items() for start, stop, ma, mb in d][:limit]
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    n = report["a"]["events"]
+    rate = n / (load_ms + sim_ms) * 60000 if n else 0
+    print(f"{n} 个事件，{report['a']['devices']} 台设备；读取 {load_ms:.0f} ms，回放 {sim_ms:.0f} ms（约 {rate / 1e6:.1f} 百万事件/分钟）")
+    for name in ("a", "b"):
+        if name not in report:
+            continue
+        r = report[name]
+        spent = "，".join(f"{mode} {_format_seconds(sec)}" for mode, sec in sorted(r["time_in_mode"].items()))
+        label = {"a": rules_path or "当前规则", "b": against}[name]
+        print(f"[{label}] 切换 {r['switches']} 次，写入 {r['writes']} 次；{spent or '无'}")
+    if res_b is not None:
+        print(f"模式不一致: {report['diff_devices']} 台设备，共 {_format_seconds(report['diff_seconds'])}")
+        for d in report["diffs"]:
+            who = f"{d['device']} " if d["device"] else ""
+            print(f"  {who}{d['start']:.0f}→{d['end']:.0f}: {d['a']} / {d['b']}")
+    return 0
+
+
+def controller_identity(api):
+    """控制器标识：各控制器的 host:port，按顺序"""
+    controllers = api.controllers if isinstance(api, ControllerGroup) else [api]
+    return [f"{c.host}:{c.port}" if isinstance(c, ClashController) else repr(c) for c in controllers]
+
+
+def _state_network(network):
+    """写入状态文件的网络标识：SSID、网关 MAC、接口类型（不含 BSSID，同一网络内漫游不算变化）"""
+    if isinstance(network, NetworkFingerprint):
+        return [network.ssid, network.gateway_mac, network.iface]
+    return [network, None, None]
+
+
+def resume_state(state, network, target, api):
+    """上次退出时的网络、模式、控制器与现在一致，且控制器实际就是目标模式时返回 True（无需写入）"""
+    if not state or state.get("mode") != target or state.get("network") != _state_network(network) \
+            or state.get("controllers") != controller_identity(api):
+        return False
+    controllers = api.controllers if isinstance(api, ControllerGroup) else [api]
+    try:
+        return all((c.get_mode() or "").lower() == target.lower() for c in controllers)
+    except Exception:
+        return False
+
+
+class MonitorContext(collections.namedtuple("MonitorContext", (
+        "watcher watch_interval scheduler drift cutover_opts fingerprint config_watcher state_path "
+        "transition override status group_selector power rules_feed"),
+        defaults=(None, 120, None, None, None, False, None, None, None, None, None, None, None, None))):
+    """monitor_loop 的可选组件，由 create_monitor 按配置组装；没有启用的功能保持默认值。
+
+    watcher 网络变化监听（兼作可唤醒的等待点）；scheduler 轮询调度；drift 模式漂移检测；
+    cutover_opts 切换后清理连接的选项；fingerprint 是否读取网络指纹；config_watcher 配置热加载；
+    state_path 决策状态文件；transition 切换防抖；override 手动指定模式；status 供控制通道查询的状态字典；
+    group_selector 代理组选择；power 休眠唤醒监听；rules_feed 集中规则源。
+    """
+    __slots__ = ()
+
+
+def monitor_loop(rules, api, interval, log_widget, stop_event, status_callback, mode_callback, ctx=None):
+    ctx = ctx or MonitorContext()
+    fingerprint = ctx.fingerprint  # 热加载后可能改变
+    last_ssid = None
+    resumes = ctx.power.resumes if ctx.power else 0
+    verify = False  # 唤醒后即使目标未变也要向控制器确认一次
+    last_group = None
+    group_failed = collections.deque()  # 后台选择失败的 key，由监控线程取出后重试
+    probe_runs = _probe_runner.runs if _probe_runner else 0
+    last_hold = None
+    last_forced = None
+    last_health = ("运行中", "#27ae60")
+    target = None
+    last_net = None
+    snap = ctx.config_watcher.snapshot if ctx.config_watcher else None
+    saved_at = None  # 刚热加载的配置文件保存时间，用于统计保存→生效耗时
+    state = load_state(ctx.state_path) if ctx.state_path else {}
+    saved_state = {k: state.get(k) for k in ("network", "mode", "controllers")}
+    identity = controller_identity(api)
+    started = time.monotonic()
+    booting = True  # 启动后还没有确认过模式
+    current_mode = None
+    local_rules = rules.rules if isinstance(rules, RuleIndex) else rules
+    feed_revision = ctx.rules_feed.revision if ctx.rules_feed else None
+    # 在循环里编译：规则有误时记录错误并报告异常，监控线程不退出
+    rules = rules if isinstance(rules, RuleIndex) and not ctx.rules_feed else None
+    scheduler = ctx.scheduler or PollScheduler(interval)
+    poll_ceiling = scheduler.max_stable
+    log("监控已启动" + (f"（事件监听: {ctx.watcher.name}）" if ctx.watcher else ""), log_widget)
+    status_callback(*last_health)
+
+    def wait(delay):
+        """等待网络变化事件或超时；返回变化发生时间"""
+        if ctx.watcher and ctx.watcher.alive:
+            if ctx.watcher.wait(delay):
+                return ctx.watcher.last_change
+            return None
+        stop_event.wait(delay)
+        return None
+
+    changed_at = None
+    wrong_since = None  # 规则目标与实际模式不一致的起始时间
+    right_at = started  # 最近一次确认实际模式就是目标的时间
+
+    def count_wrong(m):
+        """一段模式不对的时间结束（切换成功、目标变回当前模式或监控停止），计入指标"""
+        nonlocal wrong_since
+        if m and wrong_since is not None:
+            m.inc("autovpn_wrong_mode_seconds_total", max(0.0, time.monotonic() - wrong_since))
+        wrong_since = None
+    try:
+        while not stop_event.is_set():
+            changed = failed = unreachable = False
+            m = _metrics
+            try:
+                if ctx.config_watcher and ctx.config_watcher.snapshot is not snap:
+                    old, snap = snap, ctx.config_watcher.snapshot
+                    local_rules = snap.config["rules"]
+                    rules = None if ctx.rules_feed else snap.rules
+                    interval = snap.config["interval"]
+                    fingerprint = snap.config["fingerprint"]
+                    scheduler.reconfigure(interval, snap.config["fast_interval"], snap.config["max_interval"], snap.config["max_backoff"])
+                    poll_ceiling = scheduler.max_stable
+                    saved_at = snap.stamp[0] / 1e9
+                    log(f"配置已重新加载（第 {snap.version} 版，解析校验 {snap.load_ms:.1f} ms，"
+                        f"保存→生效 {(time.time() - saved_at) * 1000:.0f} ms）", log_widget, kind="config")
+                    pending = sorted(k for k in set(old.config) | set(snap.config)
+                                     if k not in CONFIG_HOT_KEYS and old.config.get(k) != snap.config.get(k))
+                    if pending:
+                        log(f"以下设置需重启监控后生效: {', '.join(pending)}", log_widget)
+                    if m:
+                        m.observe("autovpn_config_apply_seconds", max(0.0, time.time() - saved_at))
+                    changed = True
+
+                if ctx.rules_feed and ctx.rules_feed.revision != feed_revision:
+                    # 下发的规则换了新版，与本地规则重新合并
+                    feed_revision = ctx.rules_feed.revision
+                    rules = None
+                    changed = True
+
+                if ctx.power and ctx.power.resumes != resumes:
+                    # 休眠前的判断都不再可信：网络、探测结果、等待中的防抖目标、Clash 的实际模式
+                    resumes = ctx.power.resumes
+                    source, slept = ctx.power.last_resume
+                    log(f"系统已唤醒（{source}" + (f"，休眠约 {slept:.0f} 秒" if slept else "") + "），重新判断",
+                        log_widget, kind="resume", source=source)
+                    last_ssid = last_net = last_group = None
+                    if _probe_runner:
+                        _probe_runner.cache.clear()
+                    if ctx.transition:
+                        ctx.transition.pending = None
+                    verify = changed = True
+                    if m:
+                        m.inc("autovpn_resumes_total", source=source)
+
+                ssid = get_ssid()
+                if m:
+                    m.inc("autovpn_ticks_total")
+                    if _ssid_provider:
+                        m.observe("autovpn_ssid_query_seconds", _ssid_provider.last_ms / 1000, provider=_ssid_provider.name)
+
+                if ssid != last_ssid:
+                    cost = f"（{_ssid_provider.name} {_ssid_provider.last_ms:.1f} ms）" if _ssid_provider else ""
+                    log(f"WiFi: {ssid or '未连接'}{cost}", log_widget, kind="ssid", ssid=ssid,
+                        ms=round(_ssid_provider.last_ms, 2) if _ssid_provider else None)
+                    last_ssid = ssid
+                    changed = True
+
+                network = get_fingerprint(ssid) if fingerprint else ssid
+                if fingerprint and (network.gateway_mac, network.iface) != last_net:
+                    log(f"网络: {network.describe()}", log_widget, kind="network", ssid=ssid,
+                        gateway_mac=network.gateway_mac, iface=network.iface)
+                    last_net = (network.gateway_mac, network.iface)
+                    changed = True
+
+                if rules is None:
+                    rules = compile_rules(merge_rules(local_rules, ctx.rules_feed.rules) if ctx.rules_feed else local_rules)
+                t_match = time.perf_counter()
+                rule = rules.lookup(network)
+                target = rule["mode"] if rule else "Rule"
+                group = rule.get("group") if rule else None
+                if m:
+                    m.observe("autovpn_rule_match_seconds", time.perf_counter() - t_match)
+                if _probe_runner and _probe_runner.runs != probe_runs:
+                    probe_runs = _probe_runner.runs
+                    log(f"探测: {_probe_runner.summary()}", log_widget, kind="probe", ssid=ssid,
+                        ms=_probe_runner.last["ms"])
+                    if m:
+                        m.observe("autovpn_probe_seconds", _probe_runner.last["ms"] / 1000)
+
+                forced = ctx.override.mode if ctx.override else None
+                if forced != last_forced:
+                    log(f"手动指定模式 {forced}" if forced else "恢复按规则自动切换", log_widget,
+                        kind="override", ssid=ssid, mode=forced or target)
+                    last_forced = forced
+                    changed = True
+                if forced:
+                    target = forced
+                elif ctx.transition:
+                    connected = bool(ssid) or bool(fingerprint and network.gateway_mac)
+                    wanted, target = target, ctx.transition.decide(target, current_mode, connected)
+                    hold = (wanted, ctx.transition.reason) if ctx.transition.reason else None
+                    if hold != last_hold:
+                        if hold:
+                            log(f"暂不切换到 {wanted}: {TransitionFilter.REASONS[ctx.transition.reason]}，保持 {target}", log_widget,
+                                kind="hold", ssid=ssid, mode=wanted, reason=ctx.transition.reason)
+                            if m:
+                                m.inc("autovpn_switches_held_total", reason=ctx.transition.reason)
+                        last_hold = hold
+
+                if ctx.drift:
+                    ctx.drift.expect(target)
+
+                if booting and state:
+                    # 启动后第一次决策：与上次退出时完全一致就只确认、不写入，也不做切换后清理
+                    if resume_state(state, network, target, api):
+                        current_mode = target
+                        booting = False
+                        mode_callback(current_mode, False)
+                        log(f"与上次一致，保持 {target}（启动→确认 {(time.monotonic() - started) * 1000:.0f} ms）", log_widget,
+                            kind="switch", ssid=ssid, mode=target, ok=True, resumed=True)
+                        if m:
+                            m.set("autovpn_mode", 1, mode=target)
+                    state = None
+
+                if target == current_mode:
+                    count_wrong(m)  # 切换失败期间网络又变回来了
+                    right_at = time.monotonic()
+                elif wrong_since is None and current_mode is not None:
+                    # 启动时还不知道实际模式，不计；从网络变化的时刻算起；不知道变化时刻（轮询发现）时从上次确认无误算起，最多多算一个检查间隔
+                    wrong_since = changed_at if changed_at is not None and changed_at > right_at else right_at
+
+                if target != current_mode or verify:
+                    switched = target != current_mode  # 否则只是唤醒后的确认
+                    t_switch = time.perf_counter()
+                    ok, msg = set_clash_mode(target, api)
+                    switch_ms = round((time.perf_counter() - t_switch) * 1000, 1)
+                    if m:
+                        m.observe("autovpn_switch_seconds", switch_ms / 1000)
+                    if ok:
+                        verify = False
+                        if ctx.transition and switched:
+                            ctx.transition.record(target)
+                        if m and switched:
+                            m.inc("autovpn_switches_total", mode=target)
+                            if current_mode:
+                                m.set("autovpn_mode", 0, mode=current_mode)
+                            m.set("autovpn_mode", 1, mode=target)
+                        count_wrong(m)
+                        right_at = time.monotonic()
+                        if saved_at is not None:
+                            msg += f"（配置保存→切换 {(time.time() - saved_at) * 1000:.0f} ms）"
+                        elif changed_at is not None:
+                            msg += f"（网络变化→切换 {(time.monotonic() - changed_at) * 1000:.0f} ms）"
+                        if scheduler.failures:
+                            msg += f"（此前连续失败 {scheduler.failures} 次）"
+                        if booting:
+                            msg += f"（启动→确认 {(time.monotonic() - started) * 1000:.0f} ms）"
+                            booting = False
+                        log(f"成功 {msg}", log_widget, kind="switch", ssid=ssid, mode=target, ok=True, ms=switch_ms)
+                        if ctx.cutover_opts and switched and target in ctx.cutover_opts.get("modes", ()):
+                            # 清理在后台进行，不拖慢下一轮检查
+                            threading.Thread(target=run_cutover, daemon=True,
+                                             args=(api, ctx.cutover_opts.get("filters"),
+                                                   ctx.cutover_opts.get("flush", True),
+                                                   ctx.cutover_opts.get("timeout", 5.0), log_widget)).start()
+                        current_mode = target
+                        mode_callback(current_mode, False)
+                        changed = True
+                    else:
+                        failed = True
+                        unreachable = not getattr(api, "reachable", True)
+                        if m:
+                            m.inc("autovpn_switch_failures_total", reason="unreachable" if unreachable else "error")
+                        # 连不上时只在第 1、2、4、8… 次失败时记录，避免每轮刷日志
+                        n = scheduler.failures + 1 if unreachable else 1
+                        if n & (n - 1) == 0:
+                            log(f"失败 {msg}" + (f"（第 {n} 次）" if n > 1 else ""), log_widget,
+                                kind="switch", ssid=ssid, mode=target, ok=False, ms=switch_ms)
+
+                if ctx.state_path and current_mode == target:
+                    # 只在网络或模式变化时写状态文件
+                    record = {"network": _state_network(network), "mode": current_mode, "controllers": identity}
+                    if record != saved_state:
+                        saved_state = record
+                        save_state(dict(record, updated=datetime.now().isoformat(timespec="seconds")), ctx.state_path)
+
+                if ctx.group_selector and current_mode == target:
+                    # 换网络（或规则换了代理组）后为代理组选最快的节点；测速在后台进行
+                    key = (group, ctx.group_selector.network_key(network)) if group else None
+                    while group_failed:
+                        if group_failed.popleft() == last_group:
+                            last_group = None  # 上次选择没成功，这一轮重试
+                    if key != last_group:
+                        last_group = key  # 先记下，测速进行中不重复发起；失败时由回调清掉
+                        if group:
+                            threading.Thread(target=run_group_select, daemon=True,
+                                             args=(api, ctx.group_selector, group, network, log_widget,
+                                                   lambda ok, key=key: ok or group_failed.append(key))).start()
+            except Exception as e:
+                log(f"E 监控错误: {e}", log_widget, kind="error")
+                failed = True
+                if m:
+                    m.inc("autovpn_tick_errors_total")
+
+            # 有系统事件监听时稳定期可以放得更慢（ManualWatcher 只用于内部唤醒，不算）
+            events = ctx.watcher and ctx.watcher.alive and not isinstance(ctx.watcher, ManualWatcher)
+            scheduler.max_stable = max(interval, ctx.watch_interval) if events else poll_ceiling
+            delay = scheduler.update(changed, failed, unreachable)
+            health = ("异常", "#e74c3c") if failed else ("运行中", "#27ae60")
+            if health != last_health:
+                last_health = health
+                status_callback(*health)
+            hint = ctx.transition.wait_hint() if ctx.transition and not failed else None
+            if hint is not None:
+                # 等待稳定的目标到期时正好检查一次
+                delay = min(delay, hint + 0.05)
+            if m:
+                m.set("autovpn_poll_delay_seconds", round(delay, 3))
+            if ctx.status is not None:
+                ctx.status.update(state=health[0], ssid=last_ssid, target=target, mode=current_mode,
+                                  next_check=round(delay, 2), checked=datetime.now().isoformat(timespec="seconds"),
+                                  ticks=ctx.status["ticks"] + 1)
+                if ctx.rules_feed:
+                    ctx.status["rules_version"] = ctx.rules_feed.version
+            saved_at = None
+            changed_at = wait(delay)
+    finally:
+        count_wrong(_metrics)
+        if ctx.watcher:
+            ctx.watcher.stop()
+        if ctx.drift:
+            ctx.drift.stop()
+        if ctx.config_watcher:
+            ctx.config_watcher.stop()
+        if ctx.group_selector:
+            ctx.group_selector.close()
+        if ctx.power:
+            ctx.power.stop()
+        if ctx.rules_feed:
+            ctx.rules_feed.stop()
+        if hasattr(api, "close"):
+            api.close()
+
+    if _ssid_provider and _ssid_provider.calls:
+        st = _ssid_provider.stats()
+        log(f"WiFi 查询({st['provider']}): {st['calls']} 次，平均 {st['avg_ms']} ms，最大 {st['max_ms']} ms", log_widget)
+    log("监控已停止", log_widget)
+    if ctx.status is not None:
+        ctx.status["state"] = "已停止"
+    status_callback("已停止", "#95a5a6")
+
+# ==================== 事件日志检索 ====================
+def _parse_since(value):
+    """"30m"、"2h"、"7d" 或 ISO 时间 -> 时间戳"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value and value[-1] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def cmd_journal(args):
+    """按条件检索事件日志，从新到旧输出"""
+    journal = enable_journal()
+    fields = {k: v for k, v in (("ssid", args.ssid), ("mode", args.mode), ("kind", args.kind)) if v}
+    if args.errors:
+        fields["level"] = "error"
+    start = _parse_since(args.since) if args.since else None
+    end = _parse_since(args.until) if args.until else None
+    rows = list(itertools.islice(journal.query(start, end, args.grep, **fields), args.limit))
+    for rec in reversed(rows):
+        print(json.dumps(rec, ensure_ascii=False) if args.json else format_event(rec), end="\n" if args.json else "")
+    return 0
+
+# ==================== 启动 & 命令行 ====================
+def _noop(*args, **kwargs):
+    pass
+
+
+def create_monitor(config, stop_event, log_widget=None, status_callback=None, mode_callback=None, control=None):
+    """按配置组装监控线程（未启动），返回 (thread, watcher, scheduler)；传入 MonitorControl 时可从外部查询和控制"""
+    api = parse_api_urls(config.get("api_url", ""))
+    interval = config.get("interval", 15)
+    if config.get("metrics", False):
+        enable_metrics(config.get("metrics_port", 9797))
+    if config.get("journal", True):
+        enable_journal(max_segments=config.get("journal_segments", 100))
+    set_ssid_provider(create_ssid_provider(config.get("ssid_provider", "auto"), config.get("ssid_helper", "")))
+    watcher = create_network_watcher("auto" if config.get("event_watch", True) else "poll")
+    # 慢的探测不拖住本轮判断：超出 probe_budget 的在后台完成，成功时唤醒监控线程重新判断
+    set_probe_runner(ProbeRunner(config.get("probe_timeout", 0.8), config.get("probe_ttl", 300),
+                                 budget=config.get("probe_budget", 0.3),
+                                 notify=lambda: watcher and watcher.notify(settle=False)))
+    config_watcher = None
+    if config.get("hot_reload", True):
+        try:
+            # 没有网络事件监听时也需要一个可唤醒的等待点，让新配置立即生效
+            watcher = watcher or ManualWatcher().start()
+            config_watcher = ConfigWatcher(CONFIG_FILE, config, notify=lambda: watcher.notify(settle=False)).start()
+        except ValueError as e:
+            log(f"E 配置热加载不可用: {e}", log_widget)
+    rules_feed = None
+    if config.get("rules_url"):
+        # 先用本地缓存的上一版，后台再按间隔条件拉取
+        watcher = watcher or ManualWatcher().start()
+        rules_feed = create_rules_feed(config, lambda: watcher.notify(settle=False)).start()
+    if control is not None:
+        watcher = watcher or ManualWatcher().start()
+        control.override.notify = lambda: watcher.notify(settle=False)
+        control.attach(watcher, config_watcher, rules_feed)
+    power = None
+    if config.get("power_watch", True):
+        watcher = watcher or ManualWatcher().start()
+        power = create_power_watcher(lambda: watcher.notify(settle=False), config.get("resume_jump", 10))
+    scheduler = PollScheduler(interval, config.get("fast_interval", 2), config.get("max_interval", 60),
+                              config.get("max_backoff", 300), boot_grace=config.get("boot_grace", 60))
+    controller = create_controller(api, config.get("connect_timeout", 1.0), config.get("request_timeout", 3.0), config.get("api_retries", 1))
+    drift = None
+    if config.get("drift_check", True):
+        drift = DriftWatcher(api, config.get("drift_interval", 5), config.get("connect_timeout", 1.0), config.get("request_timeout", 3.0)).start()
+    transition = None
+    if config.get("debounce", True):
+        transition = TransitionFilter(config.get("stable_window", 10), config.get("max_switches", 6),
+                                      config.get("switch_window", 300), config.get("immediate_modes", ["Direct"]))
+    group_selector = GroupSelector(config.get("group_probe_url", DEFAULT_CONFIG["group_probe_url"]),
+                                   config.get("group_probe_timeout", 2.0), config.get("group_deadline", 3.0),
+                                   config.get("group_cache_ttl", 1800))
+    cutover_opts = None
+    if config.get("cutover", False):
+        cutover_opts = {"modes": config.get("cutover_modes", ["Direct"]), "filters": config.get("cutover_filters") or None}
+    ctx = MonitorContext(watcher=watcher, watch_interval=config.get("watch_interval", 120), scheduler=scheduler,
+                         drift=drift, cutover_opts=cutover_opts, fingerprint=config.get("fingerprint", True),
+                         config_watcher=config_watcher,
+                         state_path=STATE_FILE if config.get("persist_state", True) else None,
+                         transition=transition, override=control and control.override,
+                         status=control and control.status, group_selector=group_selector,
+                         power=power, rules_feed=rules_feed)
+    thread = threading.Thread(
+        target=monitor_loop,
+        args=(config["rules"], controller, interval, log_widget, stop_event, status_callback or _noop,
+              mode_callback or _noop, ctx),
+        daemon=True
+    )
+    return thread, watcher, scheduler
+
+
+def decide(config):
+    """查询一次 WiFi 和网络指纹并匹配规则，返回 (指纹, 目标模式)"""
+    set_ssid_provider(create_ssid_provider(config.get("ssid_provider", "auto"), config.get("ssid_helper", "")))
+    set_probe_runner(ProbeRunner(config.get("probe_timeout", 0.8), config.get("probe_ttl", 300)))
+    ssid = get_ssid()
+    if config.get("fingerprint", True):
+        network = get_fingerprint(ssid)
+    else:
+        network = NetworkFingerprint(ssid, None, None, None)
+    rules = config["rules"]
+    feed = create_rules_feed(config)
+    if feed:
+        rules = merge_rules(rules, feed.rules)  # 只用本地缓存的集中规则，不联网
+    return network, match_rule(network, rules) or "Rule"
+
+
+def cmd_status(config, as_json=False):
+    network, target = decide(config)
+    modes = {}
+    for url in parse_api_urls(config.get("api_url", "")):
+        c = ClashController(url, config.get("connect_timeout", 1.0), config.get("request_timeout", 3.0))
+        try:
+            modes[url] = c.get_mode()
+        except Exception as e:
+            modes[url] = None
+            if not as_json:
+                print(f"{url}: 不可用 ({e})")
+        finally:
+            c.close()
+    if as_json:
+        print(json.dumps({**network._asdict(), "target": target, "modes": modes,
+                          "ssid_query_ms": round(_ssid_provider.last_ms, 2)}, ensure_ascii=False))
+    else:
+        print(f"WiFi: {network.ssid or '未连接'}（{_ssid_provider.name} {_ssid_provider.last_ms:.1f} ms）")
+        print(f"网络: {network.describe()}")
+        print(f"规则目标: {target}")
+        for url, mode in modes.items():
+            if mode is not None:
+                print(f"{url}: {mode}")
+    return 0
+
+
+def cmd_ctl(request, as_json=False):
+    """把命令交给正在运行的实例，不加载配置也不查询网络"""
+    reply = send_control(request)
+    if reply is None:
+        print("没有正在运行的实例", file=sys.stderr)
+        return 2
+    if as_json:
+        print(json.dumps(reply, ensure_ascii=False))
+    elif not reply.get("ok"):
+        print(f"失败: {reply.get('error')}", file=sys.stderr)
+    else:
+        forced = f"（手动指定 {reply['forced']}）" if reply.get("forced") else ""
+        print(f"{reply.get('state')}：WiFi {reply.get('ssid') or '未连接'}，规则目标 {reply.get('target')}，"
+              f"当前模式 {reply.get('mode')}{forced}")
+    return 0 if reply.get("ok") else 1
+
+
+def cmd_rules(config, action, path=None, key=None):
+    """sign：给规则文档加上校验和/签名后输出；fetch：立即拉取一次集中规则并更新本地缓存"""
+    if action == "sign":
+        if not path:
+            print("用法: rules sign 文件 [--key 密钥]", file=sys.stderr)
+            return 2
+        doc = _load_rules_file(path)
+        doc = {"rules": doc} if isinstance(doc, list) else doc
+        print(json.dumps(sign_rules_document(doc, key or config.get("rules_key")), ensure_ascii=False, indent=2))
+        return 0
+    feed = create_rules_feed(config)
+    if feed is None:
+        print("未配置 rules_url", file=sys.stderr)
+        return 2
+    cached = feed.revision
+    result = feed.refresh()
+    state = {"updated": "已更新", "not_modified": "未修改", "error": "失败"}[result]
+    print(f"{feed.source}: {state}，版本 {feed.version or '未标注'}，下发 {len(feed.rules)} 条"
+          + ("（来自本地缓存）" if result == "error" and cached else ""))
+    merged = merge_rules(config["rules"], feed.rules)
+    print(f"与本地 {len(config['rules'])} 条合并后共 {len(merged)} 条")
+    return 1 if result == "error" else 0
+
+
+def cmd_once(config):
+    network, target = decide(config)
+    controller = create_controller(config.get("api_url", ""), config.get("connect_timeout", 1.0),
+                                   config.get("request_timeout", 3.0), config.get("api_retries", 1))
+    try:
+        ok, msg = set_clash_mode(target, controller)
+    finally:
+        controller.close()
+    log(f"WiFi: {network.ssid or '未连接'} → {'成功' if ok else '失败'} {msg}")
+    return 0 if ok else 1
+
+
+def run_headless(config):
+    """无界面守护模式：只运行监控线程，收到 Ctrl+C / SIGTERM 时退出"""
+    import signal
+    if not acquire_mutex("AutoVPN_SingleInstance_Mutex"):
+        reply = send_control("status")
+        print("程序已在运行中" + (f"（pid {reply['pid']}，{reply['state']}，模式 {reply.get('mode')}）" if reply else ""))
+        return 1
+    stop_event = threading.Event()
+    control = MonitorControl()
+    thread, watcher, scheduler = create_monitor(config, stop_event, control=control)
+    server = None
+    if config.get("control", True):
+        try:
+            server = ControlServer(control.handle).start()
+        except OSError as e:
+            log(f"E 控制通道不可用: {e}")
+
+    def shutdown(*args):
+        stop_event.set()
+        if watcher:
+            watcher.stop()
+    signal.signal(signal.SIGTERM, shutdown)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        shutdown()
+        thread.join(5)
+    finally:
+        if server:
+            server.stop()
+        release_mutex()
+        close_log_writer()
+    return 0
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    try:
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize // 1024
+    except Exception:
+        return 0
+
+
+def _startup_probe(config, gui=False):
+    """bench startup 的子进程：输出模块加载、首次决策耗时与峰值内存"""
+    import_ms = (time.perf_counter() - _T0) * 1000
+    if gui:
+        sys.modules.setdefault("autovpn", sys.modules[__name__])
+        import autovpn_gui  # noqa: F401
+    gui_ms = (time.perf_counter() - _T0) * 1000 - import_ms
+    _, target = decide(config)
+    decision_ms = (time.perf_counter() - _T0) * 1000
+    print(json.dumps({"import_ms": round(import_ms, 1), "gui_import_ms": round(gui_ms, 1),
+                      "decision_ms": round(decision_ms, 1), "rss_kb": _peak_rss_kb(), "target": target}))
+    return 0
+
+
+def main(argv=None):
+    global CONFIG_FILE, STATE_FILE, RULES_CACHE, JOURNAL_DIR
+    import argparse
+    parser = argparse.ArgumentParser(prog="autovpn", description="AutoVPN 切换器：按 WiFi 自动切换 Clash 模式")
+    parser.add_argument("--headless", action="store_true", help="不加载图形界面，直接在后台运行监控（同 run）")
+    parser.add_argument("--config", help=f"配置文件路径（默认 {CONFIG_FILE}）")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("gui", help="打开图形界面（默认）")
+    sub.add_parser("run", help="无界面运行监控")
+    sub.add_parser("once", help="检查一次并切换，成功返回 0")
+    p = sub.add_parser("status", help="显示当前 WiFi、规则目标与 Clash 模式")
+    p.add_argument("--json", action="store_true", help="以 JSON 输出")
+    p = sub.add_parser("simulate", help="离线回放网络时间线，检验规则会怎样切换")
+    p.add_argument("timeline", help="时间线文件：.jsonl、.csv 或 AutoVPN 日志")
+    p.add_argument("--rules", help="规则文件（配置 JSON 或规则列表），默认用当前配置")
+    p.add_argument("--against", help="另一套规则文件，输出两者的差异")
+    p.add_argument("--no-debounce", action="store_true", help="回放时不启用切换防抖")
+    p.add_argument("--json", action="store_true", help="以 JSON 输出")
+    p = sub.add_parser("journal", help="检索事件日志")
+    p.add_argument("--since", help="起始时间：30m、2h、7d 或 ISO 时间")
+    p.add_argument("--until", help="结束时间，格式同 --since")
+    p.add_argument("--ssid")
+    p.add_argument("--mode")
+    p.add_argument("--kind", help="ssid/network/switch/hold/config/error")
+    p.add_argument("--errors", action="store_true", help="只看错误")
+    p.add_argument("--grep", help="消息中包含的文本")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--json", action="store_true", help="以 JSON 行输出")
+    p = sub.add_parser("ctl", help="控制正在运行的实例：status、reevaluate、force <模式|auto>、reload")
+    p.add_argument("request", nargs="+", help="命令及参数，如 force Direct")
+    p.add_argument("--json", action="store_true", help="原样输出 JSON 应答")
+    p = sub.add_parser("rules", help="集中规则：sign 给规则文档加校验和/签名，fetch 立即拉取一次")
+    p.add_argument("action", choices=["sign", "fetch"])
+    p.add_argument("file", nargs="?", help="sign：规则文件（{\"rules\": [...]} 或规则列表）")
+    p.add_argument("--key", help="sign：HMAC 签名密钥，默认用配置里的 rules_key")
+    p = sub.add_parser("bench", help="基准测试")
+    p.add_argument("target", choices=["startup", "rules", "log", "e2e", "reload", "coldstart", "flap", "simulate", "journal", "control", "groups", "probes", "resume", "feed"])
+    p.add_argument("--ticks", type=int, default=200, help="e2e：每项测量的轮数")
+    p.add_argument("--backend", default="netsh", choices=["netsh", "nmcli", "iw"], help="e2e：回放哪种命令输出")
+    p.add_argument("--out", help="e2e：结果写入 JSON 文件")
+    p.add_argument("--compare", help="e2e：与之前的 JSON 结果对比")
+    p = sub.add_parser("_probe")
+    p.add_argument("--gui", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        CONFIG_FILE = os.path.abspath(args.config)
+        STATE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "autovpn_state.json")
+        RULES_CACHE = os.path.join(os.path.dirname(CONFIG_FILE), "autovpn_rules_cache.json")
+        JOURNAL_DIR = os.path.join(os.path.dirname(CONFIG_FILE), "journal")
+    command = "run" if args.headless and args.command in (None, "gui") else (args.command or "gui")
+
+    if command == "gui":
+        # 界面模块（tkinter、pystray、PIL）只在需要窗口时才加载
+        sys.modules.setdefault("autovpn", sys.modules[__name__])
+        import autovpn_gui
+        return autovpn_gui.run_gui()
+    if command == "bench":
+        # 基准测试和测试替身在单独的模块里，只在需要时加载
+        sys.modules.setdefault("autovpn", sys.modules[__name__])
+        import autovpn_bench
+        return autovpn_bench.run(args)
+    if command == "ctl":
+        return cmd_ctl(" ".join(args.request), args.json)
+
+    config = load_config()
+    if command == "_probe":
+        return _startup_probe(config, args.gui)
+    if command == "status":
+        return cmd_status(config, args.json)
+    if command == "journal":
+        return cmd_journal(args)
+    if command == "simulate":
+        return cmd_simulate(config, args.timeline, args.rules, args.against, not args.no_debounce, args.json)
+    if command == "rules":
+        return cmd_rules(config, args.action, args.file, args.key)
+    if command == "once":
+        return cmd_once(config)
+    return run_headless(config)
+
+# ==================== 主程序 ====================
+if __name__ == "__main__":
+    sys.exit(main())
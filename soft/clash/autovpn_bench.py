@@ -0,0 +1,1040 @@
+# -*- coding: utf-8 -*-
+# AutoVPN Switcher - 基准测试与测试替身（录制的命令输出、假 Clash 控制器、假规则服务器、合成时间线）
+# 由 autovpn.py 的 bench 命令按需导入，监控运行时不会加载本模块；tests/ 也使用这里的替身
+
+import subprocess
+import time
+import threading
+import queue
+import urllib.parse
+import json
+import os
+import sys
+import socket
+import shutil
+import random
+import hashlib
+import itertools
+import tempfile
+import tracemalloc
+import platform
+from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import autovpn
+from autovpn import (
+    CONTROL_ADDRESS, DEFAULT_CONFIG, SSID_PROVIDERS, ClashController, ConfigWatcher, ControlServer,
+    EventJournal, GroupSelector, LogWriter, LogindSleepSource, ManualWatcher, MonitorContext, MonitorControl,
+    NetworkFingerprint, PollScheduler, PowerWatcher, ProbeRunner, ProcWirelessProvider, RuleIndex, RulesFeed,
+    TransitionFilter, compare_rule_sets, compile_rules, create_controller, disable_metrics, enable_metrics,
+    get_ssid, load_snapshot, match_rule, monitor_loop, save_config, send_control, set_clash_mode,
+    set_ssid_provider, sign_rules_document, simulate, simulate_fleet, summarize_simulation, _noop,
+    _transition_factory,
+)
+
+# ==================== 测试替身 ====================
+NETSH_FIXTURE = """
+There is 1 interface on the system:
+
+    Name                   : WLAN
+    Description            : Intel(R) Wi-Fi 6 AX201 160MHz
+    GUID                   : 6f5c2a3e-1b2c-4d5e-8f90-a1b2c3d4e5f6
+    Physical address       : 8c:8d:28:11:22:33
+    State                  : connected
+    SSID                   : {ssid}
+    BSSID                  : 3c:84:6a:aa:bb:cc
+    Network type           : Infrastructure
+    Radio type             : 802.11ax
+    Authentication         : WPA2-Personal
+    Cipher                 : CCMP
+    Connection mode        : Auto Connect
+    Channel                : 36
+    Receive rate (Mbps)    : 1201
+    Transmit rate (Mbps)   : 1201
+    Signal                 : 92%
+    Profile                : {ssid}
+
+    Hosted network status  : Not available
+"""
+
+
+NMCLI_FIXTURE = ("no:Neighbour-2.4G:F4\\:EC\\:38\\:01\\:02\\:03\nno:DIRECT-printer:DA\\:A1\\:19\\:04\\:05\\:06\n"
+                 "yes:{ssid}:3C\\:84\\:6A\\:AA\\:BB\\:CC\nno:Guest:3C\\:84\\:6A\\:AA\\:BB\\:CD\n")
+
+
+IW_FIXTURE = "phy#0\n\tInterface wlp0s20f3\n\t\tifindex 3\n\t\twdev 0x1\n\t\taddr 8c:8d:28:11:22:33\n\t\tssid {ssid}\n\t\ttype managed\n"
+
+
+def fixture_provider(name, outputs):
+    """用录制的命令输出（或 proc 后端的 {网卡: SSID} 字典）构造假后端，按顺序循环回放"""
+    state = {"i": 0}
+
+    def next_output(*args):
+        out = outputs[state["i"] % len(outputs)]
+        state["i"] += 1
+        return out
+
+    if name == "proc":
+        current = {}
+        provider = ProcWirelessProvider(path=os.devnull, essid_func=lambda ifname: current.get(ifname, ""))
+
+        def interfaces():
+            current.clear()
+            current.update(next_output() or {})
+            return list(current)
+        provider.interfaces = interfaces
+        return provider
+    return SSID_PROVIDERS[name](runner=next_output)
+
+
+class FakeClashServer:
+    """进程内的假 Clash 控制器（HTTP/1.1 长连接），用于基准测试和本地验证。
+
+    routes 可按 (方法, 路径前缀) 注册额外接口：fn(server, path, body) -> (状态码, 响应对象)。
+    GET /configs 带 ETag，模式没变时对 If-None-Match 返回 304（etags=False 时关闭）。
+    """
+
+    def __init__(self, mode="rule", delay=0.0):
+        self.version = 0       # 配置版本，模式每变一次加一，用作 ETag
+        self.mode = mode
+        self.etags = True
+        self.not_modified = 0  # 已返回的 304 次数
+        self.max_requests = 0  # 每条连接最多处理的请求数，到达后回 Connection: close 并断开（0 表示不限）
+        self.delay = delay  # 每个请求的人为延迟（秒）
+        self.requests = []
+        self.routes = {}
+        self.connections = {}  # id -> 连接信息，格式同 GET /connections
+        self.groups = {}       # 代理组名 -> {"type": "Selector", "now": 节点, "all": [节点...]}
+        self.delays = {}       # 节点 -> 模拟的测速延迟（毫秒），None 表示不可用
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = 65536  # 整个响应一次写出，避免 Nagle/延迟确认
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else None
+                fake.requests.append((self.command, self.path))
+                if fake.delay:
+                    time.sleep(fake.delay)
+                etag = f'"{fake.version}"' if fake.etags and self.path.startswith("/configs") else None
+                if etag and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+                    status, payload = 304, None
+                    fake.not_modified += 1
+                else:
+                    status, payload = fake.dispatch(self.command, self.path, body)
+                data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(status)
+                self.served = getattr(self, "served", 0) + 1
+                if fake.max_requests and self.served >= fake.max_requests:
+                    # 之后已经发来的管线请求不再处理
+                    self.close_connection = True
+                    self.send_header("Connection", "close")
+                if etag and self.command == "GET" and status in (200, 304):
+                    self.send_header("ETag", f'"{fake.version}"')
+                if status != 304:
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_PATCH = do_PUT = do_DELETE = do_POST = _handle
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.url = self.base + "/configs"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = mode
+        self.version += 1
+
+    def change_mode(self, mode):
+        """模拟在 Clash 界面里手动改模式（不经过 AutoVPN），返回新的配置版本"""
+        self.mode = mode.lower()
+        return self.version
+
+    def dispatch(self, method, path, body):
+        for (m, prefix), fn in self.routes.items():
+            if m == method and path.startswith(prefix):
+                return fn(self, path, body)
+        if path.startswith("/configs"):
+            if method == "GET":
+                return 200, {"mode": self.mode, "port": 7890, "mixed-port": 7897}
+            if method == "PATCH" and body and "mode" in body:
+                self.mode = body["mode"].lower()
+                return 204, None
+        if path.startswith("/connections"):
+            cid = urllib.parse.unquote(path[len("/connections/"):]) if path.startswith("/connections/") else None
+            if method == "GET":
+                return 200, {"downloadTotal": 0, "uploadTotal": 0, "connections": list(self.connections.values())}
+            if method == "DELETE":
+                if cid is None:
+                    self.connections.clear()
+                else:
+                    self.connections.pop(cid, None)
+                return 204, None
+        if method == "POST" and path.startswith("/cache/"):
+            return 204, None
+        if path.startswith("/proxies/"):
+            return self._proxies(method, path, body)
+        return 404, {"message": "not found"}
+
+    def _proxies(self, method, path, body):
+        parts = urllib.parse.urlsplit(path)
+        name, _, action = parts.path[len("/proxies/"):].partition("/")
+        name = urllib.parse.unquote(name)
+        if action == "delay" and method == "GET":
+            if name not in self.delays:
+                return 404, {"message": "resource not found"}
+            timeout = int(urllib.parse.parse_qs(parts.query).get("timeout", ["5000"])[0]) / 1000
+            delay = self.delays[name]
+            # 按模拟延迟真实等待，超时与 Clash 一样返回 504
+            if delay is None or delay / 1000 > timeout:
+                time.sleep(timeout)
+                return 504, {"message": "Timeout"}
+            time.sleep(delay / 1000)
+            return 200, {"delay": delay}
+        group = self.groups.get(name)
+        if group is None:
+            return 404, {"message": "resource not found"}
+        if method == "GET":
+            return 200, dict(group, name=name)
+        if method == "PUT" and body and body.get("name") in group["all"]:
+            group["now"] = body["name"]
+            return 204, None
+        return 400, {"message": "Selector update error"}
+
+    def add_group(self, name, delays):
+        """加入一个选择器代理组，delays 为 {节点: 模拟延迟毫秒或 None}"""
+        self.delays.update(delays)
+        self.groups[name] = {"type": "Selector", "now": next(iter(delays), None), "all": list(delays)}
+
+    def add_connections(self, count, chains=("节点选择", "香港01"), rule="Match"):
+        """批量加入假连接，返回新连接的 id"""
+        ids = []
+        for _ in range(count):
+            cid = f"{len(self.connections):08x}-{random.getrandbits(32):08x}"
+            self.connections[cid] = {"id": cid, "chains": list(chains), "rule": rule, "rulePayload": "",
+                                     "metadata": {"host": "example.com", "destinationPort": "443"}}
+            ids.append(cid)
+        return ids
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeRulesServer:
+    """进程内的规则文档服务器：带 ETag / Last-Modified 并支持条件请求，用于集中规则的基准测试和本地验证"""
+
+    def __init__(self, doc=None, key=None):
+        self.requests = []       # (状态码, 响应体字节数)
+        self.conditional = True  # False 时忽略条件请求头，总是返回全文
+        self.publish(doc or {"version": "1", "rules": [{"ssids": "*", "mode": "Rule"}]}, key)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                etag, body, modified = fake.current
+                inm = self.headers.get("If-None-Match")
+                fresh = inm == etag if inm else self.headers.get("If-Modified-Since") == modified
+                if fake.conditional and fresh:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    fake.requests.append((304, 0))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", modified)
+                self.end_headers()
+                self.wfile.write(body)
+                fake.requests.append((200, len(body)))
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/rules.json"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def publish(self, doc, key=None):
+        """换上一版文档（自动加校验和/签名），ETag 随内容变化"""
+        body = json.dumps(sign_rules_document(doc, key), ensure_ascii=False).encode("utf-8")
+        self.current = (f'"{hashlib.sha256(body).hexdigest()[:16]}"', body, formatdate(usegmt=True))
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def flap_timeline(duration=600, office="Office-5G", hotspot="iPhone", seed=1):
+    """合成的覆盖边缘时间线：办公室 SSID、断开、手机热点之间每 1~8 秒随机跳变，最后稳定在办公室"""
+    rnd = random.Random(seed)
+    t = 0.0
+    events = []
+    while t < duration:
+        events.append((t, rnd.choices([office, None, hotspot], weights=[5, 3, 2])[0]))
+        t += rnd.uniform(1, 8)
+    events.append((t, office))
+    return events
+
+
+def synthetic_timeline(events=1000000, devices=200, seed=7):
+    """合成车队时间线：每台设备在家、公司、公司有线、热点、断网之间随机切换"""
+    rnd = random.Random(seed)
+    home = NetworkFingerprint("Home-WiFi", None, "aa:bb:cc:00:00:01", "wifi")
+    office = NetworkFingerprint("Office-5G", "3c:84:6a:aa:bb:cc", "00:11:22:33:44:55", "wifi")
+    dock = NetworkFingerprint(None, None, "00:11:22:33:44:55", "wired")
+    places = [home, office, dock, "iPhone", None, "Starbucks"]
+    weights = [30, 30, 15, 10, 10, 5]
+    per_device = events // devices
+    timeline = []
+    for d in range(devices):
+        device = f"pc-{d:04d}"
+        t = 0.0
+        for network in rnd.choices(places, weights, k=per_device):
+            t += rnd.expovariate(1 / 120)
+            timeline.append((device, t, network))
+    return timeline
+
+
+# ==================== 基准测试 ====================
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _summary(values, digits=3):
+    return {"p50": round(_percentile(values, 50), digits), "p99": round(_percentile(values, 99), digits),
+            "max": round(max(values), digits) if values else 0.0, "n": len(values)}
+
+
+def bench_log(n=2000):
+    """对比旧实现（每行追加 + 整文件回读裁剪）与后台批量写入的吞吐"""
+    tmp = tempfile.mkdtemp()
+
+    def legacy(path, line, max_lines=1000):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        if len(lines) > max_lines:
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(lines[-max_lines:])
+
+    line = "[12:00:00] 成功 模式切换: Direct\n"
+    path = os.path.join(tmp, "legacy.log")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        legacy(path, line)
+    legacy_s = time.perf_counter() - t0
+
+    writer = LogWriter(os.path.join(tmp, "new.log"))
+    t0 = time.perf_counter()
+    for _ in range(n):
+        writer.write(line)
+    enqueue_s = time.perf_counter() - t0
+    writer.flush()
+    total_s = time.perf_counter() - t0
+    writer.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(f"{n} 行  旧实现: {n / legacy_s:,.0f} 行/秒  "
+          f"新实现: 调用方 {n / enqueue_s:,.0f} 行/秒，落盘 {n / total_s:,.0f} 行/秒")
+
+
+def bench_match_rule(counts=(10, 100, 1000, 5000), lookups=2000):
+    """对比逐条扫描与规则索引在不同规则数下的单次匹配耗时"""
+    def linear(ssid, rules):
+        ssid_lower = (ssid or "").lower()
+        for rule in rules:
+            ssids = [s.strip().lower() for s in rule["ssids"].split(",")]
+            if "*" in ssids or any(s in ssid_lower for s in ssids if s):
+                return rule["mode"]
+        return None
+
+    print(f"{'规则数':>8} {'逐条扫描(us)':>14} {'索引(us)':>10} {'编译(ms)':>10}")
+    for n in counts:
+        rules = [{"ssids": f"Hotel-{i:05d},Office-{i:05d}-5G", "mode": "Direct"} for i in range(n)]
+        rules.append({"ssids": "*", "mode": "Rule"})
+        # 一半命中尾部规则，一半落到兜底
+        ssids = [f"Office-{n - 1 - (i % 10):05d}-5G" if i % 2 else f"Home-{i}" for i in range(lookups)]
+        t0 = time.perf_counter()
+        index = RuleIndex(rules)
+        compile_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        for s in ssids:
+            linear(s, rules)
+        linear_us = (time.perf_counter() - t0) / lookups * 1e6
+        t0 = time.perf_counter()
+        for s in ssids:
+            index.cache.clear()  # 关闭指纹缓存，只测索引本身
+            index.match(s)
+        index_us = (time.perf_counter() - t0) / lookups * 1e6
+        assert all(index.match(s) == linear(s, rules) for s in ssids[:200])
+        print(f"{n:>8} {linear_us:>14.1f} {index_us:>10.2f} {compile_ms:>10.1f}")
+
+
+def bench_probes(rounds=200):
+    """可达性探测：在 127.0.0.1 上开监听端口、慢速 HTTP 服务和关闭的端口，测首次探测、短路与缓存命中的耗时"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(64)
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))  # 只绑定不监听：连接被拒绝
+    slow = FakeClashServer(delay=0.3)
+    open_port, closed_port = listener.getsockname()[1], closed.getsockname()[1]
+    office = {"ssids": f"tcp:127.0.0.1:{closed_port}", "mode": "Global"}
+    cases = (
+        # 第一条规则的端口被拒绝后立即可判定第二条，不等慢速 HTTP
+        ("短路", [office, {"ssids": f"tcp:127.0.0.1:{open_port}", "mode": "Direct"},
+                 {"ssids": f"{slow.base}/configs", "mode": "Global"}, {"ssids": "*", "mode": "Rule"}]),
+        ("等待全部", [office, {"ssids": f"{slow.base}/configs", "mode": "Direct"},
+                     {"ssids": "dns:localhost", "mode": "Global"}, {"ssids": "*", "mode": "Rule"}]),
+    )
+    print(f"{'场景':<8} {'结果':>6} {'首次(ms)':>9} {'缓存命中(us)':>12}  明细")
+    try:
+        for name, rules in cases:
+            runner = ProbeRunner(timeout=0.8, ttl=300)
+            index = RuleIndex(rules)
+            t0 = time.perf_counter()
+            mode = index.lookup("Office-5G", runner)["mode"]
+            first = (time.perf_counter() - t0) * 1000
+            summary = runner.summary()
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                index.lookup("Office-5G", runner)
+            hit = (time.perf_counter() - t0) / rounds * 1e6
+            print(f"{name:<8} {mode:>6} {first:>9.1f} {hit:>12.1f}  {summary}")
+            runner.close()
+    finally:
+        listener.close()
+        closed.close()
+        slow.close()
+    return 0
+
+
+def bench_groups(nodes=40, seed=7):
+    """代理组选择：假控制器按模拟延迟应答测速，对比逐个测速与并发测速在同一总时限下的结果，以及重连时命中缓存"""
+    rnd = random.Random(seed)
+    delays = {f"节点{i:02d}": (None if rnd.random() < 0.15 else rnd.randint(40, 900)) for i in range(nodes)}
+    fastest = min((d, n) for n, d in delays.items() if d is not None)
+    server = FakeClashServer()
+    server.add_group("节点选择", delays)
+    controller = ClashController(server.url)
+    network = NetworkFingerprint("Hotel-WiFi", None, "02:00:00:00:00:01", "wifi")
+    print(f"{nodes} 个节点，{sum(d is None for d in delays.values())} 个不可用，最快 {fastest[1]}（{fastest[0]} ms）")
+    print(f"{'方式':<10} {'耗时(ms)':>9} {'可用':>6} {'选中':>8} {'延迟(ms)':>9} {'请求数':>6}")
+    try:
+        for name, workers, rejoin in (("逐个测速", 1, False), ("并发测速", 16, False), ("重连", 16, True)):
+            selector = GroupSelector(timeout=1.0, deadline=1.5, workers=workers)
+            if rejoin:
+                selector.select(controller, "节点选择", network)
+                server.groups["节点选择"]["now"] = "节点00"  # 离开期间被改掉
+            server.requests.clear()
+            st = selector.select(controller, "节点选择", network)
+            selector.close()
+            measured = "缓存" if st["cached"] else f"{st['alive']}/{st['nodes']}"
+            print(f"{name:<10} {st['ms']:>9.0f} {measured:>6} {st['node'] or '-':>8} {st['delay'] or '-':>9} {len(server.requests):>6}")
+    finally:
+        controller.close()
+        server.close()
+    return 0
+
+
+def bench_resume(runs=5):
+    """休眠唤醒：家里休眠、在公司唤醒（SSID 已变），分别由伪造的 logind 信号、模拟的时钟跳变、无唤醒检测触发，
+    测从唤醒到 Clash 切到直连的耗时。监控轮询间隔设为 1 小时，没有唤醒检测时只能等下一轮。
+    """
+    tmp = tempfile.mkdtemp()
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+    current = ["Home"]
+    set_ssid_provider(SSID_PROVIDERS["netsh"](runner=lambda cmd: NETSH_FIXTURE.format(ssid=current[0])))
+    server = FakeClashServer()
+    offset = [0.0]
+    results = {}
+
+    def once(kind):
+        current[0] = "Home"
+        stop = threading.Event()
+        watcher = ManualWatcher().start()
+        wake = lambda: watcher.notify(settle=False)
+        signals = None
+        if kind == "logind":
+            r, w = os.pipe()
+            signals = os.fdopen(w, "w", buffering=1)
+            power = PowerWatcher(wake, [LogindSleepSource(stream=os.fdopen(r))], period=3600).start()
+        elif kind == "clock":
+            power = PowerWatcher(wake, period=3600, wall=lambda: time.time() + offset[0]).start()
+        else:
+            power = None
+        thread = threading.Thread(target=monitor_loop, daemon=True,
+                                  args=(DEFAULT_CONFIG["rules"], create_controller(server.url), 3600, None, stop, _noop, _noop),
+                                  kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                                power=power)})
+        thread.start()
+        deadline = time.monotonic() + 5
+        while server.mode != "rule" and time.monotonic() < deadline:
+            time.sleep(0.001)
+        if signals:
+            signals.write("/org/freedesktop/login1: org.freedesktop.login1.Manager.PrepareForSleep (true,)\n")
+        current[0] = "Office-5G"  # 休眠期间被带到了公司
+        t0 = time.perf_counter()
+        if signals:
+            signals.write("/org/freedesktop/login1: org.freedesktop.login1.Manager.PrepareForSleep (false,)\n")
+        elif power:
+            offset[0] += 3600  # 墙钟走了一小时，monotonic 没走
+            power.check()
+        deadline = time.monotonic() + 2
+        while server.mode != "direct" and time.monotonic() < deadline:
+            time.sleep(0.001)
+        ms = (time.perf_counter() - t0) * 1000 if server.mode == "direct" else None
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+        if signals:
+            signals.close()
+        return ms
+
+    try:
+        with open(os.devnull, "w") as devnull:
+            saved_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                for kind in ("logind", "clock", "none"):
+                    results[kind] = [once(kind) for _ in range(runs if kind != "none" else 1)]
+            finally:
+                sys.stdout = saved_stdout
+        print(f"{'唤醒来源':<10} {'唤醒→切到直连 p50(ms)':>22}")
+        for kind, samples in results.items():
+            done = [x for x in samples if x is not None]
+            value = f"{_percentile(done, 50):.1f}" if done else "2 秒内未切换（等下一轮，约 1 小时）"
+            print(f"{kind:<10} {value:>22}")
+    finally:
+        server.close()
+        set_ssid_provider(None)
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+    return 0
+
+
+def bench_reload(runs=10, counts=(10, 100, 1000)):
+    """配置热加载：不同规则数下解析+校验+编译的耗时，以及 inotify/轮询两种方式从保存到 Clash 模式切换完成的耗时"""
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "autovpn_config.json")
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+
+    def config_with(n, office_mode="Direct"):
+        rules = [{"ssids": f"Hotel-{i:05d},=Lab-{i:05d}", "mode": "Global"} for i in range(n)]
+        rules += [{"ssids": "Office", "mode": office_mode}, {"ssids": "*", "mode": "Rule"}]
+        return dict(DEFAULT_CONFIG, rules=rules)
+
+    print(f"{'规则数':>8} {'解析校验编译(ms)':>18}")
+    try:
+        for n in counts:
+            save_config(config_with(n), path)
+            costs = [load_snapshot(path).load_ms for _ in range(runs)]
+            print(f"{n:>8} {_percentile(costs, 50):>18.2f}")
+
+        set_ssid_provider(SSID_PROVIDERS["netsh"](runner=lambda cmd: NETSH_FIXTURE.format(ssid="Office-5G")))
+        print(f"\n{'方式':>8} {'保存→切换 p50(ms)':>18} {'p99(ms)':>10}")
+        for backend in ("inotify", "poll"):
+            save_config(config_with(10, "Direct"), path)
+            server = FakeClashServer()
+            controller = create_controller(server.url)
+            watcher = ManualWatcher().start()
+            config_watcher = ConfigWatcher(path, notify=lambda: watcher.notify(settle=False),
+                                           use_inotify=backend == "inotify").start()
+            modes = queue.Queue()
+            stop = threading.Event()
+            thread = threading.Thread(target=monitor_loop, daemon=True,
+                                      args=(config_watcher.snapshot.rules, controller, 3600, None, stop, _noop,
+                                            lambda mode, silent: modes.put(mode)),
+                                      kwargs={"ctx": MonitorContext(watcher=watcher,
+                                                                    scheduler=PollScheduler(3600, 3600),
+                                                                    config_watcher=config_watcher)})
+            effect_ms = []
+            with open(os.devnull, "w") as devnull:
+                saved_stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    thread.start()
+                    modes.get(timeout=5)
+                    for i in range(runs):
+                        target = "Global" if i % 2 == 0 else "Direct"
+                        t0 = time.perf_counter()
+                        save_config(config_with(10, target), path)
+                        try:
+                            while modes.get(timeout=5) != target:
+                                pass
+                        except queue.Empty:
+                            continue
+                        effect_ms.append((time.perf_counter() - t0) * 1000)
+                finally:
+                    stop.set()
+                    watcher.stop()
+                    thread.join(5)
+                    sys.stdout = saved_stdout
+                    server.close()
+            print(f"{config_watcher.backend:>8} {_percentile(effect_ms, 50):>18.1f} {_percentile(effect_ms, 99):>10.1f}")
+    finally:
+        set_ssid_provider(None)
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+def bench_flap(duration=3600):
+    """网络跳变回放：有/无防抖时的切换次数、切到代理的次数与处理耗时"""
+    rules = DEFAULT_CONFIG["rules"]
+    events = flap_timeline(duration)
+    cfg = DEFAULT_CONFIG
+    print(f"{len(events)} 个网络事件，{duration} 秒")
+    print(f"{'':>6} {'切换次数':>8} {'切到代理':>8} {'耗时(ms)':>10}")
+    for name, transition in (("无防抖", None),
+                             ("防抖", TransitionFilter(cfg["stable_window"], cfg["max_switches"],
+                                                     cfg["switch_window"], cfg["immediate_modes"]))):
+        t0 = time.perf_counter()
+        switches = simulate(events, rules, transition)["switches"]
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{name:>6} {len(switches):>8} {sum(1 for _, m in switches if m != 'Direct'):>8} {ms:>10.1f}")
+    return 0
+
+
+def bench_simulate(events=1000000):
+    """离线回放吞吐：合成一百万事件，分别测无防抖、防抖、两套规则对比"""
+    timeline = synthetic_timeline(events)
+    rules_a = DEFAULT_CONFIG["rules"]
+    rules_b = [{"ssids": "gw:00:11:22:33:44:55", "mode": "Direct"}] + rules_a
+    print(f"{'场景':>10} {'耗时(ms)':>10} {'百万事件/分钟':>14} {'切换次数':>10}")
+    cases = (("无防抖", lambda: simulate_fleet(timeline, rules_a)),
+             ("防抖", lambda: simulate_fleet(timeline, rules_a, _transition_factory(DEFAULT_CONFIG))),
+             ("规则对比", lambda: compare_rule_sets(timeline, rules_a, rules_b, _transition_factory(DEFAULT_CONFIG))[0]))
+    for name, run in cases:
+        t0 = time.perf_counter()
+        res = run()
+        sec = time.perf_counter() - t0
+        print(f"{name:>10} {sec * 1000:>10.0f} {len(timeline) / sec * 60 / 1e6:>14.1f} "
+              f"{summarize_simulation(res)['switches']:>10}")
+    return 0
+
+
+def bench_control(runs=2000):
+    """控制通道往返耗时：status 直接应答；force、reevaluate 要等监控线程跑完一轮（假 Clash 控制器）"""
+    tmp = tempfile.mkdtemp()
+    address = CONTROL_ADDRESS + f"-bench-{os.getpid()}" if sys.platform == "win32" else os.path.join(tmp, "bench.sock")
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+    set_ssid_provider(SSID_PROVIDERS["netsh"](runner=lambda cmd: NETSH_FIXTURE.format(ssid="Office-5G")))
+    fake = FakeClashServer()
+    control = MonitorControl()
+    stop_event = threading.Event()
+    watcher = ManualWatcher().start()
+    control.override.notify = lambda: watcher.notify(settle=False)
+    control.attach(watcher)
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=(DEFAULT_CONFIG["rules"], create_controller(fake.url), 3600, None, stop_event, _noop, _noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                            override=control.override, status=control.status)})
+    server = ControlServer(control.handle, address).start()
+    results = []
+    try:
+        with open(os.devnull, "w") as devnull:
+            saved_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                thread.start()
+                control._after_tick(0)
+                for name, commands in (("status", ["status"] * runs),
+                                       ("force", ["force Global", "force auto"] * (runs // 20)),
+                                       ("reevaluate", ["reevaluate"] * (runs // 10))):
+                    times = []
+                    for cmd in commands:
+                        t0 = time.perf_counter()
+                        reply = send_control(cmd, address)
+                        times.append((time.perf_counter() - t0) * 1000)
+                        if not (reply and reply["ok"]):
+                            raise RuntimeError(f"{cmd}: {reply}")
+                    results.append((name, sorted(times)))
+            finally:
+                sys.stdout = saved_stdout
+        print(f"{'命令':<12} {'次数':>6} {'p50(ms)':>8} {'p99(ms)':>8} {'最大(ms)':>8}")
+        for name, times in results:
+            print(f"{name:<12} {len(times):>6} {_percentile(times, 50):>8.2f} {_percentile(times, 99):>8.2f} {times[-1]:>8.2f}")
+        print(f"共处理 {server.requests} 个请求，Clash 当前模式 {fake.mode}")
+    finally:
+        stop_event.set()
+        watcher.stop()
+        thread.join(5)
+        server.stop()
+        fake.close()
+        set_ssid_provider(None)
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+    return 0
+
+
+def bench_e2e(ticks=200, backend="netsh", out=None, compare=None):
+    """端到端切换延迟：录制的 WiFi 命令输出 + 进程内假 Clash 控制器，无需无线网卡。
+
+    输出各阶段耗时、每轮 CPU 时间与内存分配，以及从 SSID 变化到回读确认切换完成的 p50/p99；
+    out 写入 JSON 结果，compare 与之前的结果文件对比。
+    """
+    fixtures = {"netsh": NETSH_FIXTURE, "nmcli": NMCLI_FIXTURE, "iw": IW_FIXTURE}
+    office, home = "Office-5G", "Home-WiFi"
+    state = {"ssid": home}
+    provider = SSID_PROVIDERS[backend](runner=lambda cmd: fixtures[backend].format(ssid=state["ssid"]))
+    set_ssid_provider(provider)
+    rules = compile_rules(DEFAULT_CONFIG["rules"])
+    server = FakeClashServer()
+    controller = create_controller(server.url)
+    tmp = tempfile.mkdtemp()
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+    results = {}
+    try:
+        # 1. 各阶段单独计时
+        ssid_ms, match_us, switch_ms = [], [], []
+        for i in range(ticks):
+            state["ssid"] = office if i % 2 else home
+            t0 = time.perf_counter()
+            ssid = get_ssid()
+            t1 = time.perf_counter()
+            target = match_rule(ssid, rules)
+            t2 = time.perf_counter()
+            ok, _ = set_clash_mode(target, controller)
+            t3 = time.perf_counter()
+            ssid_ms.append((t1 - t0) * 1000)
+            rules.cache.clear()
+            match_us.append((t2 - t1) * 1e6)
+            switch_ms.append((t3 - t2) * 1000)
+        results["ssid_query_ms"] = _summary(ssid_ms)
+        results["match_rule_us"] = _summary(match_us)
+        results["switch_confirmed_ms"] = _summary(switch_ms)
+
+        # 2. 稳态一轮（网络未变、模式一致只做一次 GET）的 CPU 时间与内存分配
+        state["ssid"] = office
+        set_clash_mode("Direct", controller)
+        tracemalloc.start()
+        snap0 = tracemalloc.take_snapshot()
+        cpu0 = time.thread_time()
+        for _ in range(ticks):
+            set_clash_mode(match_rule(get_ssid(), rules), controller)
+        cpu = (time.thread_time() - cpu0) / ticks
+        snap1 = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = snap1.compare_to(snap0, "filename")
+        results["tick_cpu_ms"] = round(cpu * 1000, 4)
+        results["tick_alloc_blocks"] = round(sum(max(0, s.count_diff) for s in stats) / ticks, 2)
+        results["tick_peak_kb"] = round(peak / 1024, 1)
+
+        # 开启指标收集后的稳态 CPU，用于确认埋点开销
+        saved_metrics = autovpn._metrics
+        enable_metrics()
+        cpu0 = time.thread_time()
+        for _ in range(ticks):
+            set_clash_mode(match_rule(get_ssid(), rules), controller)
+        results["tick_cpu_ms_metrics"] = round((time.thread_time() - cpu0) / ticks * 1000, 4)
+        if saved_metrics is None:
+            disable_metrics()
+
+        # 3. 完整监控循环：模拟网络变化事件，计到回读确认
+        watcher = ManualWatcher().start()
+        switched = threading.Event()
+        stop = threading.Event()
+        e2e_ms = []
+
+        def on_mode(mode, silent):
+            switched.set()
+        state["ssid"] = home
+        thread = threading.Thread(target=monitor_loop, daemon=True,
+                                  args=(rules, controller, 3600, None, stop, _noop, on_mode),
+                                  kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600))})
+        with open(os.devnull, "w") as devnull:
+            saved_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                thread.start()
+                switched.wait(5)
+                for i in range(ticks):
+                    switched.clear()
+                    t0 = time.perf_counter()
+                    state["ssid"] = office if i % 2 == 0 else home
+                    watcher.notify()
+                    if switched.wait(5):
+                        e2e_ms.append((time.perf_counter() - t0) * 1000)
+            finally:
+                stop.set()
+                watcher.stop()
+                thread.join(5)
+                sys.stdout = saved_stdout
+        results["change_to_confirmed_ms"] = _summary(e2e_ms)
+        results["watcher_settle_ms"] = watcher.settle * 1000
+    finally:
+        controller.close()
+        server.close()
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+        set_ssid_provider(None)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {"benchmark": "e2e", "backend": backend, "ticks": ticks,
+              "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "results": results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if compare:
+        with open(compare, "r", encoding="utf-8") as f:
+            old = json.load(f)["results"]
+        print("\n与基线对比（正数表示变慢）:")
+        for key, value in results.items():
+            before = old.get(key)
+            a = value.get("p50") if isinstance(value, dict) else value
+            b = before.get("p50") if isinstance(before, dict) else before
+            if isinstance(a, (int, float)) and isinstance(b, (int, float)) and b:
+                print(f"  {key:<26} {b:>10} → {a:<10} {(a - b) / b * 100:+.1f}%")
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+def bench_coldstart(runs=5, connections=500):
+    """冷启动：
+    1. Clash 已是目标模式时，有/无状态文件下从监控启动到确认的耗时，以及发出的写请求数（含切换后清理）
+    2. Clash 晚于本程序 N 秒可用时（按假时钟推演调度），启动期快速重试与指数退避下首次确认的时间
+    """
+    tmp = tempfile.mkdtemp()
+    state_path = os.path.join(tmp, "autovpn_state.json")
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+    set_ssid_provider(SSID_PROVIDERS["netsh"](runner=lambda cmd: NETSH_FIXTURE.format(ssid="Office-5G")))
+    server = FakeClashServer(mode="direct")
+    rules = compile_rules(DEFAULT_CONFIG["rules"])
+    cutover_opts = {"modes": ["Direct"], "flush": True, "timeout": 2.0}
+
+    def start_once():
+        server.requests.clear()
+        server.connections.clear()
+        server.add_connections(connections)
+        confirmed = threading.Event()
+        stop = threading.Event()
+        controller = create_controller(server.url)
+        thread = threading.Thread(target=monitor_loop, daemon=True,
+                                  args=(rules, controller, 3600, None, stop, _noop, lambda mode, silent: confirmed.set()),
+                                  kwargs={"ctx": MonitorContext(scheduler=PollScheduler(3600, 3600),
+                                                                fingerprint=True, cutover_opts=cutover_opts,
+                                                                state_path=state_path)})
+        t0 = time.perf_counter()
+        thread.start()
+        confirmed.wait(5)
+        ms = (time.perf_counter() - t0) * 1000
+        time.sleep(0.3)  # 等后台清理结束再统计请求
+        stop.set()
+        thread.join(5)
+        writes = sum(1 for method, _ in server.requests if method != "GET")
+        return ms, writes, len(server.requests)
+
+    print(f"{'状态文件':>8} {'启动→确认 p50(ms)':>18} {'写请求':>8} {'总请求':>8}")
+    try:
+        with open(os.devnull, "w") as devnull:
+            saved_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results = {}
+                for variant in ("无", "有"):
+                    start_once()  # 预热，同时写出状态文件
+                    samples = []
+                    for _ in range(runs):
+                        if variant == "无" and os.path.exists(state_path):
+                            os.remove(state_path)
+                        samples.append(start_once())
+                    results[variant] = samples
+            finally:
+                sys.stdout = saved_stdout
+        for variant, samples in results.items():
+            print(f"{variant:>8} {_percentile([x[0] for x in samples], 50):>18.1f} "
+                  f"{samples[-1][1]:>8} {samples[-1][2]:>8}")
+    finally:
+        server.close()
+        set_ssid_provider(None)
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    cfg = DEFAULT_CONFIG
+    print(f"\n{'Clash 可用(s)':>12} {'快速重试(s)':>12} {'指数退避(s)':>12}")
+    for late in (5, 10, 20, 40):
+        row = []
+        for grace in (cfg["boot_grace"], 0):
+            now = [0.0]
+            sched = PollScheduler(cfg["interval"], cfg["fast_interval"], cfg["max_interval"], cfg["max_backoff"],
+                                  clock=lambda: now[0], rand=lambda: 0.5, boot_grace=grace)
+            while now[0] < late:
+                now[0] += sched.update(failed=True, unreachable=True)
+            row.append(now[0])
+        print(f"{late:>12} {row[0]:>12.0f} {row[1]:>12.0f}")
+    return 0
+
+
+def bench_journal(records=1000000, page=200):
+    """事件日志：写入吞吐、索引大小，以及百万条记录下按字段、时间、文本查询第一页的耗时"""
+    tmp = tempfile.mkdtemp()
+    try:
+        journal = EventJournal(tmp)
+        ssids = [f"Hotel-{i:03d}" for i in range(200)] + ["Office-5G", "Home-WiFi", None]
+        rnd = random.Random(3)
+        t = time.time() - records * 30
+        t0 = time.perf_counter()
+        for i in range(records):
+            t += 30
+            ssid = rnd.choice(ssids)
+            if i % 3:
+                rec = {"kind": "ssid", "ssid": ssid, "ms": 1.2, "level": "info", "msg": f"WiFi: {ssid or '未连接'}"}
+            elif i % 1000 == 0:
+                rec = {"kind": "error", "level": "error", "msg": f"E 监控错误: timed out #{i}"}
+            else:
+                mode = "Direct" if ssid == "Office-5G" else "Rule"
+                rec = {"kind": "switch", "ssid": ssid, "mode": mode, "ok": True, "level": "info",
+                       "msg": f"成功 模式切换: {mode}"}
+            rec["t"] = round(t, 3)
+            journal.write(rec)
+        journal.close(timeout=600)
+        write_s = time.perf_counter() - t0
+        size = sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp))
+        idx_size = sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp) if n.endswith(".idx"))
+        print(f"写入 {records} 条: {write_s:.1f} s（{records / write_s:,.0f} 条/秒），"
+              f"数据 {size / 1e6:.1f} MB，索引 {idx_size / 1e6:.2f} MB")
+
+        t0 = time.perf_counter()
+        journal = EventJournal(tmp)
+        print(f"重新打开（加载索引）: {(time.perf_counter() - t0) * 1000:.0f} ms，{journal.stats()['segments']} 段")
+        mid = t - records * 15
+        queries = (("最新一页", {}),
+                   ("level=error", {"level": "error"}),
+                   ("ssid=Office-5G", {"ssid": "Office-5G"}),
+                   ("时间范围（中间 1 小时）", {"start": mid, "end": mid + 3600}),
+                   ("文本 timed out", {"text": "timed out"}),
+                   ("ssid=Hotel-007 且 mode=Rule", {"ssid": "Hotel-007", "mode": "Rule"}),
+                   ("不存在的 SSID", {"ssid": "Nowhere"}))
+        print(f"{'查询':<28} {'首页(ms)':>10} {'条数':>6}")
+        for name, kwargs in queries:
+            t0 = time.perf_counter()
+            rows = list(itertools.islice(journal.query(**kwargs), page))
+            print(f"{name:<28} {(time.perf_counter() - t0) * 1000:>10.1f} {len(rows):>6}")
+        journal.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+def bench_feed(rules=2000, runs=50):
+    """集中规则：首次拉取、304 未修改、关闭条件请求时的全量拉取、离线从缓存启动，以及共享文件未变时的检查耗时"""
+    tmp = tempfile.mkdtemp()
+    saved_writer, autovpn._log_writer = autovpn._log_writer, LogWriter(os.path.join(tmp, "bench.log"), max_lines=10 ** 9)
+    doc = {"version": "2026.1", "rules": [{"ssids": f"Branch-{i:05d},=Lab-{i:05d}", "mode": "Direct"}
+                                          for i in range(rules)] + [{"ssids": "*", "mode": "Rule"}]}
+    server = FakeRulesServer(doc)
+    cache = os.path.join(tmp, "rules_cache.json")
+
+    def timed(fn, n):
+        costs = []
+        with open(os.devnull, "w") as devnull:
+            saved_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                for _ in range(n):
+                    t0 = time.perf_counter()
+                    fn()
+                    costs.append((time.perf_counter() - t0) * 1000)
+            finally:
+                sys.stdout = saved_stdout
+        return costs
+
+    print(f"{'场景':<12} {'p50(ms)':>9} {'p99(ms)':>9} {'每次响应(B)':>12}")
+    try:
+        feed = RulesFeed(server.url, cache)
+        first = timed(feed.refresh, 1)
+        print(f"{'首次拉取':<12} {first[0]:>9.2f} {first[0]:>9.2f} {server.requests[-1][1]:>12}")
+        before = len(server.requests)
+        costs = timed(feed.refresh, runs)
+        sizes = [b for _, b in server.requests[before:]]
+        print(f"{'未修改(304)':<12} {_percentile(costs, 50):>9.2f} {_percentile(costs, 99):>9.2f} {max(sizes):>12}")
+        server.conditional = False
+        before = len(server.requests)
+        costs = timed(feed.refresh, runs)
+        sizes = [b for _, b in server.requests[before:]]
+        print(f"{'不支持条件请求':<12} {_percentile(costs, 50):>9.2f} {_percentile(costs, 99):>9.2f} {max(sizes):>12}")
+        server.close()
+        server = None
+        costs = timed(lambda: RulesFeed(feed.source, cache), runs)
+        offline = RulesFeed(feed.source, cache)
+        result = []
+        timed(lambda: result.append(offline.refresh()), 1)
+        print(f"{'离线载入缓存':<12} {_percentile(costs, 50):>9.2f} {_percentile(costs, 99):>9.2f} {'-':>12}"
+              f"  （{len(offline.rules)} 条，拉取结果 {result[0]}）")
+        path = os.path.join(tmp, "rules.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(sign_rules_document(doc), f, ensure_ascii=False)
+        shared = RulesFeed(path)
+        timed(shared.refresh, 1)
+        costs = timed(shared.refresh, runs)
+        print(f"{'共享文件未变':<12} {_percentile(costs, 50):>9.3f} {_percentile(costs, 99):>9.3f} {'-':>12}")
+    finally:
+        if server:
+            server.close()
+        autovpn._log_writer.close()
+        autovpn._log_writer = saved_writer
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+def bench_startup(runs=5):
+    """分别以无界面和加载界面模块的方式启动子进程，统计从进程启动到首次决策的耗时与内存"""
+    if getattr(sys, "frozen", False):
+        base = [sys.executable]
+    else:
+        base = [sys.executable, os.path.abspath(autovpn.__file__)]
+    print(f"{'模式':<8} {'进程→决策(ms)':>14} {'模块加载(ms)':>12} {'界面模块(ms)':>12} {'峰值内存(KB)':>12}")
+    for label, extra in (("headless", []), ("gui", ["--gui"])):
+        rows = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            out = subprocess.run(base + ["_probe"] + extra, capture_output=True, text=True)
+            wall = (time.perf_counter() - t0) * 1000
+            try:
+                data = json.loads(out.stdout.strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                print(f"{label:<8} 启动失败: {out.stderr.strip().splitlines()[-1:]}")
+                break
+            data["wall_ms"] = wall
+            rows.append(data)
+        if rows:
+            med = lambda k: sorted(r[k] for r in rows)[len(rows) // 2]
+            print(f"{label:<8} {med('wall_ms'):>14.1f} {med('import_ms'):>12.1f} "
+                  f"{med('gui_import_ms'):>12.1f} {med('rss_kb'):>12}")
+    return 0
+
+
+BENCHES = {"startup": bench_startup, "rules": bench_match_rule, "log": bench_log,
+           "reload": bench_reload, "coldstart": bench_coldstart, "flap": bench_flap,
+           "simulate": bench_simulate, "journal": bench_journal, "control": bench_control,
+           "groups": bench_groups, "probes": bench_probes, "resume": bench_resume, "feed": bench_feed}
+
+
+def run(args):
+    """bench 命令入口：args 为 autovpn.main 解析好的参数"""
+    if args.target == "e2e":
+        return bench_e2e(args.ticks, args.backend, args.out, args.compare)
+    return BENCHES[args.target]() or 0
@@ -0,0 +1,857 @@
+# -*- coding: utf-8 -*-
+# AutoVPN Switcher - 图形界面（主窗口、设置、日志窗口、托盘）
+# 依赖: pip install pystray pillow
+# 由 autovpn.py 在需要窗口时才导入，无界面模式不会加载本模块
+
+import tkinter as tk
+from tkinter import messagebox, scrolledtext
+import threading
+import collections
+import itertools
+import time
+import os
+import sys
+import ctypes
+import pystray
+from PIL import Image, ImageDraw, ImageFont
+try:
+    import winreg
+except ImportError:  # 非 Windows 平台
+    winreg = None
+
+from autovpn import (
+    CONFIG_FILE, LOG_FILE, ICON_ICO, ICON_PNG,
+    acquire_mutex, release_mutex, load_config, save_config,
+    log, set_log_view, read_log_tail, flush_log_writer, close_log_writer,
+    parse_api_urls, create_monitor, get_journal, format_event,
+    MonitorControl, ControlServer, send_control,
+)
+
+# ==================== 日志窗口 ====================
+class LogView:
+    """日志窗口的线程安全缓冲：任意线程 push，Tk 线程用 root.after 定时批量取出，窗口最多保留 max_lines 行"""
+
+    def __init__(self, root, max_lines=2000, interval_ms=200):
+        self.root = root
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.pending = collections.deque(maxlen=max_lines)
+        self.widget = None
+        self._after = None  # 已排定的 _pump，重复 attach 时先取消，保证只有一条定时链
+
+    def push(self, line):
+        # 窗口未打开时不缓存，打开时从日志文件尾部补齐
+        if self.widget is not None:
+            self.pending.append(line)
+
+    def attach(self, widget):
+        self.widget = widget
+        flush_log_writer(timeout=1)
+        self.pending.clear()
+        try:
+            tail = read_log_tail(LOG_FILE, self.max_lines)
+        except OSError:
+            tail = []
+        widget.insert(tk.END, "".join(tail))
+        widget.see(tk.END)
+        self._schedule()
+
+    def detach(self):
+        self.widget = None
+        self.pending.clear()
+        self._cancel()
+
+    def _schedule(self):
+        self._cancel()
+        self._after = self.root.after(self.interval_ms, self._pump)
+
+    def _cancel(self):
+        if self._after is not None:
+            try:
+                self.root.after_cancel(self._after)
+            except tk.TclError:
+                pass
+            self._after = None
+
+    def clear(self):
+        if self.widget is not None and self.widget.winfo_exists():
+            self.widget.delete("1.0", tk.END)
+
+    def _pump(self):
+        self._after = None
+        widget = self.widget
+        if widget is None or not widget.winfo_exists():
+            return
+        lines = []
+        while self.pending:
+            lines.append(self.pending.popleft())
+        if lines:
+            # 只有视图停在底部时才自动滚动，方便翻看历史
+            at_bottom = widget.yview()[1] >= 0.999
+            widget.insert(tk.END, "".join(lines))
+            count = int(widget.index("end-1c").split(".")[0])
+            if count > self.max_lines:
+                widget.delete("1.0", f"{count - self.max_lines + 1}.0")
+            if at_bottom:
+                widget.see(tk.END)
+        self._schedule()
+
+
+class JournalPager:
+    """日志窗口的检索模式：后台线程从事件日志按页取记录（从新到旧），Tk 线程把每页插到文本框顶部"""
+
+    def __init__(self, root, widget, status_var, page=200):
+        self.root = root
+        self.widget = widget
+        self.status_var = status_var
+        self.page = page
+        self.shown = 0
+        self._iter = None
+        self._gen = 0       # 每次新检索加一，丢弃旧检索迟到的结果
+        self._busy = False
+        self._done = False
+
+    def start(self, **query):
+        self._gen += 1
+        self._busy = self._done = False
+        self.shown = 0
+        self.widget.delete("1.0", tk.END)
+        journal = get_journal()
+        if journal is None:
+            self._iter = None
+            self.status_var.set("事件日志未启用（journal），请先开始监控")
+            return
+        self._iter = journal.query(**query)
+        self.more()
+
+    def stop(self):
+        self._gen += 1
+        self._iter = None
+
+    def more(self):
+        if self._iter is None or self._busy or self._done:
+            return
+        self._busy = True
+        self.status_var.set("检索中…")
+        threading.Thread(target=self._fetch, args=(self._gen, self._iter), daemon=True).start()
+
+    def _fetch(self, gen, it):
+        t0 = time.perf_counter()
+        try:
+            rows = list(itertools.islice(it, self.page))
+        except Exception as e:
+            rows = []
+            log(f"E 检索事件日志失败: {e}")
+        ms = (time.perf_counter() - t0) * 1000
+        self.root.after(0, lambda: self._show(gen, rows, ms))
+
+    def _show(self, gen, rows, ms):
+        if gen != self._gen or not self.widget.winfo_exists():
+            return
+        self._busy = False
+        self._done = len(rows) < self.page
+        first = self.shown == 0
+        if rows:
+            self.widget.insert("1.0", "".join(format_event(r) for r in reversed(rows)))
+        self.shown += len(rows)
+        if first:
+            self.widget.see(tk.END)
+        tail = "，没有更早的记录" if self._done else "，点“更早”继续"
+        self.status_var.set(f"已显示 {self.shown} 条（本页 {ms:.0f} ms）{tail}")
+
+
+class TrayIcon:
+    """随模式和运行状态变化的托盘图标。每种状态的图片只绘制一次并缓存；
+    update() 只在 Tk 线程调用，短时间内的多次变化合并成一次刷新，网络来回跳变也不会频繁重绘托盘。
+    """
+    COLORS = {"Direct": "#27ae60", "Rule": "#3498db", "Global": "#e67e22", "error": "#e74c3c", "stopped": "#95a5a6"}
+    NAMES = {"Direct": "直连", "Rule": "规则", "Global": "全局"}
+
+    def __init__(self, root, base, menu, coalesce_ms=300):
+        self.root = root
+        self.base = base.convert("RGBA").resize((64, 64))
+        self.coalesce_ms = coalesce_ms
+        self.mode = None
+        self.state = "stopped"   # stopped / running / error
+        self.forced = None
+        self.updates = 0         # update() 调用次数
+        self.redraws = 0         # 实际刷新托盘的次数
+        self._images = {}
+        self._shown = None
+        self._scheduled = False
+        self.icon = pystray.Icon("AutoVPN", self.image("stopped"), self.title(), menu)
+
+    def image(self, key):
+        img = self._images.get(key)
+        if img is None:
+            img = self.base.copy()
+            ImageDraw.Draw(img).ellipse((34, 34, 62, 62), fill=self.COLORS.get(key, self.COLORS["Rule"]),
+                                        outline="white", width=3)
+            self._images[key] = img
+        return img
+
+    def key(self):
+        if self.state != "running":
+            return self.state
+        return self.mode or "stopped"
+
+    def title(self):
+        if self.state == "stopped":
+            return "VPN 切换器 - 未运行"
+        text = f"VPN 切换器 - {self.NAMES.get(self.mode, self.mode or '--')}"
+        if self.forced:
+            text += "（手动）"
+        if self.state == "error":
+            text += "（连接异常）"
+        return text
+
+    def update(self, **changes):
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.updates += 1
+        if not self._scheduled:
+            self._scheduled = True
+            self.root.after(self.coalesce_ms, self._flush)
+
+    def _flush(self):
+        self._scheduled = False
+        shown = (self.key(), self.title(), self.forced)
+        if shown == self._shown:
+            return
+        forced_changed = self._shown is None or shown[2] != self._shown[2]
+        self._shown = shown
+        self.redraws += 1
+        self.icon.icon = self.image(shown[0])
+        self.icon.title = shown[1]
+        if forced_changed:
+            self.icon.update_menu()
+
+    def run(self):
+        threading.Thread(target=self.icon.run, daemon=True).start()
+
+    def stop(self):
+        self.icon.stop()
+
+
+# ==================== 托盘 & 热键 ====================
+def set_autostart(enable):
+    try:
+        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run", 0, winreg.KEY_SET_VALUE)
+        if enable:
+            winreg.SetValueEx(key, "AutoVPN", 0, winreg.REG_SZ, f'"{sys.executable}"')
+        else:
+            try:
+                winreg.DeleteValue(key, "AutoVPN")
+            except:
+                pass
+        winreg.CloseKey(key)
+    except:
+        pass
+
+class App:
+    def __init__(self, root):
+        self.root = root
+        self.config = load_config()
+        self.thread = None
+        self.watcher = None
+        self.scheduler = None
+        self.stop_event = threading.Event()
+        # 托盘菜单与本机控制通道（ctl 命令）共用同一个控制对象
+        self.control = MonitorControl()
+        self.control.extra["show"] = lambda arg: self.show_window()
+        self.control.on_force = lambda mode: self.root.after(0, lambda: self.tray.update(forced=mode))
+        self.override = self.control.override
+        self.control_server = None
+        self.log_window = None
+        self.log_view = LogView(root, max_lines=self.config.get("log_view_lines", 2000))
+        set_log_view(self.log_view)
+
+        root.title("AutoVPN 切换器")
+        root.geometry("400x500")
+        root.minsize(380, 240)
+        root.resizable(True, True)
+        root.configure(bg="#f5f7fa")
+
+        # 尝试加载目录下的 ico 优先作为窗口图标，若没有则尝试 png
+        try:
+            if os.path.exists(ICON_ICO):
+                try:
+                    root.iconbitmap(ICON_ICO)
+                except:
+                    pass
+            elif os.path.exists(ICON_PNG):
+                try:
+                    self._icon_photo = tk.PhotoImage(file=ICON_PNG)
+                    root.iconphoto(False, self._icon_photo)
+                except:
+                    pass
+        except:
+            pass
+
+        # 设置窗口权重，使内容自适应
+        root.grid_rowconfigure(0, weight=1)
+        root.grid_columnconfigure(0, weight=1)
+
+        self._create_ui()
+        self.setup_tray()
+        self.load_autostart()
+        if self.config.get("control", True):
+            try:
+                self.control_server = ControlServer(self.control.handle).start()
+            except OSError as e:
+                log(f"E 控制通道不可用: {e}")
+
+    def _create_ui(self):
+        # 主容器使用网格布局
+        main_container = tk.Frame(self.root, bg="#f5f7fa")
+        main_container.grid(row=0, column=0, sticky="nsew", padx=0, pady=0)
+        main_container.grid_rowconfigure(0, weight=0)  # 头部
+        main_container.grid_rowconfigure(1, weight=0)  # 状态
+        main_container.grid_rowconfigure(2, weight=0)  # 按钮
+        main_container.grid_rowconfigure(3, weight=1)  # 空白
+        main_container.grid_columnconfigure(0, weight=1)
+
+        self._create_header(main_container)
+        self._create_status_section(main_container)
+        self._create_buttons(main_container)
+
+    def _create_header(self, parent):
+        header = tk.Frame(parent, bg="#2c3e50", height=110)
+        header.grid(row=0, column=0, sticky="ew", padx=0, pady=0)
+        header.grid_columnconfigure(0, weight=1)
+        header.pack_propagate(False)
+        
+        inner = tk.Frame(header, bg="#2c3e50")
+        inner.pack(expand=True, fill="both")
+        
+        tk.Label(inner, text="⚔️", font=("Segoe UI Emoji", 36), bg="#2c3e50", fg="white").pack(pady=(8, 0))
+        tk.Label(inner, text="VPN 切换器", font=("Microsoft YaHei UI", 18, "bold"), bg="#2c3e50", fg="white").pack(pady=(2, 0))
+        tk.Label(inner, text="智能多策略 VPN 切换系统", font=("Microsoft YaHei UI", 9), bg="#2c3e50", fg="#bdc3c7").pack(pady=(0, 8))
+
+    def _create_status_section(self, parent):
+        frame = tk.Frame(parent, bg="#ffffff", highlightbackground="#dfe4ea", highlightthickness=1)
+        frame.grid(row=1, column=0, sticky="ew", padx=15, pady=(15, 15))
+        frame.grid_columnconfigure(0, weight=1)
+        
+        inner = tk.Frame(frame, bg="#ffffff")
+        inner.pack(fill="both", expand=False, padx=15, pady=12)
+        
+        # 状态行
+        status_row = tk.Frame(inner, bg="#ffffff")
+        status_row.pack(fill="x", padx=0, pady=(0, 8))
+        tk.Label(status_row, text="运行状态:", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(side="left", padx=(0, 10))
+        self.status_label = tk.Label(status_row, text="未启动", font=("Microsoft YaHei UI", 11, "bold"), bg="#ffffff", fg="#95a5a6")
+        self.status_label.pack(side="left", fill="x", expand=True)
+        
+        # 模式行
+        mode_row = tk.Frame(inner, bg="#ffffff")
+        mode_row.pack(fill="x", padx=0, pady=(0, 0))
+        tk.Label(mode_row, text="当前模式:", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(side="left", padx=(0, 10))
+        self.mode_label = tk.Label(mode_row, text="--", font=("Microsoft YaHei UI", 11, "bold"), bg="#ffffff", fg="#2c3e50")
+        self.mode_label.pack(side="left", fill="x", expand=True)
+
+    def _create_buttons(self, parent):
+        frame = tk.Frame(parent, bg="#f5f7fa")
+        frame.grid(row=2, column=0, sticky="ew", padx=15, pady=(0, 15))
+        frame.grid_columnconfigure(0, weight=1)
+        
+        btn_inner = tk.Frame(frame, bg="#f5f7fa")
+        btn_inner.pack(expand=False, pady=10, fill="x")
+        
+        # 使用 grid 布局使按钮能自适应换行
+        btn_frame = tk.Frame(btn_inner, bg="#f5f7fa")
+        btn_frame.pack(fill="x")
+        btn_frame.grid_columnconfigure(0, weight=1)
+        btn_frame.grid_columnconfigure(1, weight=1)
+        btn_frame.grid_columnconfigure(2, weight=1)
+        btn_frame.grid_columnconfigure(3, weight=1)
+        
+        tk.Button(btn_frame, text="▶ 启动", command=self.start, bg="#27ae60", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=0, padx=4, pady=2, sticky="ew")
+        tk.Button(btn_frame, text="⏹ 停止", command=self.stop, bg="#e74c3c", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=1, padx=4, pady=2, sticky="ew")
+        tk.Button(btn_frame, text="⚙ 设置", command=self.open_settings, bg="#3498db", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=2, padx=4, pady=2, sticky="ew")
+        tk.Button(btn_frame, text="📋 日志", command=self.open_log_window, bg="#9b59b6", fg="white", relief="flat", padx=10, pady=10, font=("Microsoft YaHei UI", 10, "bold")).grid(row=0, column=3, padx=4, pady=2, sticky="ew")
+
+    def update_status(self, text, color):
+        state = {"已停止": "stopped", "异常": "error"}.get(text, "running")
+        if self.status_label.winfo_exists():
+            self.root.after(0, lambda: [self.status_label.config(text=f"{text}", fg=color), self.tray.update(state=state)])
+
+    def update_mode(self, mode, is_silent=False):
+        if self.mode_label.winfo_exists():
+            self.root.after(0, lambda: [self.mode_label.config(text=f"模式: {mode}"), self.tray.update(mode=mode)])
+
+    def force_mode(self, mode):
+        """托盘菜单：手动指定模式（None 为按规则自动）"""
+        self.override.set(mode)
+        self.root.after(0, lambda: self.tray.update(forced=mode))
+        if not (self.thread and self.thread.is_alive()):
+            log(f"已手动指定 {mode}，启动监控后生效" if mode else "已恢复按规则自动切换")
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            messagebox.showinfo("提示", "监控已在运行")
+            return
+
+        if not parse_api_urls(self.config.get("api_url", "")):
+            messagebox.showerror("错误", "请先在设置中填写 API 地址")
+            return
+
+        self.stop_event.clear()
+        self.thread, self.watcher, self.scheduler = create_monitor(
+            self.config, self.stop_event, self.log_view, self.update_status, self.update_mode, self.control)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        # 唤醒正在等待网络事件的监控线程
+        if self.watcher:
+            self.watcher.stop()
+
+    def open_settings(self):
+        """打开设置窗口"""
+        # 配置文件可能已在外部修改并被热加载，以文件为准
+        self.config = load_config()
+        settings_win = tk.Toplevel(self.root)
+        settings_win.title("设置")
+        settings_win.geometry("550x500")
+        settings_win.minsize(450, 400)
+        settings_win.transient(self.root)
+        settings_win.grab_set()
+
+        # 主容器
+        main = tk.Frame(settings_win, bg="#f5f7fa")
+        main.pack(fill="both", expand=True, padx=0, pady=0)
+        main.grid_rowconfigure(1, weight=1)
+        main.grid_columnconfigure(0, weight=1)
+
+        # 头部
+        header = tk.Frame(main, bg="#2c3e50", height=60)
+        header.pack(fill="x")
+        header.pack_propagate(False)
+        tk.Label(header, text="⚙ 设置", font=("Microsoft YaHei UI", 16, "bold"), bg="#2c3e50", fg="white").pack(pady=15)
+
+        # 内容区 - 使用滚动框架
+        scroll_frame = ScrollableFrame(main, bg="#f5f7fa")
+        scroll_frame.pack(fill="both", expand=True, pady=20, padx=20)
+        content = scroll_frame.get_frame()
+        content.configure(bg="#f5f7fa")
+
+        # 规则部分
+        rules_frame = tk.LabelFrame(content, text="多策略规则", font=("Microsoft YaHei UI", 12, "bold"), bg="#ffffff", fg="#2c3e50", padx=15, pady=15)
+        rules_frame.pack(fill="x", pady=(0, 15), padx=0)
+
+        self.rules_text_settings = tk.Text(rules_frame, height=4, font=("Consolas", 9), relief="flat", bd=1, bg="#f8f9fa", padx=10, pady=8)
+        self.rules_text_settings.pack(fill="both", expand=True, pady=(0, 10))
+        self._update_rules_text_settings()
+
+        rules_btn = tk.Frame(rules_frame, bg="#ffffff")
+        rules_btn.pack(fill="x")
+        tk.Button(rules_btn, text="添加规则", command=self.add_rule_settings, bg="#3498db", fg="white", relief="flat", padx=12, pady=6, font=("Microsoft YaHei UI", 10)).pack(side="right", padx=(5, 0))
+        tk.Button(rules_btn, text="保存规则", command=lambda: self.save_rules_settings(settings_win), bg="#27ae60", fg="white", relief="flat", padx=12, pady=6, font=("Microsoft YaHei UI", 10)).pack(side="right", padx=5)
+
+        # API 部分
+        api_frame = tk.LabelFrame(content, text="Clash API 配置", font=("Microsoft YaHei UI", 12, "bold"), bg="#ffffff", fg="#2c3e50", padx=15, pady=15)
+        api_frame.pack(fill="x", padx=0, pady=(0, 15))
+        
+        tk.Label(api_frame, text="API 地址 (多个用逗号分隔):", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(anchor="w", pady=(0, 5))
+        self.e_api_settings = tk.Entry(api_frame, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#f8f9fa", highlightthickness=0)
+        self.e_api_settings.pack(fill="x", padx=10, pady=8)
+        self.e_api_settings.insert(0, ", ".join(parse_api_urls(self.config["api_url"])))
+
+        # 间隔部分
+        interval_frame = tk.Frame(content, bg="#ffffff")
+        interval_frame.pack(fill="x", padx=15, pady=15)
+        tk.Label(interval_frame, text="检查间隔 (秒):", font=("Microsoft YaHei UI", 11), bg="#ffffff", fg="#34495e").pack(anchor="w", pady=(0, 5))
+        self.e_int_settings = tk.Entry(interval_frame, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#f8f9fa", highlightthickness=0, width=10)
+        self.e_int_settings.pack(anchor="w", padx=10, pady=8)
+        self.e_int_settings.insert(0, str(self.config["interval"]))
+
+        # 开机启动
+        v = tk.BooleanVar(value=self.config.get("autostart", False))
+        chk = tk.Checkbutton(content, text="开机启动", variable=v,
+                             command=lambda: [self.config.update(autostart=v.get()), set_autostart(v.get()), save_config(self.config)],
+                             bg="#f5f7fa", fg="#2c3e50", activebackground="#f5f7fa", selectcolor="#ffffff", font=("Microsoft YaHei UI", 11))
+        chk.pack(anchor="w", padx=15, pady=15)
+
+        # 底部保存按钮 - 固定在底部
+        btn_frame = tk.Frame(main, bg="#f5f7fa")
+        btn_frame.pack(fill="x", padx=20, pady=(0, 20))
+        tk.Button(btn_frame, text="保存所有设置", command=lambda: self.save_all_settings_settings(settings_win), bg="#27ae60", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x")
+
+    def _update_rules_text_settings(self):
+        self.rules_text_settings.delete("1.0", tk.END)
+        for r in self.config["rules"]:
+            group = f" [{r['group']}]" if r.get("group") else ""
+            self.rules_text_settings.insert(tk.END, f"{r['ssids']} → {r['mode']}{group}\n")
+
+    def add_rule_settings(self):
+        """添加规则（设置窗口版本）"""
+        win = tk.Toplevel(self.root)
+        win.title("添加规则")
+        win.geometry("400x360")
+        win.minsize(350, 330)
+        win.transient(self.root)
+        win.grab_set()
+
+        main = tk.Frame(win, bg="#f5f7fa")
+        main.pack(fill="both", expand=True)
+
+        # 头部
+        header = tk.Frame(main, bg="#2c3e50")
+        header.pack(fill="x", padx=0, pady=0)
+        tk.Label(header, text="➕ 添加规则", font=("Microsoft YaHei UI", 12, "bold"), bg="#2c3e50", fg="white").pack(pady=10)
+
+        # 内容
+        content = tk.Frame(main, bg="#f5f7fa")
+        content.pack(fill="both", expand=True, padx=20, pady=20)
+
+        tk.Label(content, text="WiFi名称 (逗号分隔):", font=("Microsoft YaHei UI", 11), bg="#f5f7fa", fg="#34495e").pack(anchor="w", pady=(0, 5))
+        e1 = tk.Entry(content, width=40, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#ffffff")
+        e1.pack(fill="x", pady=(0, 15))
+        
+        tk.Label(content, text="代理模式:", font=("Microsoft YaHei UI", 11), bg="#f5f7fa", fg="#34495e").pack(anchor="w", pady=(0, 8))
+        mode = tk.StringVar(value="Rule")
+        frame_mode = tk.Frame(content, bg="#f5f7fa")
+        frame_mode.pack(fill="x", pady=(0, 15))
+        tk.Radiobutton(frame_mode, text="直连 (Direct)", variable=mode, value="Direct", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
+        tk.Radiobutton(frame_mode, text="规则 (Rule)", variable=mode, value="Rule", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
+        tk.Radiobutton(frame_mode, text="全局 (Global)", variable=mode, value="Global", font=("Microsoft YaHei UI", 10), bg="#f5f7fa").pack(anchor="w")
+
+        tk.Label(content, text="代理组 (可选，自动选最快节点):", font=("Microsoft YaHei UI", 11), bg="#f5f7fa", fg="#34495e").pack(anchor="w", pady=(0, 5))
+        e2 = tk.Entry(content, width=40, font=("Microsoft YaHei UI", 10), relief="flat", bd=1, bg="#ffffff")
+        e2.pack(fill="x", pady=(0, 15))
+
+        # 按钮
+        btn_frame = tk.Frame(main, bg="#f5f7fa")
+        btn_frame.pack(fill="x", padx=20, pady=20)
+
+        def ok():
+            ssids = e1.get().strip()
+            if ssids:
+                rule = {"ssids": ssids, "mode": mode.get()}
+                if e2.get().strip():
+                    rule["group"] = e2.get().strip()
+                self.config["rules"].insert(-1, rule)
+                self._update_rules_text_settings()
+                win.destroy()
+            else:
+                messagebox.showwarning("提示", "请输入WiFi名称")
+        
+        tk.Button(btn_frame, text="确定", command=ok, bg="#27ae60", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x", side="left", padx=(0, 5))
+        tk.Button(btn_frame, text="取消", command=win.destroy, bg="#95a5a6", fg="white", relief="flat", padx=20, pady=10, font=("Microsoft YaHei UI", 11, "bold")).pack(fill="x", side="left", padx=5)
+
+    def save_rules_settings(self, parent):
+        """保存规则（设置窗口版本）"""
+        try:
+            text = self.rules_text_settings.get("1.0", tk.END).strip()
+            rules = []
+            for line in text.splitlines():
+                if "→" in line:
+                    ssids, mode = line.split("→", 1)
+                    mode, _, group = mode.partition("[")
+                    rule = {"ssids": ssids.strip(), "mode": mode.strip()}
+                    if group.strip(" ]"):
+                        rule["group"] = group.strip(" ]")
+                    rules.append(rule)
+            if not any("*" in r["ssids"] for r in rules):
+                rules.append({"ssids": "*", "mode": "Rule"})
+            self.config["rules"] = rules
+            messagebox.showinfo("成功", "规则已保存")
+        except:
+            messagebox.showerror("错误", "规则格式错误")
+
+    def save_all_settings_settings(self, parent):
+        """保存所有设置"""
+        try:
+            urls = parse_api_urls(self.e_api_settings.get())
+            api = urls if len(urls) > 1 else "".join(urls)
+            try:
+                interval = max(3, int(self.e_int_settings.get()))
+            except:
+                interval = 15
+
+            if not api:
+                messagebox.showerror("错误", "请填写 API 地址")
+                return
+
+            self.config.update({"api_url": api, "interval": interval})
+            self.save_rules_settings(parent)
+            save_config(self.config)
+            if self.thread and self.thread.is_alive() and self.config.get("hot_reload", True):
+                messagebox.showinfo("成功", "所有设置已保存，规则和检查间隔已即时生效")
+            else:
+                messagebox.showinfo("成功", "所有设置已保存")
+            parent.destroy()
+        except Exception as e:
+            messagebox.showerror("错误", f"保存失败: {e}")
+
+    def open_log_window(self):
+        """打开日志窗口"""
+        if self.log_window and self.log_window.winfo_exists():
+            self.log_window.lift()
+            return
+
+        self.log_window = tk.Toplevel(self.root)
+        self.log_window.title("日志")
+        self.log_window.geometry("750x600")
+        self.log_window.minsize(500, 300)
+        self.log_window.protocol("WM_DELETE_WINDOW", self.close_log_window)
+
+        # 主容器
+        main = tk.Frame(self.log_window, bg="#f5f7fa")
+        main.pack(fill="both", expand=True, padx=0, pady=0)
+        main.grid_rowconfigure(2, weight=1)
+        main.grid_columnconfigure(0, weight=1)
+
+        # 头部
+        header = tk.Frame(main, bg="#2c3e50", height=50)
+        header.grid(row=0, column=0, sticky="ew", padx=0, pady=0)
+        header.pack_propagate(False)
+        tk.Label(header, text="📋 日志", font=("Microsoft YaHei UI", 14, "bold"), bg="#2c3e50", fg="white").pack(pady=12)
+
+        # 检索条件：在事件日志中按时间、类型、SSID、模式和文本查找
+        search = tk.Frame(main, bg="#f5f7fa")
+        search.grid(row=1, column=0, sticky="ew", padx=10, pady=(10, 0))
+        font = ("Microsoft YaHei UI", 9)
+        text_var, ssid_var, mode_var = tk.StringVar(), tk.StringVar(), tk.StringVar()
+        kind_var, range_var = tk.StringVar(value="全部"), tk.StringVar(value="全部时间")
+        status_var = tk.StringVar(value="实时")
+        for label, var, width in (("文本", text_var, 14), ("SSID", ssid_var, 12), ("模式", mode_var, 8)):
+            tk.Label(search, text=label, bg="#f5f7fa", font=font).pack(side="left")
+            tk.Entry(search, textvariable=var, width=width, font=font).pack(side="left", padx=(2, 8))
+        kinds = {"全部": {}, "错误": {"level": "error"}, "切换": {"kind": "switch"},
+                 "WiFi": {"kind": "ssid"}, "防抖": {"kind": "hold"}}
+        ranges = {"全部时间": None, "1 小时": 3600, "24 小时": 86400, "7 天": 7 * 86400}
+        tk.OptionMenu(search, kind_var, *kinds).pack(side="left")
+        tk.OptionMenu(search, range_var, *ranges).pack(side="left", padx=(4, 0))
+
+        # 日志框 - 自适应填充可用空间
+        log_frame = tk.Frame(main, bg="#ffffff")
+        log_frame.grid(row=2, column=0, sticky="nsew", padx=10, pady=10)
+        log_frame.grid_rowconfigure(0, weight=1)
+        log_frame.grid_columnconfigure(0, weight=1)
+
+        log_box = scrolledtext.ScrolledText(log_frame, font=("Consolas", 10), relief="flat", bd=0, bg="#2c3e50", fg="#ecf0f1", insertbackground="#ecf0f1", padx=10, pady=8)
+        log_box.grid(row=0, column=0, sticky="nsew")
+
+        pager = JournalPager(self.root, log_box, status_var)
+
+        def run_search(event=None):
+            query = dict(kinds[kind_var.get()])
+            for key, var in (("ssid", ssid_var), ("mode", mode_var)):
+                if var.get().strip():
+                    query[key] = var.get().strip()
+            if ranges[range_var.get()]:
+                query["start"] = time.time() - ranges[range_var.get()]
+            self.log_view.detach()
+            pager.start(text=text_var.get().strip() or None, **query)
+
+        def back_to_live():
+            pager.stop()
+            status_var.set("实时")
+            log_box.delete("1.0", tk.END)
+            self.log_view.attach(log_box)
+
+        for child in search.winfo_children():
+            if isinstance(child, tk.Entry):
+                child.bind("<Return>", run_search)
+
+        # 底部按钮
+        btn_frame = tk.Frame(main, bg="#f5f7fa")
+        btn_frame.grid(row=3, column=0, sticky="ew", padx=10, pady=10)
+        btn_frame.grid_columnconfigure(0, weight=1)
+        tk.Label(btn_frame, textvariable=status_var, bg="#f5f7fa", fg="#7f8c8d", font=font).pack(anchor="w")
+
+        btn_inner = tk.Frame(btn_frame, bg="#f5f7fa")
+        btn_inner.pack()
+
+        tk.Button(btn_inner, text="检索", command=run_search, bg="#3498db", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
+        tk.Button(btn_inner, text="更早", command=pager.more, bg="#3498db", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
+        tk.Button(btn_inner, text="实时", command=back_to_live, bg="#27ae60", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
+        tk.Button(btn_inner, text="清空日志", command=self.clear_log, bg="#e74c3c", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
+        tk.Button(btn_inner, text="关闭", command=self.close_log_window, bg="#95a5a6", fg="white", relief="flat", padx=15, pady=8, font=("Microsoft YaHei UI", 10)).pack(side="left", padx=5)
+
+        # 先填入日志文件尾部，之后由 LogView 定时批量追加
+        self.log_view.attach(log_box)
+        log(f"配置加载: {CONFIG_FILE}", self.log_view)
+
+    def close_log_window(self):
+        """关闭日志窗口"""
+        self.log_view.detach()
+        if self.log_window:
+            self.log_window.destroy()
+            self.log_window = None
+
+    def clear_log(self):
+        """清空日志"""
+        self.log_view.clear()
+
+    def setup_tray(self):
+        # 托盘图标：优先使用 ico，然后 png，最后回退为简易生成图
+        if os.path.exists(ICON_ICO):
+            try:
+                image = Image.open(ICON_ICO)
+            except:
+                image = None
+        elif os.path.exists(ICON_PNG):
+            try:
+                image = Image.open(ICON_PNG)
+            except:
+                image = None
+        else:
+            image = None
+
+        if image is None:
+            image = Image.new("RGB", (64, 64), "#34495e")
+            d = ImageDraw.Draw(image)
+            try:
+                font = ImageFont.truetype("seguiemj.ttf", 40)
+            except:
+                font = ImageFont.load_default()
+            d.text((10, 10), "Shield", fill="white", font=font)
+
+        def force_item(text, mode):
+            return pystray.MenuItem(text, lambda icon, item: self.force_mode(mode),
+                                    checked=lambda item: self.override.mode == mode, radio=True)
+
+        menu = pystray.Menu(
+            pystray.MenuItem("显示", self.show_window, default=True),
+            pystray.Menu.SEPARATOR,
+            force_item("按规则自动", None),
+            force_item("强制直连", "Direct"),
+            force_item("强制规则", "Rule"),
+            force_item("强制全局", "Global"),
+            pystray.Menu.SEPARATOR,
+            pystray.MenuItem("退出", self.quit_app)
+        )
+        self.tray = TrayIcon(self.root, image, menu)
+        self.icon = self.tray.icon
+        self.tray.run()
+
+    def show_window(self, icon=None, item=None):
+        self.root.after(0, lambda: [self.root.deiconify(), self.root.lift()])
+
+    def quit_app(self, icon=None, item=None):
+        # 触发停止，停止托盘并释放互斥，最后退出主循环
+        try:
+            self.stop()
+            # 等待后台线程短暂结束
+            try:
+                if self.thread and self.thread.is_alive():
+                    self.thread.join(timeout=2)
+            except:
+                pass
+            if getattr(self, 'icon', None):
+                try:
+                    self.icon.stop()
+                except:
+                    pass
+            if self.control_server:
+                self.control_server.stop()
+            try:
+                release_mutex()
+            except:
+                pass
+            close_log_writer()
+            try:
+                self.root.quit()
+                self.root.destroy()
+            except:
+                pass
+            try:
+                sys.exit(0)
+            except:
+                pass
+        except Exception:
+            pass
+
+    def on_close(self):
+        # 点击窗口 X 时直接退出程序（关闭后台、托盘、释放锁）
+        self.quit_app()
+
+    def load_autostart(self):
+        try:
+            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run")
+            winreg.QueryValueEx(key, "AutoVPN")
+            self.config["autostart"] = True
+        except:
+            self.config["autostart"] = False
+
+# ==================== UI 组件 ====================
+class ModernEntry(tk.Frame):
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, bg="#f5f7fa", **kwargs)
+        self.entry = tk.Entry(self, font=("Microsoft YaHei UI", 11), relief="flat", bd=0, bg="#ffffff", highlightthickness=1, highlightbackground="#dfe4ea", insertbackground="#2c3e50")
+        self.entry.pack(fill="both", expand=True, padx=10, pady=8)
+
+    def get(self):
+        return self.entry.get()
+
+    def insert(self, index, string):
+        self.entry.insert(index, string)
+    
+    def config(self, **kwargs):
+        self.entry.config(**kwargs)
+
+
+class ScrollableFrame(tk.Frame):
+    """可滚动的框架，用于处理内容溢出"""
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        
+        # 创建画布和滚动条
+        self.canvas = tk.Canvas(self, bg=parent.cget("bg"), highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.scrollable_frame = tk.Frame(self.canvas, bg=self.canvas.cget("bg"))
+        
+        self.scrollable_frame.bind(
+            "<Configure>",
+            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        )
+        
+        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        
+        # 支持鼠标滚轮
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+
+    def _on_mousewheel(self, event):
+        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+
+    def get_frame(self):
+        return self.scrollable_frame
+
+
+# ==================== 主程序 ====================
+def run_gui():
+    # 先获取单实例锁，防止重复打开
+    if not acquire_mutex("AutoVPN_SingleInstance_Mutex"):
+        # 已有实例在运行：通过控制通道让它显示窗口，本进程直接退出
+        try:
+            if send_control("show", timeout=2.0):
+                return 0
+        except (OSError, ValueError):
+            pass
+        try:
+            # 旧版本实例没有控制通道时，退回 Windows 原生消息框
+            ctypes.windll.user32.MessageBoxW(None, "程序已在运行中", "提示", 0)
+        except:
+            print("程序已在运行中")
+        return 0
+
+    root = tk.Tk()
+    app = App(root)
+    # 点击 X 时退出（而不是隐藏）以确保后台线程与托盘被清理
+    root.protocol("WM_DELETE_WINDOW", app.quit_app)
+    try:
+        root.mainloop()
+    finally:
+        # 确保退出时释放互斥（保险起见）
+        try:
+            release_mutex()
+        except:
+            pass
+    return 0
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "soft", "clash"))
+
+import autovpn  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_log(tmp_path, monkeypatch):
+    """日志写到临时目录，不碰源码旁的 autovpn.log；测试之间不共享 SSID 来源和事件日志"""
+    writer = autovpn.LogWriter(str(tmp_path / "autovpn.log"))
+    monkeypatch.setattr(autovpn, "_log_writer", writer)
+    monkeypatch.setattr(autovpn, "_journal", None)
+    monkeypatch.setattr(autovpn, "_ssid_provider", None)
+    yield writer
+    writer.close()
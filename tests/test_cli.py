@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import autovpn
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE, fixture_provider
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]
+
+
+@pytest.fixture
+def fake():
+    server = FakeClashServer(mode="global")
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch, fake):
+    """临时目录里的配置文件；main 改写的路径和全局组件在测试结束后还原"""
+    for name in ("CONFIG_FILE", "STATE_FILE", "RULES_CACHE", "JOURNAL_DIR", "_probe_runner"):
+        monkeypatch.setattr(autovpn, name, getattr(autovpn, name))
+    monkeypatch.setattr(autovpn, "create_ssid_provider",
+                        lambda *args: fixture_provider("netsh", [NETSH_FIXTURE.format(ssid="Office-5G")]))
+    path = tmp_path / "conf" / "autovpn_config.json"
+    path.parent.mkdir()
+    path.write_text(json.dumps({"rules": RULES, "api_url": fake.url, "fingerprint": False}), encoding="utf-8")
+    return path
+
+
+def test_once_switches_and_paths_follow_config(config, fake):
+    assert autovpn.main(["--config", str(config), "once"]) == 0
+    assert fake.mode == "direct"
+    directory = str(config.parent)
+    assert autovpn.STATE_FILE == os.path.join(directory, "autovpn_state.json")
+    assert autovpn.JOURNAL_DIR == os.path.join(directory, "journal")
+    assert autovpn.main(["--config", str(config), "once"]) == 0
+    assert [m for m, _ in fake.requests].count("PATCH") == 1  # 第二次模式已对，不再写入
+
+
+def test_status_json(config, fake, capsys):
+    assert autovpn.main(["--config", str(config), "status", "--json"]) == 0
+    reply = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert (reply["ssid"], reply["target"], reply["modes"]) == ("Office-5G", "Direct", {fake.url: "global"})
+    assert fake.mode == "global"  # status 只读
+
+
+def test_once_fails_when_controller_is_down(config, fake):
+    fake.close()
+    assert autovpn.main(["--config", str(config), "once"]) == 1
+
+
+def test_import_does_not_load_heavy_modules():
+    code = ("import sys, autovpn; "
+            "print(sorted(m for m in ('argparse', 'concurrent.futures', 'hashlib', 'hmac', 'http.server', "
+            "'tkinter', 'pystray', 'autovpn_gui', 'autovpn_bench') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(autovpn.__file__),
+                         capture_output=True, text=True, timeout=30).stdout
+    assert out.strip() == "[]"
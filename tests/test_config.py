@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+import pytest
+
+from autovpn import ConfigWatcher, save_config
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]
+
+
+def write(path, text):
+    # 每次写入都换一个新文件，保证 mtime/大小/inode 至少有一项变化
+    tmp = str(path) + ".new"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "config.json"
+    write(path, json.dumps({"rules": RULES, "interval": 15}))
+    return path
+
+
+def test_valid_change_replaces_snapshot(config_file):
+    watcher = ConfigWatcher(str(config_file), use_inotify=False)
+    assert watcher.snapshot.config["interval"] == 15
+    write(config_file, json.dumps({"rules": RULES, "interval": 30}))
+    assert watcher.check()
+    assert watcher.snapshot.config["interval"] == 30
+    assert watcher.snapshot.version == 1 and watcher.reloads == 1
+    assert not watcher.check()  # 文件没再变化
+
+
+@pytest.mark.parametrize("text", [
+    "{not json",
+    json.dumps({"rules": []}),
+    json.dumps({"rules": [{"ssids": "re:(", "mode": "Direct"}]}),
+    json.dumps({"rules": RULES, "interval": -1}),
+])
+def test_bad_file_keeps_previous_snapshot(config_file, text):
+    notified = []
+    watcher = ConfigWatcher(str(config_file), notify=lambda: notified.append(1), use_inotify=False)
+    previous = watcher.snapshot
+    write(config_file, text)
+    assert not watcher.check()
+    assert watcher.snapshot is previous
+    assert watcher.errors == 1 and notified == []
+    assert not watcher.check()  # 同一个坏版本只报一次
+    assert watcher.errors == 1
+    write(config_file, json.dumps({"rules": RULES, "interval": 20}))
+    assert watcher.check()
+    assert watcher.snapshot.config["interval"] == 20 and notified == [1]
+
+
+def test_inotify_backend_picks_up_saves(config_file):
+    changed = threading.Event()
+    watcher = ConfigWatcher(str(config_file), interval=0.1, notify=changed.set).start()
+    try:
+        save_config({"rules": RULES, "interval": 45}, str(config_file))
+        assert changed.wait(5)
+        assert watcher.snapshot.config["interval"] == 45
+    finally:
+        watcher.stop()
+
+
+def test_atomic_save_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "config.json"
+    assert save_config({"rules": RULES}, str(path))
+    assert json.loads(path.read_text(encoding="utf-8")) == {"rules": RULES}
+    assert os.listdir(tmp_path) == ["config.json"]
@@ -0,0 +1,126 @@
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+import autovpn
+from autovpn import (ControlServer, ManualWatcher, MonitorContext, MonitorControl, PollScheduler, create_controller,
+                     monitor_loop, send_control)
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE, fixture_provider
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="命名管道另行验证，这里只测 Unix 套接字")
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]
+
+
+@pytest.fixture
+def running(tmp_path):
+    """跑着监控线程和控制通道的实例，返回 (控制通道地址, 假 Clash 控制器)"""
+    autovpn.set_ssid_provider(fixture_provider("netsh", [NETSH_FIXTURE.format(ssid="Office-5G")]))
+    fake = FakeClashServer()
+    control = MonitorControl()
+    watcher = ManualWatcher().start()
+    control.override.notify = lambda: watcher.notify(settle=False)
+    control.attach(watcher)
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=(RULES, create_controller(fake.url), 3600, None, stop,
+                                    autovpn._noop, autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                            override=control.override, status=control.status)})
+    address = str(tmp_path / "control.sock")
+    server = ControlServer(control.handle, address).start()
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not control.status["ticks"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield address, fake
+    stop.set()
+    watcher.stop()
+    thread.join(5)
+    server.stop()
+    fake.close()
+
+
+def test_status_round_trip(running):
+    address, fake = running
+    reply = send_control("status", address)
+    assert reply["ok"] and reply["state"] == "运行中"
+    assert (reply["ssid"], reply["target"], reply["mode"]) == ("Office-5G", "Direct", "Direct")
+    assert reply["pid"] == os.getpid() and reply["forced"] is None
+    assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+
+
+def test_force_and_auto_wait_for_the_switch(running):
+    address, fake = running
+    reply = send_control("force Global", address)
+    assert reply["ok"] and reply["forced"] == "Global" and reply["mode"] == "Global"
+    assert fake.mode == "global"
+    reply = send_control("force auto", address)
+    assert reply["forced"] is None and reply["mode"] == "Direct"
+    assert fake.mode == "direct"
+
+
+def test_reevaluate_runs_another_tick(running):
+    address, _ = running
+    ticks = send_control("status", address)["ticks"]
+    assert send_control("reevaluate", address)["ticks"] > ticks
+
+
+@pytest.mark.parametrize("command, error", [
+    ("bogus", "未知命令"),
+    ("force Sideways", "用法"),
+    ("reload", "hot_reload"),
+])
+def test_bad_commands_are_rejected(running, command, error):
+    address, _ = running
+    reply = send_control(command, address)
+    assert not reply["ok"] and error in reply["error"]
+
+
+def test_no_instance_returns_none(tmp_path):
+    assert send_control("status", str(tmp_path / "missing.sock")) is None
+
+
+@pytest.fixture
+def lock_dir(tmp_path, monkeypatch):
+    """把单实例锁放到临时的运行目录下，返回该目录"""
+    runtime = tmp_path / "runtime"
+    monkeypatch.setattr(autovpn, "CONTROL_ADDRESS", str(runtime / "autovpn.sock"))
+    yield runtime
+    autovpn.release_mutex()
+
+
+def test_lock_creates_private_runtime_dir(lock_dir):
+    assert autovpn.acquire_mutex()
+    assert stat.S_IMODE(os.stat(lock_dir).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(lock_dir / "autovpn.sock.lock").st_mode) == 0o600
+
+
+def test_lock_held_by_another_open_refuses(lock_dir):
+    assert autovpn.acquire_mutex()
+    handle = autovpn._mutex_handle
+    autovpn._mutex_handle = None  # 模拟另一个进程：同一文件再打开一次，flock 互斥
+    try:
+        assert not autovpn.acquire_mutex()
+    finally:
+        autovpn._mutex_handle = handle
+
+
+def test_lock_does_not_follow_symlinks(lock_dir, tmp_path):
+    lock_dir.mkdir(mode=0o700)
+    victim = tmp_path / "victim"
+    victim.write_text("keep", encoding="utf-8")
+    os.symlink(victim, lock_dir / "autovpn.sock.lock")
+    assert not autovpn.acquire_mutex()
+    assert victim.read_text(encoding="utf-8") == "keep"
+
+
+def test_shared_runtime_dir_is_refused(lock_dir):
+    lock_dir.mkdir()
+    os.chmod(lock_dir, 0o777)
+    assert not autovpn.acquire_mutex()
+    assert not os.path.exists(lock_dir / "autovpn.sock.lock")
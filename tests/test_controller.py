@@ -0,0 +1,111 @@
+import socket
+import time
+
+import pytest
+
+from autovpn import ClashController, ControllerGroup
+from autovpn_bench import FakeClashServer
+
+
+@pytest.fixture
+def fake():
+    server = FakeClashServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def hanging():
+    """只接受连接、从不应答的控制器地址"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}/configs"
+    sock.close()
+
+
+def test_group_waits_for_all_three_requests_of_a_slow_target():
+    slow = FakeClashServer(delay=0.15)
+    group = ControllerGroup([ClashController(slow.url, connect_timeout=0.05, timeout=0.2)], retries=0)
+    try:
+        # GET + PATCH + 回读 GET 共约 0.45 秒，超过单个请求的超时之和，但仍是正常目标
+        ok, msg = group.set_mode("Direct")
+        assert ok, msg
+        assert slow.mode == "direct"
+        assert group.reachable
+    finally:
+        group.close()
+        slow.close()
+
+
+def test_group_keeps_one_task_per_unreachable_target(fake, hanging):
+    down = ClashController(hanging, connect_timeout=0.2, timeout=1.0)
+    group = ControllerGroup([ClashController(fake.url), down], retries=0)
+    submitted = []
+    submit = group._pool.submit
+    group._pool.submit = lambda fn, c: submitted.append(c) or submit(fn, c)
+    # 上一轮就连不上的目标不等待，本轮起在后台重试
+    group.status[down.api_url]["ok"] = False
+    down.reachable = False
+    try:
+        for mode in ("Direct", "Global", "Direct", "Global", "Direct"):
+            ok, msg = group.set_mode(mode)
+            assert not ok and "后台重试中" in msg
+        assert fake.mode == "direct"
+        assert submitted.count(down) == 1
+        assert not group.reachable
+    finally:
+        group.close()
+
+
+def test_timeout_does_not_touch_controller_state(hanging):
+    c = ClashController(hanging, connect_timeout=0.2, timeout=0.6)
+    group = ControllerGroup([c], retries=0)
+    group.REQUESTS_PER_SWITCH = 0.5  # 让等待上限短于一次请求，模拟超时
+    try:
+        t0 = time.monotonic()
+        ok, msg = group.set_mode("Direct")
+        assert not ok and "超时" in msg
+        assert time.monotonic() - t0 < 0.6
+        assert c.reachable  # 请求还在进行，controller 自己的状态不被外部改写
+        assert not group.reachable
+        time.sleep(0.8)
+        assert not c.reachable  # 请求超时后由请求线程自己记下
+    finally:
+        group.close()
+
+
+def test_same_mode_skips_patch(fake):
+    c = ClashController(fake.url)
+    ok, msg = c.set_mode("Rule")
+    assert ok and "跳过写入" in msg
+    assert fake.requests == [("GET", "/configs")]
+    c.close()
+
+
+def test_switch_is_read_back_over_one_connection(fake):
+    c = ClashController(fake.url)
+    ok, msg = c.set_mode("Direct")
+    assert ok, msg
+    conn = c._conn
+    assert fake.requests == [("GET", "/configs"), ("PATCH", "/configs"), ("GET", "/configs")]
+    assert c.set_mode("Direct")[0]
+    assert c._conn is conn  # 长连接复用，不是每次请求重新连接
+    c.close()
+
+
+def test_read_back_mismatch_fails(fake):
+    fake.routes[("PATCH", "/configs")] = lambda server, path, body: (204, None)  # 应答成功但不生效
+    c = ClashController(fake.url)
+    ok, msg = c.set_mode("Direct")
+    assert not ok and "回读不一致" in msg
+    c.close()
+
+
+def test_reconnects_after_server_drops_keepalive(fake):
+    c = ClashController(fake.url)
+    assert c.get_mode() == "rule"
+    c._conn.sock.shutdown(socket.SHUT_RDWR)  # 模拟对端关闭了空闲连接
+    assert c.get_mode() == "rule"
+    assert c.reachable
+    c.close()
@@ -0,0 +1,89 @@
+import pytest
+
+from autovpn import ClashController, cutover, is_proxied_connection
+from autovpn_bench import FakeClashServer
+
+
+@pytest.fixture
+def fake():
+    server = FakeClashServer()
+    yield server
+    server.close()
+
+
+def deletes(server):
+    return [path for method, path in server.requests if method == "DELETE"]
+
+
+def test_only_proxied_connections_are_closed(fake):
+    proxied = fake.add_connections(5)
+    direct = fake.add_connections(3, chains=("DIRECT",))
+    rejected = fake.add_connections(1, chains=("REJECT",))
+    c = ClashController(fake.url)
+    st = cutover(c)
+    assert (st["total"], st["matched"], st["closed"], st["remaining"]) == (9, 5, 5, 0)
+    assert sorted(fake.connections) == sorted(direct + rejected)
+    assert sorted(deletes(fake)) == sorted(f"/connections/{cid}" for cid in proxied)
+    assert st["flush"] == {"cache/fakeip/flush": True, "cache/dns/flush": True}
+    c.close()
+
+
+def test_all_proxied_uses_a_single_delete(fake):
+    fake.add_connections(50)
+    c = ClashController(fake.url)
+    st = cutover(c, flush=False)
+    assert (st["matched"], st["closed"], st["remaining"]) == (50, 50, 0)
+    assert deletes(fake) == ["/connections"]
+    assert "flush" not in st
+    c.close()
+
+
+def test_filters_match_rule_or_chain(fake):
+    fake.add_connections(2, rule="GeoIP")
+    fake.add_connections(2, chains=("公司出口",))
+    kept = fake.add_connections(2)
+    c = ClashController(fake.url)
+    st = cutover(c, filters=["GeoIP", "公司出口"], flush=False)
+    assert (st["matched"], st["closed"]) == (4, 4)
+    assert sorted(fake.connections) == sorted(kept)
+    c.close()
+
+
+def test_nothing_to_close_sends_no_delete(fake):
+    fake.add_connections(3, chains=("DIRECT",))
+    c = ClashController(fake.url)
+    st = cutover(c, flush=False)
+    assert (st["matched"], st["closed"]) == (0, 0)
+    assert deletes(fake) == []
+    c.close()
+
+
+def test_is_proxied_connection():
+    assert is_proxied_connection({"chains": ["节点选择", "香港01"]})
+    assert not is_proxied_connection({"chains": ["DIRECT"]})
+    assert not is_proxied_connection({"chains": []})
+    assert is_proxied_connection({"chains": ["DIRECT"], "rule": "GeoSite"}, ["GeoSite"])
+
+
+def test_pipeline_reuses_the_keep_alive_connection(fake):
+    proxied = fake.add_connections(30)
+    c = ClashController(fake.url)
+    c.get_connections()
+    conn = c._conn
+    assert c.close_connections(proxied[:10], batch=4) == 10
+    assert c._conn is conn
+    assert c.get_mode() == "rule"  # 管线结束后连接还能照常使用
+    assert c._conn is conn
+    c.close()
+
+
+def test_server_closing_mid_pipeline_falls_back_to_single_requests(fake):
+    fake.max_requests = 7  # 每条连接只处理 7 个请求，管线里其余的请求被丢弃
+    proxied = fake.add_connections(20)
+    direct = fake.add_connections(2, chains=("DIRECT",))
+    c = ClashController(fake.url)
+    st = cutover(c, flush=False)
+    assert (st["matched"], st["closed"], st["remaining"]) == (20, 20, 0)
+    assert sorted(fake.connections) == sorted(direct)
+    assert sorted(deletes(fake)) == sorted(f"/connections/{cid}" for cid in proxied)  # 没有重复发送
+    c.close()
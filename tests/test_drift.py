@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+import autovpn
+from autovpn import DriftWatcher, Metrics
+from autovpn_bench import FakeClashServer
+
+
+@pytest.fixture
+def fake():
+    server = FakeClashServer(mode="direct")
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    m = Metrics()
+    monkeypatch.setattr(autovpn, "_metrics", m)
+    return m
+
+
+def test_unchanged_mode_is_a_304(fake):
+    drift = DriftWatcher(fake.url)
+    drift.expect("Direct")
+    assert drift.check() == 0
+    assert drift.check() == 0
+    assert fake.not_modified == 1
+    assert [m for m, _ in fake.requests] == ["GET", "GET"]
+    drift.stop()
+
+
+def test_out_of_band_change_is_reverted(fake, metrics):
+    drift = DriftWatcher(fake.url)
+    drift.expect("Direct")
+    assert drift.check() == 0
+    fake.change_mode("Global")  # 用户在 Clash 界面里改成了全局
+    assert drift.check() == 1
+    assert fake.mode == "direct" and drift.corrections == 1
+    target = f"127.0.0.1:{fake.httpd.server_address[1]}"
+    assert metrics.counters[("autovpn_drift_total", (("target", target),))] == 1
+    assert drift.check() == 0  # 已恢复，不再重复纠正
+    drift.stop()
+
+
+def test_background_thread_corrects_within_interval(fake):
+    drift = DriftWatcher(fake.url, interval=0.05)
+    drift.expect("Direct")
+    drift.start()
+    try:
+        time.sleep(0.1)
+        fake.change_mode("Global")
+        deadline = time.monotonic() + 2
+        while fake.mode != "direct" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert fake.mode == "direct"
+        assert drift.corrections == 1
+    finally:
+        drift.stop()
+
+
+def test_no_target_means_no_correction(fake):
+    drift = DriftWatcher(fake.url)
+    fake.change_mode("Global")
+    assert drift.check() == 0
+    assert fake.mode == "global" and fake.requests == []
+    drift.stop()
+
+
+def test_unreachable_controller_is_left_to_the_monitor(fake):
+    url = fake.url
+    fake.close()
+    drift = DriftWatcher(url, connect_timeout=0.2, timeout=0.2)
+    drift.expect("Direct")
+    assert drift.check() == 0
+    drift.stop()
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from autovpn import RulesFeed, merge_rules, parse_rules_document, sign_rules_document
+from autovpn_bench import FakeRulesServer
+
+OFFICE = {"ssids": "Office-5G", "mode": "Direct"}
+HOTEL = {"ssids": "Hotel-WiFi", "mode": "Global"}
+
+
+@pytest.fixture
+def server():
+    server = FakeRulesServer({"version": "1", "rules": [OFFICE]})
+    yield server
+    server.close()
+
+
+def test_unchanged_document_costs_one_304(server, tmp_path):
+    updates = []
+    feed = RulesFeed(server.url, str(tmp_path / "cache.json"), notify=lambda: updates.append(1))
+    assert feed.refresh() == "updated"
+    assert (feed.version, feed.rules, feed.revision) == ("1", [OFFICE], 1)
+    size = feed.stats["bytes"]
+    assert feed.refresh() == "not_modified"
+    assert feed.stats["bytes"] == size  # 304 没有响应体
+    assert feed.revision == 1 and updates == [1]
+    server.publish({"version": "2", "rules": [OFFICE, HOTEL]})
+    assert feed.refresh() == "updated"
+    assert (feed.version, feed.revision, updates) == ("2", 2, [1, 1])
+
+
+def test_same_body_without_conditional_support_is_not_reparsed(server):
+    server.conditional = False
+    feed = RulesFeed(server.url)
+    assert feed.refresh() == "updated"
+    size = feed.stats["bytes"]
+    assert feed.refresh() == "not_modified"
+    assert feed.stats["bytes"] == 2 * size  # 又下载了一遍全文，但没有重新解析
+    assert feed.revision == 1
+
+
+def test_bad_signature_keeps_previous_rules(server):
+    feed = RulesFeed(server.url, key="secret")
+    server.publish({"version": "1", "rules": [OFFICE]}, key="secret")
+    assert feed.refresh() == "updated"
+    server.publish({"version": "2", "rules": [HOTEL]}, key="wrong")
+    assert feed.refresh() == "error"
+    assert (feed.version, feed.rules) == ("1", [OFFICE])
+    # 坏版本的 ETag 没有记下，修正后的文档能正常拉到
+    server.publish({"version": "3", "rules": [HOTEL]}, key="secret")
+    assert feed.refresh() == "updated"
+    assert feed.version == "3"
+
+
+@pytest.mark.parametrize("doc, error", [
+    ({"version": "1", "rules": [OFFICE]}, "缺少 sha256"),
+    (dict(sign_rules_document({"version": "1", "rules": [OFFICE]}), version="2"), "校验和不匹配"),
+    (sign_rules_document({"version": "1", "rules": []}), "rules"),
+])
+def test_invalid_documents_are_rejected(doc, error):
+    with pytest.raises(ValueError, match=error):
+        parse_rules_document(json.dumps(doc))
+
+
+def test_offline_start_uses_cache(server, tmp_path):
+    cache = str(tmp_path / "cache.json")
+    assert RulesFeed(server.url, cache).refresh() == "updated"
+    url = server.url
+    server.close()
+    feed = RulesFeed(url, cache, timeout=1)
+    assert (feed.version, feed.rules) == ("1", [OFFICE])  # 不联网就已可用
+    assert feed.refresh() == "error"
+    assert feed.rules == [OFFICE]
+    assert RulesFeed("http://127.0.0.1:9/other.json", cache).rules == []  # 别的地址的缓存不用
+
+
+def test_file_source_skips_unchanged_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(sign_rules_document({"version": "1", "rules": [OFFICE]})), encoding="utf-8")
+    feed = RulesFeed(str(path))
+    assert feed.refresh() == "updated"
+    assert feed.refresh() == "not_modified"
+    assert feed.stats["bytes"] == path.stat().st_size  # 第二次没有读取文件
+
+
+def test_local_rules_take_precedence():
+    local = [OFFICE, {"ssids": "*", "mode": "Rule"}]
+    remote = [HOTEL, {"ssids": "Office-5G", "mode": "Global"}, {"ssids": "*", "mode": "Global"}]
+    assert merge_rules(local, remote) == [OFFICE, HOTEL, remote[1], local[1]]
+    assert merge_rules([OFFICE], remote)[-1] == remote[2]
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import autovpn
+from autovpn import (ClashController, GroupSelector, ManualWatcher, MonitorContext, NetworkFingerprint,
+                     PollScheduler, create_controller, monitor_loop, run_group_select)
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE, fixture_provider
+
+
+@pytest.fixture
+def server():
+    server = FakeClashServer()
+    yield server
+    server.close()
+
+
+def hotel(n=1):
+    return NetworkFingerprint(f"Hotel-{n}", None, f"02:00:00:00:00:{n:02x}", "wifi")
+
+
+def test_selection_finishes_within_deadline(server):
+    server.add_group("节点选择", {"慢": 1500, "断": None, "快": 50})
+    controller = ClashController(server.url)
+    selector = GroupSelector(timeout=2.0, deadline=0.3)
+    t0 = time.monotonic()
+    st = selector.select(controller, "节点选择", hotel())
+    assert time.monotonic() - t0 < 0.3 + 0.3
+    assert (st["node"], st["alive"], st["changed"]) == ("快", 1, True)
+    assert server.groups["节点选择"]["now"] == "快"
+    selector.close()
+    controller.close()
+
+
+def test_cache_and_locks_stay_bounded(server, monkeypatch):
+    monkeypatch.setattr(GroupSelector, "CACHE_SIZE", 4)
+    server.add_group("节点选择", {"快": 1})
+    controller = ClashController(server.url)
+    now = [0.0]
+    selector = GroupSelector(timeout=1.0, deadline=1.0, ttl=100, clock=lambda: now[0])
+    for n in range(10):
+        selector.select(controller, "节点选择", hotel(n))
+    assert len(selector.cache) == 4
+    assert selector._locks == {}
+    # 过期的结果在下次写入时清掉
+    now[0] = 200
+    selector.select(controller, "节点选择", hotel(99))
+    assert len(selector.cache) == 1
+    selector.close()
+    controller.close()
+
+
+def test_on_done_reports_failure(server):
+    server.add_group("节点选择", {"断": None})
+    controller = ClashController(server.url)
+    selector = GroupSelector(timeout=0.1, deadline=0.3)
+    results = []
+    run_group_select(controller, selector, "节点选择", hotel(), on_done=results.append)
+    server.delays["断"] = 5
+    run_group_select(controller, selector, "节点选择", hotel(), on_done=results.append)
+    assert results == [False, True]
+    selector.close()
+    controller.close()
+
+
+def test_monitor_retries_group_after_failed_selection(server, monkeypatch):
+    server.add_group("节点选择", {"断": None, "快": None})
+    autovpn.set_ssid_provider(fixture_provider("netsh", [NETSH_FIXTURE.format(ssid="Hotel-WiFi")]))
+    finished = threading.Semaphore(0)
+
+    def traced(*args):
+        select(*args)
+        finished.release()
+    select = autovpn.run_group_select
+    monkeypatch.setattr(autovpn, "run_group_select", traced)
+    watcher = ManualWatcher().start()
+    selector = GroupSelector(timeout=0.1, deadline=0.3)
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=([{"ssids": "Hotel-WiFi", "mode": "Rule", "group": "节点选择"}],
+                                    create_controller(server.url), 3600, None, stop, autovpn._noop, autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                            group_selector=selector)})
+    try:
+        thread.start()
+        assert finished.acquire(timeout=5)
+        assert server.groups["节点选择"]["now"] == "断"
+        server.delays["快"] = 5
+        watcher.notify(settle=False)
+        assert finished.acquire(timeout=5)
+        assert server.groups["节点选择"]["now"] == "快"
+    finally:
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+        selector.close()
+    assert not thread.is_alive()
+
+
+def test_probe_pool_is_created_on_first_use(server):
+    selector = GroupSelector(timeout=0.1, deadline=0.3)
+    assert selector._pool is None  # 没有带 group 的规则时不占用线程
+    selector.close()
+    server.add_group("节点选择", {"快": 1})
+    controller = ClashController(server.url)
+    selector = GroupSelector(timeout=0.1, deadline=0.3)
+    assert selector.select(controller, "节点选择", hotel())["node"] == "快"
+    assert selector._pool is not None
+    selector.close()
+    controller.close()
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("pystray")
+pytest.importorskip("PIL")
+
+from autovpn_gui import LogView
+
+
+class FakeRoot:
+    """只记录 after/after_cancel 的 Tk 根窗口替身，call() 手动触发到期的回调"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.next_id = 0
+
+    def after(self, ms, fn):
+        self.next_id += 1
+        job = f"after#{self.next_id}"
+        self.jobs[job] = fn
+        return job
+
+    def after_cancel(self, job):
+        self.jobs.pop(job, None)
+
+    def call(self):
+        jobs, self.jobs = self.jobs, {}
+        for fn in jobs.values():
+            fn()
+
+
+class FakeText:
+    def __init__(self):
+        self.text = ""
+
+    def insert(self, index, text):
+        self.text += text
+
+    def see(self, index):
+        pass
+
+    def yview(self):
+        return 0.0, 1.0
+
+    def index(self, index):
+        return f"{self.text.count(chr(10)) + 1}.0"
+
+    def delete(self, start, end):
+        pass
+
+    def winfo_exists(self):
+        return True
+
+
+def test_reattach_keeps_a_single_pump():
+    root = FakeRoot()
+    view = LogView(root, interval_ms=10)
+    for _ in range(3):
+        view.attach(FakeText())
+    assert len(root.jobs) == 1
+    for _ in range(5):
+        root.call()
+        assert len(root.jobs) == 1
+    view.detach()
+    assert root.jobs == {}
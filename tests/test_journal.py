@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import autovpn
+from autovpn import EventJournal
+
+
+def fill(journal, count=50):
+    for i in range(count):
+        journal.write({"t": 1000 + i, "kind": "switch" if i % 2 == 0 else "wifi", "level": "info",
+                       "ssid": "Office" if i < 30 else "Home", "msg": f"event {i}"})
+    journal.flush()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    # 每段 20 条、每块 5 条：50 条记录分成 3 段、10 块
+    j = EventJournal(str(tmp_path / "journal"), segment_records=20, block=5, flush_interval=0.01)
+    fill(j)
+    yield j
+    j.close()
+
+
+def times(records):
+    return [r["t"] for r in records]
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """记录查询时实际打开的段文件"""
+    paths = []
+
+    def spy(path, *args, **kwargs):
+        paths.append(os.path.basename(path))
+        return open(path, *args, **kwargs)
+    monkeypatch.setattr(autovpn, "open", spy, raising=False)
+    return paths
+
+
+def test_segments_and_blocks(journal, tmp_path):
+    assert journal.stats() == {"segments": 3, "records": 50, "blocks": 10, "t0": 1000, "t1": 1049}
+    # 写满的段封存时写出索引
+    assert sorted(os.listdir(tmp_path / "journal")) == ["000001.idx", "000001.jsonl", "000002.idx", "000002.jsonl",
+                                                        "000003.jsonl"]
+
+
+def test_field_filter_and_order(journal):
+    assert times(journal.query(kind="switch")) == list(range(1048, 999, -2))
+    assert times(journal.query(kind="wifi", ssid="Home", reverse=False)) == list(range(1031, 1050, 2))
+
+
+def test_time_range_reads_only_overlapping_segments(journal, opened):
+    assert times(journal.query(start=1010, end=1020, reverse=False)) == list(range(1010, 1020))
+    assert opened == ["000001.jsonl"]
+    assert times(journal.query(start=1045)) == list(range(1049, 1044, -1))
+    assert opened[1:] == ["000003.jsonl"]
+
+
+def test_values_missing_from_the_index_skip_all_reads(journal, opened):
+    assert list(journal.query(ssid="Nowhere")) == []
+    assert list(journal.query(start=2000)) == []
+    assert opened == []
+
+
+def test_text_search(journal):
+    assert times(journal.query(text="EVENT 4")) == list(range(1049, 1039, -1)) + [1004]
+    assert times(journal.query(text="event 3", kind="switch", start=1031)) == [1038, 1036, 1034, 1032]
+
+
+def test_results_are_lazy(journal, opened):
+    first = next(journal.query())
+    assert first["t"] == 1049
+    assert opened == ["000003.jsonl"]  # 只取一条时不会去读更早的段
+
+
+def test_reopen_uses_saved_index(journal, tmp_path, opened):
+    journal.close()
+    again = EventJournal(str(tmp_path / "journal"), segment_records=20, block=5)
+    try:
+        assert again.stats() == journal.stats()
+        # 封存的段直接读 .idx，只有最后一段重新扫描
+        assert [p for p in opened if p.endswith(".jsonl")] == ["000003.jsonl"]
+        assert times(again.query(kind="switch", reverse=False)) == list(range(1000, 1050, 2))
+        fill(again, 15)  # 接着写：先补满第 3 段，再开第 4 段
+        assert again.stats()["segments"] == 4 and again.stats()["records"] == 65
+    finally:
+        again.close()
+
+
+def test_reopen_rebuilds_missing_index_and_drops_torn_line(journal, tmp_path):
+    journal.close()
+    directory = tmp_path / "journal"
+    os.remove(directory / "000001.idx")
+    with open(directory / "000003.jsonl", "ab") as f:
+        f.write(b'{"t": 2000, "msg": "cut')  # 写到一半时进程被杀
+    again = EventJournal(str(directory), segment_records=20, block=5)
+    try:
+        assert again.stats() == {"segments": 3, "records": 50, "blocks": 10, "t0": 1000, "t1": 1049}
+        assert times(again.query(end=1003, reverse=False)) == [1000, 1001, 1002]
+        assert (directory / "000003.jsonl").read_bytes().endswith(b"}\n")
+    finally:
+        again.close()
+
+
+def test_old_segments_are_deleted(tmp_path):
+    j = EventJournal(str(tmp_path / "journal"), segment_records=20, block=5, max_segments=2, flush_interval=0.01)
+    try:
+        fill(j)
+        assert j.stats()["segments"] == 2 and j.stats()["t0"] == 1020
+        assert times(j.query(reverse=False))[:2] == [1020, 1021]
+        assert not os.path.exists(tmp_path / "journal" / "000001.jsonl")
+    finally:
+        j.close()
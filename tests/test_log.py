@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from autovpn import LogWriter, read_log_tail
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "app.log"
+
+
+def lines(path):
+    return path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+
+
+def test_rotates_by_line_count(path):
+    writer = LogWriter(str(path), max_lines=5, backups=2, flush_interval=0.01)
+    for i in range(12):
+        writer.write(f"line {i}\n")
+    assert writer.flush()
+    writer.close()
+    assert lines(path) == ["line 10", "line 11"]
+    assert lines(path.with_name("app.log.1")) == [f"line {i}" for i in range(5, 10)]
+    assert lines(path.with_name("app.log.2")) == [f"line {i}" for i in range(5)]
+
+
+def test_rotates_by_size(path):
+    writer = LogWriter(str(path), max_bytes=50, backups=1, flush_interval=0.01)
+    for i in range(7):
+        writer.write(f"{i:018d}\n")  # 每行 19 字节
+        writer.flush()
+    writer.close()
+    assert lines(path) == [f"{6:018d}"]
+    assert lines(path.with_name("app.log.1")) == [f"{i:018d}" for i in range(3, 6)]
+    assert not path.with_name("app.log.2").exists()
+
+
+def test_existing_lines_count_towards_max_lines(path):
+    path.write_text("old 1\nold 2\nold 3\n", encoding="utf-8")
+    writer = LogWriter(str(path), max_lines=5, flush_interval=0.01)
+    for i in range(3):
+        writer.write(f"new {i}\n")
+    writer.close()
+    assert lines(path.with_name("app.log.1")) == ["old 1", "old 2", "old 3", "new 0", "new 1"]
+    assert lines(path) == ["new 2"]
+    assert read_log_tail(str(path), 3) == ["new 0\n", "new 1\n", "new 2\n"]
+
+
+def test_close_drains_the_queue(path):
+    writer = LogWriter(str(path), flush_interval=60)
+    for i in range(100):
+        writer.write(f"line {i}\n")
+    writer.close()
+    assert len(lines(path)) == 100
+
+
+def test_flush_after_close_returns_at_once(path):
+    writer = LogWriter(str(path))
+    writer.write("a\n")
+    writer.close()
+    t0 = time.monotonic()
+    assert not writer.flush(timeout=5)
+    assert time.monotonic() - t0 < 1
+
+
+class BrokenFile:
+    closed = False
+
+    def write(self, text):
+        raise OSError(28, "No space left on device")
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_batch_closes_the_file_and_is_recorded(path):
+    writer = LogWriter(str(path), flush_interval=0.01)
+    writer.write("before\n")
+    writer.flush()
+    broken = writer._file = BrokenFile()  # 写线程空闲时换掉文件
+    writer.write("lost\n")
+    writer.flush()
+    assert broken.closed and writer.failures == 1
+    assert "No space left" in writer.last_error
+    writer.write("after\n")  # 下一批重新打开文件
+    writer.close()
+    assert lines(path) == ["before", "after"]
+
+
+def test_unwritable_path_keeps_the_thread_alive(tmp_path):
+    path = tmp_path / "missing" / "app.log"
+    writer = LogWriter(str(path), flush_interval=0.01)
+    writer.write("lost\n")
+    assert writer.flush()
+    assert writer.failures == 1
+    path.parent.mkdir()
+    writer.write("kept\n")
+    writer.close()
+    assert lines(path) == ["kept"]
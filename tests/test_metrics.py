@@ -0,0 +1,127 @@
+import json
+import re
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import autovpn
+from autovpn import DriftWatcher, ManualWatcher, Metrics, MonitorContext, PollScheduler, create_controller, monitor_loop
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE
+
+# 一行样本：名称、可选的标签、数值；标签值里不能出现未转义的换行和引号
+SAMPLE = re.compile(r'^[a-z_]+(\{([a-z_]+="([^"\\\n]|\\[\\"n])*",?)+\})? [0-9.e+-]+$')
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    m = Metrics()
+    monkeypatch.setattr(autovpn, "_metrics", m)
+    return m
+
+
+def test_prometheus_exposition():
+    m = Metrics()
+    m.inc("autovpn_switches_total", mode="Direct")
+    m.inc("autovpn_switches_total", 2, mode="Direct")
+    m.set("autovpn_mode", 1, mode="Direct")
+    m.observe("autovpn_switch_seconds", 0.003)
+    m.observe("autovpn_switch_seconds", 0.2)
+    lines = m.prometheus().splitlines()
+    assert lines[:2] == ["# TYPE autovpn_switches_total counter", 'autovpn_switches_total{mode="Direct"} 3']
+    assert lines[2:4] == ["# TYPE autovpn_mode gauge", 'autovpn_mode{mode="Direct"} 1']
+    assert "# TYPE autovpn_switch_seconds histogram" in lines
+    assert 'autovpn_switch_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'autovpn_switch_seconds_bucket{le="0.005"} 1' in lines
+    assert 'autovpn_switch_seconds_bucket{le="0.25"} 2' in lines
+    assert 'autovpn_switch_seconds_bucket{le="+Inf"} 2' in lines
+    assert "autovpn_switch_seconds_sum 0.203000" in lines
+    assert "autovpn_switch_seconds_count 2" in lines
+    assert all(SAMPLE.match(line) for line in lines if not line.startswith("#"))
+
+
+def test_label_values_are_escaped():
+    m = Metrics()
+    m.inc("autovpn_ssid_total", ssid='Cafe "5G"\\2\nGuest')
+    line = m.prometheus().splitlines()[1]
+    assert line == r'autovpn_ssid_total{ssid="Cafe \"5G\"\\2\nGuest"} 1'
+    assert SAMPLE.match(line)
+
+
+def test_snapshot_and_http_endpoint(monkeypatch):
+    monkeypatch.setattr(autovpn, "_metrics", None)
+    monkeypatch.setattr(autovpn, "_metrics_server", None)
+    m = autovpn.enable_metrics(port=0)  # 端口 0 不开接口
+    assert autovpn._metrics_server is None
+    m.inc("autovpn_ticks_total", 4)
+    m.observe("autovpn_rule_match_seconds", 0.0004)
+    snap = m.snapshot()
+    assert snap["counters"] == {"autovpn_ticks_total": 4}
+    assert snap["histograms"]["autovpn_rule_match_seconds"] == {"count": 1, "avg": 0.0004, "p50_le": 0.0005,
+                                                                "p99_le": 0.0005}
+    server = FakeClashServer()  # 借用一个空闲端口号
+    port = server.httpd.server_address[1]
+    server.close()
+    autovpn.enable_metrics(port=port)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as resp:
+            assert "autovpn_ticks_total 4" in resp.read().decode("utf-8").splitlines()
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics.json", timeout=2) as resp:
+            assert json.loads(resp.read())["counters"]["autovpn_ticks_total"] == 4
+    finally:
+        autovpn._metrics_server.shutdown()
+        autovpn._metrics_server.server_close()
+
+
+def wrong_seconds(m):
+    return m.counters.get(("autovpn_wrong_mode_seconds_total", ()), 0)
+
+
+def test_wrong_mode_time_counts_from_the_network_change(metrics):
+    current = ["Office-5G"]
+    autovpn.set_ssid_provider(autovpn.SSID_PROVIDERS["netsh"](
+        runner=lambda cmd: NETSH_FIXTURE.format(ssid=current[0])))
+    server = FakeClashServer(mode="rule")
+    watcher = ManualWatcher().start()
+    watcher.settle = 0.3  # 事件合并等待：变化发生 0.3 秒后才开始检查
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=([{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}],
+                                    create_controller(server.url), 3600, None, stop, autovpn._noop, autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600))})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while server.mode != "direct" and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert server.mode == "direct"
+        assert wrong_seconds(metrics) == 0  # 启动时的第一次切换不算
+        current[0] = "Home"
+        watcher.notify()
+        deadline = time.monotonic() + 5
+        while not wrong_seconds(metrics) and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert server.mode == "rule"
+        assert 0.3 <= wrong_seconds(metrics) < 2
+        assert metrics.counters[("autovpn_switches_total", (("mode", "Rule"),))] == 1
+    finally:
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+        server.close()
+
+
+def test_drift_counts_time_since_the_mode_was_last_right(metrics):
+    server = FakeClashServer(mode="direct")
+    drift = DriftWatcher(server.url)
+    drift.expect("Direct")
+    try:
+        assert drift.check() == 0
+        server.change_mode("Global")
+        time.sleep(0.2)
+        assert drift.check() == 1
+        assert 0.2 <= wrong_seconds(metrics) < 2  # 不只是恢复所用的几毫秒
+    finally:
+        drift.stop()
+        server.close()
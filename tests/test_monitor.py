@@ -0,0 +1,31 @@
+import queue
+import threading
+
+import autovpn
+from autovpn import ManualWatcher, MonitorContext, PollScheduler, monitor_loop, create_controller
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE, fixture_provider
+
+
+def test_bad_rule_reports_error_instead_of_killing_the_monitor():
+    server = FakeClashServer()
+    autovpn.set_ssid_provider(fixture_provider("netsh", [NETSH_FIXTURE.format(ssid="Office-5G")]))
+    watcher = ManualWatcher().start()
+    health = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=([{"ssids": "re:(", "mode": "Direct"}], create_controller(server.url), 3600, None,
+                                    stop, lambda text, color: health.put(text), autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600))})
+    try:
+        thread.start()
+        assert health.get(timeout=5) == "运行中"
+        assert health.get(timeout=5) == "异常"
+        assert thread.is_alive()
+    finally:
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+        server.close()
+    assert not thread.is_alive()
+    assert health.get(timeout=1) == "已停止"
+    assert server.requests == []
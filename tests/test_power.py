@@ -0,0 +1,121 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import autovpn
+from autovpn import (LogindSleepSource, ManualWatcher, MonitorContext, PollScheduler, PowerWatcher, create_controller,
+                     monitor_loop)
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE
+
+SLEEP = "/org/freedesktop/login1: org.freedesktop.login1.Manager.PrepareForSleep ({},)\n"
+
+
+class FakeClocks:
+    def __init__(self):
+        self.wall_now = 1_000_000.0
+        self.mono_now = 100.0
+
+    def wall(self):
+        return self.wall_now
+
+    def mono(self):
+        return self.mono_now
+
+    def tick(self, seconds):
+        self.wall_now += seconds
+        self.mono_now += seconds
+
+
+@pytest.fixture
+def clocks():
+    return FakeClocks()
+
+
+def watcher_for(clocks, notify=None, sources=()):
+    return PowerWatcher(notify, sources, period=5, threshold=10, wall=clocks.wall, mono=clocks.mono)
+
+
+def test_logind_signals_report_resume_with_sleep_time(clocks):
+    woke = threading.Event()
+    power = watcher_for(clocks, woke.set)
+    source = LogindSleepSource(stream=io.StringIO(SLEEP.format("true") + "unrelated line\n"))
+    source._reader(power)
+    assert power.suspended_at == clocks.wall_now and not woke.is_set()
+    clocks.wall_now += 3600  # 挂起期间 monotonic 不走
+    source.stream = io.StringIO(SLEEP.format("false"))
+    source._reader(power)
+    assert woke.is_set()
+    assert power.resumes == 1
+    assert power.last_resume == ("logind", 3600)
+
+
+def test_clock_jump_counts_as_resume(clocks):
+    power = watcher_for(clocks)
+    clocks.tick(5)
+    assert not power.check()  # 正常走时
+    clocks.wall_now += 1800
+    assert power.check()
+    assert power.resumes == 1 and power.last_resume[0] == "clock"
+    assert power.last_resume[1] == pytest.approx(1800 - 5)
+
+
+def test_stalled_ticker_counts_as_resume(clocks):
+    # 非 Linux 上挂起期间 monotonic 也在走，表现为检测线程很久没被调度
+    power = watcher_for(clocks)
+    clocks.tick(600)
+    assert power.check()
+    assert power.resumes == 1
+
+
+def test_one_wake_reported_by_two_sources_counts_once(clocks):
+    power = watcher_for(clocks)
+    assert power.resumed("logind")
+    clocks.wall_now += 3600
+    clocks.mono_now += 1
+    assert not power.check()
+    assert power.resumes == 1
+    clocks.tick(60)
+    assert power.resumed("logind")  # 之后的另一次唤醒照常计数
+    assert power.resumes == 2
+
+
+def test_monitor_switches_right_after_resume():
+    current = ["Home"]
+    autovpn.set_ssid_provider(autovpn.SSID_PROVIDERS["netsh"](
+        runner=lambda cmd: NETSH_FIXTURE.format(ssid=current[0])))
+    server = FakeClashServer(mode="global")
+    r, w = os.pipe()
+    signals = os.fdopen(w, "w", buffering=1)
+    watcher = ManualWatcher().start()
+    power = PowerWatcher(lambda: watcher.notify(settle=False), [LogindSleepSource(stream=os.fdopen(r))],
+                         period=3600).start()
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=([{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}],
+                                    create_controller(server.url), 3600, None, stop, autovpn._noop, autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                            power=power)})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while server.mode != "rule" and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert server.mode == "rule"
+        signals.write(SLEEP.format("true"))
+        current[0] = "Office-5G"  # 休眠期间被带到了公司
+        signals.write(SLEEP.format("false"))
+        deadline = time.monotonic() + 2  # 轮询间隔是 1 小时，只有唤醒通知能让它这么快切换
+        while server.mode != "direct" and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert server.mode == "direct"
+        assert power.resumes == 1
+    finally:
+        stop.set()
+        watcher.stop()
+        signals.close()  # 读端收到 EOF 后信号线程自行结束
+        power.stop()
+        thread.join(5)
+        server.close()
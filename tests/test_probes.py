@@ -0,0 +1,59 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from autovpn import ProbeRunner, RuleIndex
+from autovpn_bench import FakeClashServer
+
+
+@pytest.fixture
+def ports():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))  # 只绑定不监听：连接被拒绝
+    yield listener.getsockname()[1], closed.getsockname()[1]
+    listener.close()
+    closed.close()
+
+
+@pytest.fixture
+def slow():
+    server = FakeClashServer(delay=0.5)
+    yield server
+    server.close()
+
+
+def test_decided_rule_does_not_wait_for_slow_probes(ports, slow):
+    open_port, closed_port = ports
+    index = RuleIndex([
+        {"ssids": f"tcp:127.0.0.1:{closed_port}", "mode": "Global"},
+        {"ssids": f"tcp:127.0.0.1:{open_port}", "mode": "Direct"},
+        {"ssids": f"{slow.base}/configs", "mode": "Global"},
+        {"ssids": "*", "mode": "Rule"},
+    ])
+    runner = ProbeRunner(timeout=2.0)
+    t0 = time.monotonic()
+    assert index.lookup("Office", runner)["mode"] == "Direct"
+    assert time.monotonic() - t0 < 0.4
+    assert runner.last["skipped"] == 1
+    runner.close()
+
+
+def test_budget_caps_the_wait_and_late_success_is_reported(slow):
+    index = RuleIndex([{"ssids": f"{slow.base}/configs", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}])
+    woke = threading.Event()
+    runner = ProbeRunner(timeout=2.0, budget=0.1, notify=woke.set)
+    t0 = time.monotonic()
+    assert index.lookup("Office", runner)["mode"] == "Rule"  # 本轮先按不满足处理
+    assert time.monotonic() - t0 < 0.3
+    # 还没完成的探测下一轮接着等，不重复发起
+    assert index.lookup("Office", runner)["mode"] == "Rule"
+    assert woke.wait(2.0)
+    assert runner.late == 1
+    assert index.lookup("Office", runner)["mode"] == "Direct"  # 后台结果已写入缓存
+    assert len(slow.requests) == 1
+    runner.close()
@@ -0,0 +1,73 @@
+import pytest
+
+from autovpn import RuleIndex, match_rule, NetworkFingerprint, validate_config, make_snapshot
+
+
+def baseline_match(ssid, rules):
+    """改造前 match_rule 的逐条子串匹配，作为对照"""
+    ssid_lower = (ssid or "").lower()
+    for rule in rules:
+        ssids = [s.strip().lower() for s in rule["ssids"].split(",")]
+        if "*" in ssids or any(s in ssid_lower for s in ssids if s):
+            return rule["mode"]
+    return None
+
+
+BASELINE_RULES = [
+    {"ssids": "Cafe [5G]", "mode": "Direct"},
+    {"ssids": "AT&T Wi-Fi", "mode": "Global"},
+    {"ssids": "Guest?, Lab*", "mode": "Global"},
+    {"ssids": "公司WiFi,Office-5G", "mode": "Direct"},
+    {"ssids": "*", "mode": "Rule"},
+]
+
+
+@pytest.mark.parametrize("ssid", ["Cafe [5G]", "My Cafe [5G] Guest", "cafe [5g]", "Cafe 5", "Guest?", "Guest1",
+                                  "Lab*2", "Lab-2", "公司WiFi", "xx office-5g", "AT&T Wi-Fi", "T Wi-Fi AT",
+                                  "My AT&T Wi-Fi 5G", "", None])
+def test_bare_items_keep_substring_semantics(ssid):
+    assert match_rule(ssid, BASELINE_RULES) == baseline_match(ssid, BASELINE_RULES)
+
+
+def test_glob_needs_prefix():
+    rules = [{"ssids": "glob:Corp-*", "mode": "Direct"}, {"ssids": "glob:Lab-[0-9]", "mode": "Global"},
+             {"ssids": "*", "mode": "Rule"}]
+    assert match_rule("Corp-HZ", rules) == "Direct"
+    assert match_rule("My Corp-HZ", rules) == "Rule"  # 通配符整串匹配
+    assert match_rule("lab-3", rules) == "Global"
+    assert match_rule("Lab-x", rules) == "Rule"
+
+
+def test_first_matching_rule_wins():
+    rules = [{"ssids": "=Office", "mode": "Global"}, {"ssids": "re:^off", "mode": "Direct"},
+             {"ssids": "Office", "mode": "Rule"}]
+    index = RuleIndex(rules)
+    assert index.match("Office") == "Global"
+    assert index.match("Office-5G") == "Direct"
+    assert index.match("My Office") == "Rule"
+    assert index.match("Home") is None
+
+
+def test_fingerprint_fields_and_compound():
+    rules = [{"ssids": "all:gw:00:11:22:33:44:55&iface:wired", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]
+    dock = NetworkFingerprint(None, None, "00:11:22:33:44:55", "wired")
+    assert match_rule(dock, rules) == "Direct"
+    assert match_rule(dock._replace(iface="wifi"), rules) == "Rule"
+
+
+def test_sub_prefix_matches_prefixed_names_literally():
+    rules = [{"ssids": "sub:=Lab, sub:re:x", "mode": "Global"}, {"ssids": "all:sub:HZ&iface:wired", "mode": "Direct"},
+             {"ssids": "*", "mode": "Rule"}]
+    assert match_rule("My =Lab", rules) == "Global"
+    assert match_rule("re:x-guest", rules) == "Global"
+    assert match_rule("Lab", rules) == "Rule"
+    assert match_rule(NetworkFingerprint("HZ-Office", None, None, "wired"), rules) == "Direct"
+    assert match_rule(NetworkFingerprint("HZ-Office", None, None, "wifi"), rules) == "Rule"
+
+
+@pytest.mark.parametrize("ssids", ["re:(", "tcp:intranet", "all:Office&tcp:10.0.0.5"])
+def test_invalid_rules_fail_validation(ssids):
+    with pytest.raises(ValueError):
+        validate_config({"rules": [{"ssids": ssids, "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]})
+    with pytest.raises(ValueError):
+        make_snapshot({"rules": [{"ssids": ssids, "mode": "Direct"}]})
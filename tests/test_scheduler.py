@@ -0,0 +1,79 @@
+import re
+import socket
+import threading
+import time
+
+import autovpn
+from autovpn import ManualWatcher, MonitorContext, PollScheduler, create_controller, monitor_loop
+from autovpn_bench import NETSH_FIXTURE, fixture_provider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_backoff_doubles_up_to_the_cap():
+    s = PollScheduler(base=15, fast=2, max_backoff=30, rand=lambda: 0.5)  # 0.5 即不抖动
+    delays = [s.update(unreachable=True) for _ in range(6)]
+    assert delays == [2, 4, 8, 16, 30, 30]
+    assert s.state == PollScheduler.BACKOFF and s.failures == 6
+
+
+def test_backoff_jitter_stays_within_bounds():
+    low = PollScheduler(fast=2, jitter=0.2, rand=lambda: 0.0)
+    high = PollScheduler(fast=2, jitter=0.2, rand=lambda: 1.0)
+    for _ in range(3):
+        lo, hi = low.update(unreachable=True), high.update(unreachable=True)
+    assert (round(lo, 6), round(hi, 6)) == (6.4, 9.6)
+
+
+def test_recovery_goes_fast_then_slows_down():
+    s = PollScheduler(base=10, fast=2, max_stable=20, fast_ticks=2, growth=1.5, rand=lambda: 0.5)
+    s.update(unreachable=True)
+    delays = [s.update() for _ in range(6)]
+    assert delays == [2, 2, 10, 15, 20, 20]
+    assert s.failures == 0 and s.state == PollScheduler.STABLE
+    assert s.update(changed=True) == 2  # 网络变化后重新加快
+
+
+def test_boot_grace_retries_at_fast_interval():
+    clock = FakeClock()
+    s = PollScheduler(fast=2, boot_grace=60, clock=clock, rand=lambda: 0.5)
+    assert [s.update(unreachable=True) for _ in range(3)] == [2, 2, 2]
+    clock.now = 61
+    assert s.update(unreachable=True) == 16  # 宽限期过后按累计的失败次数（第 4 次）退避
+
+
+def test_unreachable_failures_are_logged_at_powers_of_two(isolated_log):
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))  # 只绑定不监听：连接被拒绝
+    url = f"http://127.0.0.1:{closed.getsockname()[1]}/configs"
+    autovpn.set_ssid_provider(fixture_provider("netsh", [NETSH_FIXTURE.format(ssid="Office-5G")]))
+    scheduler = PollScheduler(base=0.05, fast=0.01, max_backoff=0.02, jitter=0)
+    watcher = ManualWatcher().start()
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=([{"ssids": "Office-5G", "mode": "Direct"}], create_controller(url), 0.05, None,
+                                    stop, autovpn._noop, autovpn._noop),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=scheduler)})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while scheduler.failures < 10 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+        closed.close()
+    assert scheduler.failures >= 10
+    isolated_log.flush()
+    with open(isolated_log.path, encoding="utf-8") as f:
+        failures = [line for line in f if "失败" in line]
+    counts = [int(m.group(1)) if m else 1 for m in (re.search(r"第 (\d+) 次", line) for line in failures)]
+    assert counts[:4] == [1, 2, 4, 8]
+    assert len(counts) <= 5  # 10 次失败最多记到第 16 次之前
@@ -0,0 +1,91 @@
+import json
+from datetime import datetime
+
+from autovpn import (NetworkFingerprint, SimController, TransitionFilter, _mode_diff, compare_rule_sets, load_timeline,
+                     simulate, simulate_fleet)
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Global"}]
+LAB_RULES = [{"ssids": "Lab", "mode": "Direct"}, {"ssids": "*", "mode": "Global"}]
+
+
+def test_simulate_counts_switches_time_and_writes():
+    events = [(0, "Home"), (10, "Office-5G"), (20, "Office-5G"), (30, None)]
+    result = simulate(events, RULES, end=40)
+    assert result["switches"] == [(0, "Global"), (10, "Direct"), (30, "Global")]
+    assert result["time_in_mode"] == {"Global": 20.0, "Direct": 20.0}
+    assert (result["events"], result["writes"]) == (4, 3)
+
+
+def test_simulate_fingerprints_and_offline_probes():
+    rules = [{"ssids": "gw:00:11:22:33:44:55", "mode": "Direct"},
+             {"ssids": "all:Home&tcp:10.0.0.5:445", "mode": "Rule"}, {"ssids": "*", "mode": "Global"}]
+    dock = NetworkFingerprint(None, None, "00:11:22:33:44:55", "wired")
+    result = simulate([(0, dock), (5, NetworkFingerprint("Home", None, None, "wifi"))], rules)
+    # 回放时探测项按不满足处理
+    assert result["switches"] == [(0, "Direct"), (5, "Global")]
+
+
+def test_simulate_skips_writes_the_controller_already_has():
+    controller = SimController(mode="Global")
+    result = simulate([(0, "Home"), (10, "Office-5G")], RULES, controller=controller)
+    assert result["switches"] == [(0, "Global"), (10, "Direct")]
+    assert result["writes"] == 1 and controller.mode == "Direct"
+
+
+def test_fleet_replays_each_device_with_its_own_filter():
+    timeline = [("x", 0, "Office-5G"), ("x", 10, "Home"), ("x", 60, "Home"), ("y", 0, "Home")]
+    results = simulate_fleet(timeline, RULES, lambda: TransitionFilter(stable=30))
+    assert results["x"]["switches"] == [(0, "Direct"), (40, "Global")]  # 离开后稳定 30 秒到期时切换
+    assert results["y"]["switches"] == [(0, "Global")]
+
+
+def test_mode_diff_intervals():
+    a = [(0, "Direct"), (50, "Global")]
+    b = [(0, "Direct"), (30, "Global"), (80, "Direct")]
+    assert _mode_diff(a, b, 100) == [(30, 50, "Direct", "Global"), (80, 100, "Global", "Direct")]
+    # 相邻且模式相同的时间段合并
+    assert _mode_diff([(0, "Direct")], [(0, "Global"), (10, "Global")], 100) == [(0, 100, "Direct", "Global")]
+    assert _mode_diff([(5, "Direct")], [(0, "Direct")], 20) == [(0, 5, None, "Direct")]
+    assert _mode_diff(a, a, 100) == []
+
+
+def test_compare_rule_sets_reports_disagreement_per_device():
+    timeline = [("a", 0, "Home"), ("a", 60, "Lab"), ("a", 120, "Home"), ("b", 0, "Office-5G"), ("b", 30, "Office-5G")]
+    res_a, res_b, diffs = compare_rule_sets(timeline, RULES, LAB_RULES)
+    assert res_a["a"]["switches"] == [(0, "Global")]
+    assert res_b["a"]["switches"] == [(0, "Global"), (60, "Direct"), (120, "Global")]
+    assert diffs == {"a": [(60, 120, "Global", "Direct")], "b": [(0, 30, "Direct", "Global")]}
+
+
+def test_load_jsonl_timeline(tmp_path):
+    path = tmp_path / "t.jsonl"
+    rows = [{"t": "2026-10-18T09:00:00", "device": "d2", "ssid": "Home"},
+            {"t": 20, "device": "d1", "ssid": "Office-5G", "bssid": "3C-84-6A-AA-BB-CC"},
+            {"t": 10, "device": "d1", "ssid": ""}]
+    path.write_text("\n".join(json.dumps(r) for r in rows) + "\n\n", encoding="utf-8")
+    assert load_timeline(str(path)) == [
+        ("d1", 10.0, None),
+        ("d1", 20.0, NetworkFingerprint("Office-5G", "3c:84:6a:aa:bb:cc", None, None)),
+        ("d2", datetime(2026, 10, 18, 9).timestamp(), "Home"),
+    ]
+
+
+def test_load_csv_timeline(tmp_path):
+    path = tmp_path / "t.csv"
+    path.write_text("t,device,ssid,gateway_mac,iface\n5,pc,,00:11:22:33:44:55,wired\n1,pc,Home,,\n",
+                    encoding="utf-8")
+    assert load_timeline(str(path)) == [
+        ("pc", 1.0, "Home"),
+        ("pc", 5.0, NetworkFingerprint(None, None, "00:11:22:33:44:55", "wired")),
+    ]
+
+
+def test_load_own_log_rolls_over_midnight(tmp_path):
+    path = tmp_path / "autovpn.log"
+    path.write_text("[23:59:50] WiFi: Office-5G（netsh 3.2 ms）\n"
+                    "[23:59:58] 成功 模式切换: Direct\n"
+                    "[00:00:05] WiFi: 未连接\n"
+                    "[00:01:00] WiFi: Home\n", encoding="utf-8")
+    timeline = load_timeline(str(path))
+    assert timeline == [("", 86390.0, "Office-5G"), ("", 86405.0, None), ("", 86460.0, "Home")]
+    assert simulate_fleet(timeline, RULES)[""]["switches"] == [(86390.0, "Direct"), (86405.0, "Global")]
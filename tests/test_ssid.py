@@ -0,0 +1,54 @@
+import sys
+
+import pytest
+
+from autovpn import HelperSSIDProvider, create_ssid_provider
+from autovpn_bench import IW_FIXTURE, NETSH_FIXTURE, NMCLI_FIXTURE, fixture_provider
+
+
+@pytest.mark.parametrize("name, output, ssid, bssid", [
+    ("netsh", NETSH_FIXTURE.format(ssid="Office 5G"), "Office 5G", "3c:84:6a:aa:bb:cc"),
+    ("nmcli", NMCLI_FIXTURE.format(ssid="Office\\:5G"), "Office:5G", "3c:84:6a:aa:bb:cc"),
+    ("iw", IW_FIXTURE.format(ssid="Office 5G"), "Office 5G", None),
+])
+def test_command_providers_parse_recorded_output(name, output, ssid, bssid):
+    provider = fixture_provider(name, [output, ""])
+    assert provider.get() == ssid
+    assert provider.last_bssid == bssid
+    assert provider.get() is None  # 未连接
+    assert provider.last_bssid is None
+    assert provider.stats()["calls"] == 2
+
+
+def test_proc_provider_reads_first_wireless_interface():
+    provider = fixture_provider("proc", [{"wlan0": "Cafe"}, {}])
+    assert provider.get() == "Cafe"
+    assert provider.get() is None
+
+
+def test_failing_backend_reports_disconnected():
+    def broken(cmd):
+        raise OSError("netsh not found")
+    provider = create_ssid_provider("netsh")
+    provider.runner = broken
+    assert provider.get() is None
+    assert provider.calls == 1
+
+
+HELPER = "import sys\nfor line in sys.stdin:\n    print('Office-5G', flush=True)\n"
+
+
+def test_helper_process_is_reused_and_restarted():
+    provider = HelperSSIDProvider([sys.executable, "-c", HELPER])
+    try:
+        assert provider.get() == "Office-5G"
+        pid = provider.proc.pid
+        assert provider.get() == "Office-5G"
+        assert provider.proc.pid == pid  # 常驻进程，不是每次查询都启动
+        provider.proc.kill()
+        provider.proc.wait()
+        assert provider.get() in (None, "Office-5G")  # 写入已退出的进程时本次失败
+        assert provider.get() == "Office-5G"
+        assert provider.proc.pid != pid
+    finally:
+        provider.close()
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+import pytest
+
+import autovpn
+from autovpn import (ManualWatcher, MonitorContext, PollScheduler, controller_identity, create_controller, load_state,
+                     monitor_loop, resume_state, save_state)
+from autovpn_bench import FakeClashServer, NETSH_FIXTURE
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Rule"}]
+
+
+@pytest.fixture
+def fake():
+    autovpn.set_ssid_provider(autovpn.SSID_PROVIDERS["netsh"](
+        runner=lambda cmd: NETSH_FIXTURE.format(ssid="Office-5G")))
+    server = FakeClashServer(mode="direct")
+    yield server
+    server.close()
+
+
+def patches(server):
+    return [path for method, path in server.requests if method == "PATCH"]
+
+
+def state_for(server, network="Office-5G", mode="Direct"):
+    return {"network": [network, None, None], "mode": mode,
+            "controllers": controller_identity(create_controller(server.url)), "updated": "2026-10-01T09:00:00"}
+
+
+def logged(writer):
+    writer.flush()
+    with open(writer.path, encoding="utf-8") as f:
+        return f.read()
+
+
+def run_first_tick(server, state_path):
+    """跑监控线程直到完成第一次决策，返回记录下来的模式回调"""
+    modes = []
+    status = {"ticks": 0}
+    watcher = ManualWatcher().start()
+    stop = threading.Event()
+    thread = threading.Thread(target=monitor_loop, daemon=True,
+                              args=(RULES, create_controller(server.url), 3600, None, stop, autovpn._noop,
+                                    lambda mode, forced: modes.append(mode)),
+                              kwargs={"ctx": MonitorContext(watcher=watcher, scheduler=PollScheduler(3600, 3600),
+                                                            state_path=str(state_path), status=status)})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not status["ticks"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert status["ticks"]
+    finally:
+        stop.set()
+        watcher.stop()
+        thread.join(5)
+    return modes
+
+
+def test_round_trip_and_corrupt_file(tmp_path):
+    path = tmp_path / "state.json"
+    assert load_state(str(path)) == {}  # 第一次启动还没有状态文件
+    assert save_state({"mode": "Direct"}, str(path))
+    assert load_state(str(path)) == {"mode": "Direct"}
+    path.write_text("{truncated", encoding="utf-8")
+    assert load_state(str(path)) == {}
+    path.write_text("[]", encoding="utf-8")
+    assert load_state(str(path)) == {}
+
+
+def test_resume_requires_everything_to_match(fake):
+    api = create_controller(fake.url)
+    state = state_for(fake)
+    assert resume_state(state, "Office-5G", "Direct", api)
+    assert not resume_state({}, "Office-5G", "Direct", api)
+    assert not resume_state(state, "Office-5G", "Rule", api)  # 这次规则要的模式不同
+    assert not resume_state(state, "Hotel-WiFi", "Direct", api)
+    assert not resume_state(dict(state, controllers=["127.0.0.1:1"]), "Office-5G", "Direct", api)
+    fake.change_mode("global")  # 退出后有人手动改过 Clash
+    assert not resume_state(state, "Office-5G", "Direct", api)
+
+
+def test_changed_fingerprint_does_not_resume(fake):
+    api = create_controller(fake.url)
+    office = autovpn.NetworkFingerprint(ssid="Office-5G", bssid="aa:aa:aa:aa:aa:01", gateway_mac="00:11:22:33:44:55",
+                                        iface="wifi")
+    state = dict(state_for(fake), network=autovpn._state_network(office))
+    assert resume_state(state, office, "Direct", api)
+    assert resume_state(state, office._replace(bssid="aa:aa:aa:aa:aa:02"), "Direct", api)  # 同一网络内漫游
+    assert not resume_state(state, office._replace(gateway_mac="66:77:88:99:aa:bb"), "Direct", api)
+    assert not resume_state(state, office._replace(iface="ethernet"), "Direct", api)
+
+
+def test_matching_state_confirms_without_switching(fake, tmp_path, isolated_log):
+    path = tmp_path / "state.json"
+    state = state_for(fake)
+    path.write_text(json.dumps(state), encoding="utf-8")
+    assert run_first_tick(fake, path) == ["Direct"]
+    assert patches(fake) == []
+    assert "与上次一致，保持 Direct" in logged(isolated_log)
+    assert json.loads(path.read_text(encoding="utf-8")) == state  # 没有变化就不重写
+
+
+def test_changed_network_switches_and_rewrites_state(fake, tmp_path, isolated_log):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps(state_for(fake, network="Home", mode="Rule")), encoding="utf-8")
+    fake.change_mode("rule")  # 上次在家里
+    run_first_tick(fake, path)
+    assert patches(fake) == ["/configs"]
+    assert fake.mode == "direct"
+    assert "与上次一致" not in logged(isolated_log)
+    saved = load_state(str(path))
+    assert (saved["network"], saved["mode"]) == (["Office-5G", None, None], "Direct")
+
+
+def test_stale_state_switches_when_clash_was_changed(fake, tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps(state_for(fake)), encoding="utf-8")
+    fake.change_mode("global")
+    run_first_tick(fake, path)
+    assert patches(fake) == ["/configs"]
+    assert fake.mode == "direct"
+
+
+def test_corrupt_state_file_switches_normally(fake, tmp_path, isolated_log):
+    path = tmp_path / "state.json"
+    path.write_text("{truncated", encoding="utf-8")
+    assert run_first_tick(fake, path) == ["Direct"]
+    assert patches(fake) == []  # 控制器本来就是 Direct，按正常流程查询后跳过写入
+    assert "与上次一致" not in logged(isolated_log)
+    saved = load_state(str(path))
+    assert (saved["network"], saved["mode"]) == (["Office-5G", None, None], "Direct")
+    assert saved["controllers"] == controller_identity(create_controller(fake.url))
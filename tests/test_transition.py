@@ -0,0 +1,57 @@
+from autovpn import TransitionFilter, simulate
+from autovpn_bench import flap_timeline
+
+RULES = [{"ssids": "Office-5G", "mode": "Direct"}, {"ssids": "*", "mode": "Global"}]
+
+
+def test_direct_applies_immediately():
+    transition = TransitionFilter(stable=30)
+    result = simulate([(0, "Home"), (100, "Office-5G")], RULES, transition)
+    assert result["switches"] == [(0, "Global"), (100, "Direct")]
+
+
+def test_brief_disconnect_keeps_current_mode():
+    transition = TransitionFilter(stable=30)
+    events = [(0, "Office-5G"), (10, None), (15, None), (20, "Office-5G"), (100, "Office-5G")]
+    result = simulate(events, RULES, transition)
+    assert result["switches"] == [(0, "Direct")]
+    assert result["writes"] == 1
+
+
+def test_leaving_waits_for_stable_window():
+    transition = TransitionFilter(stable=30)
+    events = [(0, "Office-5G"), (10, "Home"), (20, "Office-5G"), (50, "Home"), (200, "Home")]
+    result = simulate(events, RULES, transition)
+    # 10 秒时的离开不到 30 秒就回来了，不切；50 秒起的离开在 80 秒稳定后补一次检查切换
+    assert result["switches"] == [(0, "Direct"), (80, "Global")]
+
+
+def test_switch_rate_is_limited():
+    transition = TransitionFilter(stable=5, max_switches=4, window=300)
+    result = simulate(flap_timeline(600), RULES, transition)
+    switches = result["switches"]
+    for i, (t, mode) in enumerate(switches):
+        if mode != "Direct":
+            # 受限的切换发生前，window 秒内的切换（含直连）少于 max_switches 次
+            assert sum(1 for s, _ in switches[:i] if s + 300 > t) < 4
+            assert i == 0 or t - switches[i - 1][0] >= 5  # 也等过了 stable
+    unfiltered = simulate(flap_timeline(600), RULES)
+    assert len(result["switches"]) < len(unfiltered["switches"])
+
+
+def test_filter_with_fake_clock():
+    now = [0.0]
+    f = TransitionFilter(stable=10, max_switches=1, window=60, clock=lambda: now[0])
+    assert f.decide("Global", "Direct") == "Direct" and f.reason == "stable"
+    assert f.wait_hint() == 10
+    now[0] = 10
+    assert f.decide("Global", "Direct") == "Global"
+    f.record("Global")
+    assert f.decide("Direct", "Global") == "Direct"  # 直连不受频率限制
+    f.record("Direct")
+    now[0] = 30
+    f.decide("Global", "Direct")
+    now[0] = 40
+    assert f.decide("Global", "Direct") == "Direct" and f.reason == "rate"
+    assert f.due() == 70  # 10 秒时的切换移出窗口后才能再切
+    assert f.decide("Global", "Direct", connected=False) == "Direct" and f.reason == "disconnected"
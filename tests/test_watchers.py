@@ -0,0 +1,78 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from autovpn import ManualWatcher, NetlinkWatcher
+
+
+def nlmsg(msg_type, payload=b""):
+    return struct.pack("=IHHII", 16 + len(payload), msg_type, 0, 0, 0) + payload
+
+
+@pytest.fixture
+def netlink():
+    ours, theirs = socket.socketpair()
+    watcher = NetlinkWatcher(sock=ours).start()
+    watcher.settle = 0.05
+    yield watcher, theirs
+    watcher.stop()
+    theirs.close()
+
+
+def test_parse_walks_aligned_messages():
+    data = nlmsg(16, b"x") + b"\0" * 3 + nlmsg(24) + nlmsg(3)
+    assert NetlinkWatcher.parse(data) == [16, 24, 3]
+
+
+def test_link_change_wakes_the_monitor_immediately(netlink):
+    watcher, peer = netlink
+    t0 = time.monotonic()
+    peer.send(nlmsg(16))  # RTM_NEWLINK
+    assert watcher.wait(5)
+    assert time.monotonic() - t0 < 0.5
+    assert watcher.events == 1
+
+
+def test_unrelated_messages_do_not_wake(netlink):
+    watcher, peer = netlink
+    peer.send(nlmsg(3))  # NLMSG_DONE
+    assert not watcher.wait(0.3)
+
+
+def test_closed_source_marks_watcher_dead(netlink):
+    watcher, peer = netlink
+    peer.close()
+    for _ in range(50):
+        if not watcher.alive:
+            break
+        time.sleep(0.02)
+    assert not watcher.alive
+
+
+def test_burst_of_events_is_coalesced():
+    watcher = ManualWatcher().start()
+    watcher.settle = 0.1
+
+    def burst():
+        for _ in range(5):
+            watcher.notify()
+            time.sleep(0.02)
+    threading.Thread(target=burst).start()
+    assert watcher.wait(5)
+    assert watcher.events == 5
+    assert not watcher.wait(0.2)  # 一串事件只唤醒一次
+    watcher.stop()
+
+
+def test_urgent_notify_skips_settle():
+    watcher = ManualWatcher().start()
+    watcher.settle, watcher.max_settle = 1.0, 2.0
+    t0 = time.monotonic()
+    watcher.notify(settle=False)
+    assert watcher.wait(5)
+    assert time.monotonic() - t0 < 0.5
+    watcher.stop()
+    assert not watcher.wait(5)